@@ -0,0 +1,65 @@
+# coding=utf-8
+from threading import Lock
+
+DEFAULT_BATCH_WINDOW = 0.05  # in sec
+DEFAULT_BATCH_SIZE = 50
+
+
+# ------------------------------------------------------------------------------------------------------
+class Batcher:
+    """ Collects operations for up to window seconds or max_size operations and hands them to send as one list,
+        so N board operations cost one message per server instead of N.
+        Batches are sent one after another in the order the operations were added; operations added while a batch
+        is on its way are sent together as soon as it returns, so they don't wait for the window again.
+    """
+
+    def __init__(self, worker_pool, send, window=DEFAULT_BATCH_WINDOW, max_size=DEFAULT_BATCH_SIZE):
+        self.worker_pool = worker_pool
+        # called with the list of collected operations
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.pending = list()
+        # a timed flush is waiting on the scheduler / a flush for a full batch is waiting on the worker pool
+        self.flush_scheduled = False
+        self.flush_requested = False
+        # a batch is on its way, only one at a time, which keeps the batches in order
+        self.sending = False
+        self.lock = Lock()
+
+    def add(self, operation):
+        flush_now = flush_later = False
+        with self.lock:
+            self.pending.append(operation)
+            if self.sending:
+                # flush sends it as soon as the batch on its way returns
+                return
+            if len(self.pending) >= self.max_size:
+                flush_now = not self.flush_requested
+                self.flush_requested = True
+            elif not self.flush_scheduled:
+                flush_later = self.flush_scheduled = True
+        # submitted outside the lock, submit() may block while the worker pool is busy
+        if flush_now:
+            self.worker_pool.submit(self.flush)
+        elif flush_later:
+            self.worker_pool.submit_after_delay(self.window, self.flush)
+
+    def flush(self):
+        with self.lock:
+            self.flush_scheduled = False
+            self.flush_requested = False
+            if self.sending:
+                return
+            self.sending = True
+        while True:
+            with self.lock:
+                batch = self.pending[:self.max_size]
+                del self.pending[:self.max_size]
+                if not batch:
+                    self.sending = False
+                    return
+            try:
+                self.send(batch)
+            except Exception as e:
+                print("[ERROR] Could not send a batch of {} operations: {}".format(len(batch), e))
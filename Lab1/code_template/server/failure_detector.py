@@ -0,0 +1,137 @@
+# coding=utf-8
+import collections
+import math
+import statistics
+import time
+from threading import Lock
+from urllib.parse import quote
+
+DEFAULT_HEARTBEAT_INTERVAL = 1.0  # in sec
+DEFAULT_PHI_THRESHOLD = 8.0
+# number of heartbeat intervals the distribution is estimated from
+WINDOW = 100
+# weight of the newest sample in the round trip time estimates
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+
+# ------------------------------------------------------------------------------------------------------
+class PeerMonitor:
+    """ Heartbeats received from one peer """
+
+    def __init__(self, interval: float):
+        # a peer that never answers is suspected after a few intervals, like one that stopped answering
+        self.last_heartbeat = time.time()
+        # last request of the peer itself, e.g. its own heartbeat; it shows the peer is up but isn't a sample
+        self.last_seen = 0.0
+        self.intervals = collections.deque([interval], maxlen=WINDOW)
+        # the standard deviation used is at least a quarter of the heartbeat interval, so a peer answering
+        # very regularly isn't suspected after the first late heartbeat
+        self.min_std = interval / 4
+        self.heartbeats = 0
+        self.misses = 0
+        # smoothed round trip time and its variation in sec, like TCP's SRTT and RTTVAR
+        self.rtt = None
+        self.rtt_var = None
+
+    def heartbeat(self, rtt: float):
+        now = time.time()
+        if self.heartbeats:
+            self.intervals.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+        self.heartbeats += 1
+        if self.rtt is None:
+            self.rtt, self.rtt_var = rtt, rtt / 2
+        else:
+            self.rtt_var = (1 - RTT_BETA) * self.rtt_var + RTT_BETA * abs(self.rtt - rtt)
+            self.rtt = (1 - RTT_ALPHA) * self.rtt + RTT_ALPHA * rtt
+
+    def phi(self, now: float) -> float:
+        # suspicion level: -log10 of the probability that a heartbeat arrives even later than now, given the
+        # normal distribution of the past intervals (logistic approximation of its CDF, as in Akka)
+        elapsed = now - max(self.last_heartbeat, self.last_seen)
+        mean = statistics.fmean(self.intervals)
+        std = max(statistics.pstdev(self.intervals), self.min_std)
+        # beyond 10 standard deviations phi is far above any threshold (about 38) or 0, and exp would overflow
+        y = min(max((elapsed - mean) / std, -10.0), 10.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+
+class FailureDetector:
+    """ Phi accrual failure detector (Hayashibara et al.): every peer is sent a heartbeat request every interval
+        seconds from the worker pool, and the arrival times of the answers give each peer a suspicion level phi
+        instead of a plain alive/dead. Peers with phi above threshold are suspected; broadcasts skip them instead
+        of waiting for a connect timeout, and their messages go straight to the retries.
+        A request of a suspected peer, see seen, clears the suspicion at once, so a peer that restarted isn't
+        skipped until its next heartbeat answer.
+    """
+
+    def __init__(self, worker_pool, peer_client, peers, interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 threshold=DEFAULT_PHI_THRESHOLD, ip=None):
+        self.worker_pool = worker_pool
+        self.peer_client = peer_client
+        self.interval = interval
+        self.threshold = threshold
+        # heartbeats are sent with this server's ip, if given, so the peers can call seen for it
+        self.uri = '/heartbeat' if ip is None else '/heartbeat?sender={}'.format(quote(ip))
+        # dictionary of shape srv_ip: PeerMonitor
+        self.monitors = {srv_ip: PeerMonitor(interval) for srv_ip in peers}
+        self.lock = Lock()
+
+    def start(self):
+        # every peer has its own heartbeat task, a peer that doesn't answer doesn't delay the others
+        for srv_ip in list(self.monitors):
+            self.worker_pool.submit(self._ping, (srv_ip,))
+
+    def _ping(self, srv_ip):
+        try:
+            start = time.time()
+            # a heartbeat that takes longer than the interval counts as missed
+            res = self.peer_client.request(srv_ip, self.uri, 'GET', timeout=self.interval)
+            if res.status_code == 200:
+                self.heartbeat(srv_ip, time.time() - start)
+        except Exception:
+            with self.lock:
+                self.monitors[srv_ip].misses += 1
+        self.worker_pool.submit_after_delay(self.interval, self._ping, (srv_ip,))
+
+    def heartbeat(self, srv_ip, rtt: float):
+        with self.lock:
+            self.monitors[srv_ip].heartbeat(rtt)
+
+    def seen(self, srv_ip):
+        # srv_ip sent this server a request, so it is up
+        with self.lock:
+            monitor = self.monitors.get(srv_ip)
+            if monitor is not None:
+                monitor.last_seen = time.time()
+
+    def phi(self, srv_ip) -> float:
+        # 0 for servers that aren't monitored
+        with self.lock:
+            monitor = self.monitors.get(srv_ip)
+            return monitor.phi(time.time()) if monitor is not None else 0.0
+
+    def suspected(self, srv_ip) -> bool:
+        return self.phi(srv_ip) > self.threshold
+
+    def rtt(self, srv_ip):
+        # smoothed round trip time in sec, None before the first heartbeat
+        with self.lock:
+            monitor = self.monitors.get(srv_ip)
+            return monitor.rtt if monitor is not None else None
+
+    def metrics(self) -> dict:
+        now = time.time()
+        with self.lock:
+            report = dict()
+            for srv_ip, monitor in self.monitors.items():
+                phi = monitor.phi(now)
+                report[srv_ip] = {'phi': phi, 'suspected': phi > self.threshold,
+                                  'rtt': monitor.rtt, 'rtt_var': monitor.rtt_var,
+                                  'since_heartbeat': now - monitor.last_heartbeat,
+                                  'heartbeats': monitor.heartbeats, 'misses': monitor.misses}
+            return report
@@ -0,0 +1,255 @@
+# coding=utf-8
+import random
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PEER_POOL_SIZE = 4
+CONNECT_TIMEOUT = 2.0  # in sec
+READ_TIMEOUT = 5.0  # in sec
+# weight of the newest sample in the round trip time estimate
+RTT_ALPHA = 0.2
+# retries of a request to a peer that couldn't be reached
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 0.05  # in sec, doubled for every further retry
+# fraction of the requests to a peer that may be retried, plus MIN_RETRIES_PER_SEC
+DEFAULT_RETRY_RATIO = 0.2
+MIN_RETRIES_PER_SEC = 1.0
+MAX_RETRY_TOKENS = 10.0
+# consecutive failures after which the circuit to a peer is opened
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 5.0  # in sec until a trial request is let through
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of sending a request to a peer whose circuit is open """
+
+
+# ------------------------------------------------------------------------------------------------------
+class PeerHealth:
+    """ Outcome of the requests sent to one peer """
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+        # exponentially weighted moving average of the round trip time in sec
+        self.rtt = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures == 0
+
+    def record_success(self, rtt: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        self.rtt = rtt if self.rtt is None else (1 - RTT_ALPHA) * self.rtt + RTT_ALPHA * rtt
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = time.time()
+        self.last_error = error
+
+    def to_dict(self) -> dict:
+        return {'healthy': self.healthy, 'successes': self.successes, 'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures, 'last_success': self.last_success,
+                'last_failure': self.last_failure, 'last_error': self.last_error, 'rtt': self.rtt}
+
+
+class RetryBudget:
+    """ Token bucket limiting the retries to one peer: every request adds ratio tokens and every retry takes one,
+        and min_per_sec tokens are added per second, so a peer that fails every request is retried a few times
+        per second instead of multiplying the load by the number of retries.
+    """
+
+    def __init__(self, ratio=DEFAULT_RETRY_RATIO, min_per_sec=MIN_RETRIES_PER_SEC, max_tokens=MAX_RETRY_TOKENS):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.refilled = time.time()
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.time()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.refilled) * self.min_per_sec)
+        self.refilled = now
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """ Circuit to one peer: closed while requests succeed; opened after threshold consecutive failures, then
+        requests fail at once without being sent; after reset_timeout it is half-open and lets a single trial
+        request through, which closes the circuit if it succeeds and opens it again otherwise.
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trial_running = False
+
+    def record_failure(self) -> bool:
+        # returns True if the circuit was opened by this failure
+        self.consecutive_failures += 1
+        opened = self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.threshold)
+        if opened:
+            self.state = OPEN
+            self.opened_at = time.time()
+        self.trial_running = False
+        return opened
+
+    def to_dict(self) -> dict:
+        return {'state': self.state, 'rejected': self.rejected,
+                'opened_at': self.opened_at if self.state != CLOSED else None}
+
+
+# ------------------------------------------------------------------------------------------------------
+class PeerClient:
+    """ HTTP client keeping one keep-alive connection pool per peer, so messages to a peer reuse open TCP
+        connections instead of paying a new handshake for every request.
+        Every peer has a circuit breaker, so requests to a peer that stopped answering fail at once instead of
+        holding a thread for the timeouts, and a retry budget limiting the retries of contact.
+    """
+
+    def __init__(self, pool_size=DEFAULT_PEER_POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, retry_ratio=DEFAULT_RETRY_RATIO, breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+                 breaker_reset=DEFAULT_BREAKER_RESET):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.retry_ratio = retry_ratio
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        # dictionary of shape server_ip: requests.Session
+        self.sessions = dict()
+        # dictionary of shape server_ip: PeerHealth
+        self.health = dict()
+        # dictionaries of shape server_ip: CircuitBreaker and server_ip: RetryBudget, changed holding self.lock
+        self.breakers = dict()
+        self.budgets = dict()
+        self.lock = Lock()
+
+    def session(self, srv_ip) -> requests.Session:
+        with self.lock:
+            if srv_ip not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                self.sessions[srv_ip] = session
+                self.health[srv_ip] = PeerHealth()
+                self.breakers[srv_ip] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+                self.budgets[srv_ip] = RetryBudget(self.retry_ratio)
+            return self.sessions[srv_ip]
+
+    def request(self, srv_ip, URI, req='POST', params_dict=None, headers=None, timeout=None) -> requests.Response:
+        # sends the request and returns the response; raises if the peer can't be reached
+        # params_dict is sent form encoded, unless it is already encoded as bytes (set the Content-Type in headers)
+        # timeout in sec overrides the connect and read timeouts of the client
+        # raises CircuitOpenError without sending anything while the circuit to the peer is open
+        session = self.session(srv_ip)
+        with self.lock:
+            if not self.breakers[srv_ip].allow():
+                raise CircuitOpenError('Circuit to server {} is open'.format(srv_ip))
+            self.budgets[srv_ip].deposit()
+        timeout = timeout or self.timeout
+        start = time.time()
+        try:
+            if 'POST' in req:
+                res = session.post('http://{}{}'.format(srv_ip, URI), data=params_dict, headers=headers,
+                                   timeout=timeout)
+            else:
+                res = session.get('http://{}{}'.format(srv_ip, URI), headers=headers, timeout=timeout)
+        except Exception as e:
+            with self.lock:
+                self.health[srv_ip].record_failure(str(e))
+                opened = self.breakers[srv_ip].record_failure()
+            if opened:
+                print("[WARNING ]Circuit to server {} opened, retrying in {}s".format(srv_ip, self.breaker_reset))
+            raise
+        with self.lock:
+            self.health[srv_ip].record_success(time.time() - start)
+            self.breakers[srv_ip].record_success()
+        return res
+
+    def contact(self, srv_ip, URI, req='POST', params_dict=None, headers=None) -> bool:
+        # retries if the peer couldn't be reached, as long as the retry budget of the peer allows; a read timeout
+        # isn't retried, the peer may have handled the request already
+        attempt = 0
+        while True:
+            try:
+                res = self.request(srv_ip, URI, req, params_dict, headers)
+                # result can be accessed res.json()
+                return res.status_code == 200
+            except CircuitOpenError:
+                return False
+            except requests.ConnectionError as e:
+                with self.lock:
+                    retry = attempt < self.retries and self.budgets[srv_ip].withdraw()
+                if not retry:
+                    print("[ERROR] " + str(e))
+                    return False
+            except Exception as e:
+                print("[ERROR] " + str(e))
+                return False
+            # jitter, so the retries of several threads don't arrive together
+            time.sleep(random.uniform(0.5, 1) * RETRY_BACKOFF * 2 ** attempt)
+            attempt += 1
+
+    def reachable(self, srv_ip):
+        # srv_ip sent this server a request, so it is up: its circuit is closed without waiting for a trial request
+        with self.lock:
+            breaker = self.breakers.get(srv_ip)
+            if breaker is not None:
+                breaker.record_success()
+
+    def health_report(self) -> dict:
+        with self.lock:
+            report = {srv_ip: health.to_dict() for srv_ip, health in self.health.items()}
+            for srv_ip, health in report.items():
+                health['circuit'] = self.breakers[srv_ip].to_dict()
+                health['retry_tokens'] = self.budgets[srv_ip].tokens
+                health['retries_denied'] = self.budgets[srv_ip].exhausted
+            return report
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
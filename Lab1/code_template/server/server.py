@@ -1,33 +1,114 @@
 # coding=utf-8
 import argparse
+import bisect
 import json
 import sys
-from threading import Lock, Thread
-import time
+from threading import Lock
+from types import MappingProxyType
 import traceback
 import bottle
-from bottle import Bottle, request, template, run, static_file
-import requests
+from bottle import Bottle, HTTPResponse, request, response, template, run, static_file
+from batching import Batcher, DEFAULT_BATCH_WINDOW, DEFAULT_BATCH_SIZE
+from board_changes import ChangeLog, INSERT, UPDATE, REMOVE
+from event_stream import Subscription, ThreadStreams, async_streams, stream_response, MAX_THREAD_STREAMS
+from failure_detector import FailureDetector, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_PHI_THRESHOLD
+from fanout import FanOut, DEFAULT_MAX_CONCURRENCY
+from journal import Journal, DEFAULT_FSYNC_INTERVAL, DEFAULT_SNAPSHOT_EVERY
+from peer_client import (PeerClient, DEFAULT_PEER_POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, DEFAULT_RETRIES,
+                         DEFAULT_RETRY_RATIO, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_RESET)
+from render_cache import RenderCache
+from server_adapters import SERVER_MODES, DEFAULT_POOL_SIZE
+from worker_pool import WorkerPool, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
 
 
 # ------------------------------------------------------------------------------------------------------
 
 class Blackboard:
+    """ Ordered map of element id: entry. The ids are kept in a sorted list next to the dict, so a write finds its
+        position with a bisect instead of copying the whole board.
+    """
 
-    def __init__(self):
+    def __init__(self, journal=None):
         self.content = dict()
+        # sorted list of the keys of self.content, the order of the board
+        self.keys = list()
         self.counter = 0
         self.lock = Lock()  # use lock when you modify the content
+        # write-ahead log of every change, None if the board is only kept in memory
+        self.journal = journal
+        # version of the board and the changes browsers still have to apply
+        self.changes = ChangeLog()
+        # tuple of (version, read-only view of a copy of the content)
+        self.snapshot = (self.changes.version, MappingProxyType(dict()))
 
     def get_content(self):
+        # immutable snapshot of the content, see get_versioned_content
+        return self.get_versioned_content()[1]
+
+    def get_versioned_content(self):
+        # the version and an immutable snapshot of the content. Writers change the content in place and only bump
+        # the version; readers of an unchanged board never wait for the lock. The first reader after a write
+        # captures the keys and content with two C-level copies under the lock and builds the ordered snapshot
+        # outside of it, so writers wait only for the capture (about 1 of 10 ms at 100k entries). The snapshot
+        # still costs O(n) once per version, and readers racing on the same version may each build one
+        snapshot = self.snapshot
+        if snapshot[0] == self.changes.version:
+            return snapshot
+        with self.lock:
+            version, keys, content = self.changes.version, list(self.keys), dict(self.content)
+        snapshot = (version, MappingProxyType({key: content[key] for key in keys}))
+        with self.lock:
+            # a reader that captured a later version may have published first
+            if self.snapshot[0] < version:
+                self.snapshot = snapshot
+        return snapshot
+
+    def get_changes(self, since: int, epoch: str) -> dict:
+        with self.lock:
+            return self.changes.delta(since, epoch)
+
+    def subscribe(self, since: int, epoch: str) -> Subscription:
+        with self.lock:
+            return self.changes.subscribe(since, epoch)
+
+    def restore(self):
+        # loads the latest snapshot of the journal and replays the records after it
+        journal, self.journal = self.journal, None
+        state, records = journal.load()
+        if state is not None:
+            with self.lock:
+                self.content = dict(zip(state['keys'], state['values']))
+                self.keys = sorted(self.content)
+                self.counter = state['counter']
+        for record in records:
+            if record[0] == 'add':
+                self.add_content(record[1])
+            elif record[0] == 'set':
+                self.set_content(record[1], record[2])
+            elif record[0] == 'del':
+                self.del_content(record[1])
+            elif record[0] == 'ops':
+                self.apply_operations(record[1])
         with self.lock:
-            cnt = self.content
-        return cnt
+            # browsers showing an older version have to reload the board
+            self.changes.reset()
+        self.journal = journal
+        print('Restored {} entries ({} records replayed)'.format(len(self.content), len(records)))
+
+    def _state(self) -> dict:
+        # call with the lock held; a copy of the board for a snapshot of the journal
+        return {'keys': list(self.keys), 'values': [self.content[key] for key in self.keys], 'counter': self.counter}
+
+    def _journal(self, record: list):
+        # call with the lock held, after the change was applied
+        if self.journal is not None and self.journal.append(record):
+            self.journal.snapshot(self._state())
 
     def add_content(self, new_entry):
         with self.lock:
-            self.content[self.counter] = new_entry
+            self._set(self.counter, new_entry)
             self.counter += 1
+            self._journal(['add', new_entry])
         return
 
     def set_content(self, index, new_content):
@@ -36,119 +117,231 @@ class Blackboard:
                 self.counter += 1
                 if index is None:
                     index = self.counter - 1
-            self.content[index] = new_content
+            self._set(index, new_content)
+            self._journal(['set', index, new_content])
         return
 
     def del_content(self, index):
         with self.lock:
-            self.content.pop(index)
+            self._pop(index)
+            self._journal(['del', index])
+        return
+
+    def apply_operations(self, operations):
+        # applies propagated operations of shape {'delete': ..., 'element_id': ..., 'entry': ...} in order,
+        # acquiring the lock only once for the whole batch
+        with self.lock:
+            for op in operations:
+                if op['delete'] == '1':
+                    if int(op['element_id']) in self.content:
+                        self._pop(int(op['element_id']))
+                elif op['element_id'] is None:
+                    self._set(self.counter, op['entry'])
+                    self.counter += 1
+                else:
+                    index = int(op['element_id'])
+                    if index not in self.content:
+                        self.counter += 1
+                    self._set(index, op['entry'])
+            self._journal(['ops', operations])
         return
 
+    def _set(self, index, entry):
+        # call with the lock held; the board is ordered by id, the position of the entry is a bisect of the keys
+        position = bisect.bisect_left(self.keys, index)
+        if index in self.content:
+            self.changes.record(UPDATE, position, index, entry)
+        else:
+            self.keys.insert(position, index)
+            self.changes.record(INSERT, position, index, entry)
+        self.content[index] = entry
+
+    def _pop(self, index):
+        # call with the lock held, raises KeyError if there is no entry at index
+        self.content.pop(index)
+        position = bisect.bisect_left(self.keys, index)
+        del self.keys[position]
+        self.changes.record(REMOVE, position, index)
+
 
 # ------------------------------------------------------------------------------------------------------
 class Server(Bottle):
 
-    def __init__(self, ID, IP, servers_list):
+    def __init__(self, ID, IP, servers_list, peer_client=None, fan_out=None, worker_pool=None,
+                 batch_window=DEFAULT_BATCH_WINDOW, batch_size=DEFAULT_BATCH_SIZE, journal=None,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, phi_threshold=DEFAULT_PHI_THRESHOLD,
+                 max_thread_streams=MAX_THREAD_STREAMS):
         super(Server, self).__init__()
-        self.blackboard = Blackboard()
+        self.blackboard = Blackboard(journal)
+        if journal is not None:
+            self.blackboard.restore()
         self.id = int(ID)
         self.ip = str(IP)
+        # keep-alive connections to the other servers, shared by all outgoing messages
+        self.peer_client = peer_client or PeerClient()
+        # parallel broadcasts to the other servers
+        self.fan_out = fan_out or FanOut()
+        # threads running all background tasks
+        self.worker_pool = worker_pool or WorkerPool()
+        # pages rendered from the blackboard, by version of the blackboard
+        self.render_cache = RenderCache()
+        # /board/stream clients held by request threads, the browsers only stream if the server runs asyncio
+        self.thread_streams = ThreadStreams(max_thread_streams)
+        # board operations waiting to be propagated together
+        self.batcher = Batcher(self.worker_pool, self.propagate_operations, window=batch_window, max_size=batch_size)
         self.servers_list = servers_list
+        # suspicion level of every other server from heartbeats
+        self.failure_detector = FailureDetector(self.worker_pool, self.peer_client,
+                                                [srv_ip for srv_ip in servers_list if srv_ip != self.ip],
+                                                interval=heartbeat_interval, threshold=phi_threshold)
+        self.failure_detector.start()
         # list all REST URIs
         # if you add new URIs to the server, you need to add them here
         self.route('/', callback=self.index)
         self.get('/board', callback=self.get_board)
+        # changes of the board since the version a browser shows
+        self.get('/board/changes', callback=self.get_board_changes)
+        # server-sent events with the changes of the board
+        self.get('/board/stream', callback=self.get_board_stream)
         self.post('/board', callback=self.post_board)
         self.post('/board/<element_id:int>/', callback=self.post_modify)
         # we give access to the templates elements
         self.get('/templates/<filename:path>', callback=self.get_template)
+        # health of the connections to the other servers
+        self.get('/stats', callback=self.get_stats)
+        # the failure detectors of the other servers check that this server is alive
+        self.get('/heartbeat', callback=self.get_heartbeat)
         self.post('/propagate', callback=self.post_propagate)
         # You can have variables in the URI, here's an example self.post('/board/<element_id:int>/',
         # callback=self.post_board) where post_board takes an argument (integer) called element_id
 
     def do_parallel_task(self, method, args=None):
-        # create a thread running a new task Usage example: self.do_parallel_task(self.contact_another_server,
-        # args=("10.1.0.2", "/index", "POST", params_dict)) this would start a thread sending a post request to
-        # server 10.1.0.2 with URI /index and with params params_dict
-        thread = Thread(target=method,
-                        args=args)
-        thread.daemon = True
-        thread.start()
+        # run a task on the worker pool Usage example: self.do_parallel_task(self.contact_another_server,
+        # args=("10.1.0.2", "/index", "POST", params_dict)) this would send a post request to
+        # server 10.1.0.2 with URI /index and with params params_dict from one of the pool's threads
+        self.worker_pool.submit(method, args)
 
     def do_parallel_task_after_delay(self, delay, method, args=None):
-        # create a thread, and run a task after a specified delay
+        # run a task on the worker pool after a specified delay
         # Usage example: self.do_parallel_task_after_delay(10, self.start_election, args=(,))
-        # this would start a thread starting an election after 10 seconds
-        thread = Thread(target=self._wrapper_delay_and_execute,
-                        args=(delay, method, args))
-        thread.daemon = True
-        thread.start()
-
-    def _wrapper_delay_and_execute(self, delay, method, args):
-        time.sleep(delay)  # in sec
-        method(*args)
+        # this would start an election after 10 seconds
+        self.worker_pool.submit_after_delay(delay, method, args)
 
     def contact_another_server(self, srv_ip, URI, req='POST', params_dict=None):
-        # Try to contact another serverthrough a POST or GET
+        # Try to contact another server through a POST or GET, reusing the pooled connections to that server
         # usage: server.contact_another_server("10.1.1.1", "/index", "POST", params_dict)
-        success = False
-        try:
-            if 'POST' in req:
-                res = requests.post('http://{}{}'.format(srv_ip, URI),
-                                    data=params_dict)
-            elif 'GET' in req:
-                res = requests.get('http://{}{}'.format(srv_ip, URI))
-            # result can be accessed res.json()
-            if res.status_code == 200:
-                success = True
-        except Exception as e:
-            print("[ERROR] " + str(e))
-        return success
+        return self.peer_client.contact(srv_ip, URI, req, params_dict)
 
-    def propagate_to_all_servers(self, URI='/propagate', req='POST', params_dict=None):
-        for srv_ip in self.servers_list:
-            if srv_ip != self.ip:  # don't propagate to yourself
-                success = self.contact_another_server(srv_ip, URI, req, params_dict)
-                if not success:
-                    print("[WARNING ]Could not contact server {}".format(srv_ip))
+    def propagate_to_all_servers(self, URI='/propagate', req='POST', params_dict=None) -> dict:
+        # contacts all other servers in parallel and returns a dictionary of shape server_ip: success, None for
+        # the servers that didn't answer in time and may still apply the message, see FanOut.broadcast
+        # servers suspected by the failure detector count as failed without waiting for a timeout
+        peers = [srv_ip for srv_ip in self.servers_list if srv_ip != self.ip]  # don't propagate to yourself
+        suspected = [srv_ip for srv_ip in peers if self.failure_detector.suspected(srv_ip)]
+        results = self.fan_out.broadcast([srv_ip for srv_ip in peers if srv_ip not in suspected],
+                                         lambda srv_ip: self.contact_another_server(srv_ip, URI, req, params_dict))
+        for srv_ip, success in results.items():
+            if success is None:
+                print("[WARNING ]No answer of server {} in time, it may still apply the message".format(srv_ip))
+            elif not success:
+                print("[WARNING ]Could not contact server {}".format(srv_ip))
+        for srv_ip in suspected:
+            print("[WARNING ]Skipping suspected server {}".format(srv_ip))
+            results[srv_ip] = False
+        return results
+
+    def propagate_operations(self, operations):
+        # one message per server for the whole batch
+        self.propagate_to_all_servers('/propagate', 'POST', {'batch': json.dumps(operations)})
 
     # post to ('/propagate')
     def post_propagate(self):
-        element_id = request.forms.get('element_id')
-        entry = request.forms.get('entry')
-        delete = request.forms.get('delete')
-        li = request.forms.get('list')
-        listt = json.loads(li)
-        listt [1] = 222
-        print(listt)
-        if delete == '1':
-            self.blackboard.del_content(int(element_id))
-        elif element_id is None:
-            self.blackboard.add_content(new_entry=entry)
+        # a batch is sent as json list of operations, a single operation as form fields
+        batch = request.forms.get('batch')
+        if batch is not None:
+            operations = json.loads(batch)
         else:
-            self.blackboard.set_content(index=int(element_id), new_content=entry)
+            operations = [{'delete': request.forms.get('delete'),
+                           'element_id': request.forms.get('element_id'),
+                           'entry': request.forms.get('entry')}]
+        self.blackboard.apply_operations(operations)
+
+    def board_page(self, name: str, render, *key):
+        # the page rendered from the current version of the blackboard, render(board, version) is only called if
+        # the page isn't in the render cache yet; key are the other values the page depends on
+        # returns the version and the page
+        version = self.blackboard.changes.version
+        page = self.render_cache.get((name, version) + key)
+        if page is None:
+            # we must transform the blackboard as a dict for compatibility reasons
+            version, board = self.blackboard.get_versioned_content()
+            page = self.render_cache.put((name, version) + key, render(board, version))
+        return version, page
 
     # route to ('/')
     def index(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
-        return template('server/templates/index.tpl',
-                        board_title='Server {} ({})'.format(self.id,
-                                                            self.ip),
-                        board_dict=board.items(),
-                        members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        board_title = 'Server {} ({})'.format(self.id, self.ip)
+        # browsers open /board/stream only if an open stream doesn't hold a request thread
+        stream = async_streams(request.environ)
+
+        def render(board, version):
+            return template('server/templates/index.tpl',
+                            board_title=board_title,
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream,
+                            members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        return self.board_page('index', render, board_title, stream)[1].send()
 
     # get on ('/board')
     def get_board(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
-        print(self.blackboard.get_content())
-        return template('server/templates/blackboard.tpl',
-                        board_title='Server {} ({})'.format(self.id,
-                                                            self.ip),
-                        board_dict=board.items())
+        # browsers revalidate the board on every reload and get 304 Not Modified if it didn't change
+        etag = self.blackboard.changes.etag(self.blackboard.changes.version)
+        if request.get_header('If-None-Match') == etag:
+            return HTTPResponse(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+        def render(board, version):
+            return template('server/templates/blackboard.tpl',
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream)
+        stream = async_streams(request.environ)
+        version, page = self.board_page('board', render, stream)
+        response.set_header('ETag', self.blackboard.changes.etag(version))
+        response.set_header('Cache-Control', 'no-cache')
+        return page.send()
+
+    # get on ('/board/changes')
+    def get_board_changes(self):
+        # ?since=<version>&epoch=<epoch> of the board shown by the browser, see board_changes.ChangeLog
+        try:
+            since = int(request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        response.set_header('Cache-Control', 'no-cache')
+        return self.blackboard.get_changes(since, request.query.get('epoch'))
+
+    # get on ('/board/stream')
+    def get_board_stream(self):
+        # every change of the board after ?since=<version>&epoch=<epoch> as it is applied,
+        # a reconnecting browser continues after the Last-Event-ID it received
+        try:
+            since = int(request.get_header('Last-Event-ID') or request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        threaded = not async_streams(request.environ)
+        if threaded and not self.thread_streams.acquire():
+            # every stream holds a request thread until THREAD_STREAM_DURATION; the browser polls /board/changes
+            response.status = 503
+            return 'too many streams, poll /board/changes'
+        response.content_type = 'text/event-stream'
+        response.set_header('Cache-Control', 'no-cache')
+        subscription = self.blackboard.subscribe(since, request.query.get('epoch'))
+        if threaded:
+            subscription.when_closed(self.thread_streams.release)
+        return stream_response(request.environ, subscription)
 
     # post on ('/board')
     def post_board(self):
@@ -157,11 +350,7 @@ class Server(Bottle):
             new_entry = request.forms.get('entry')
             self.blackboard.add_content(new_entry=new_entry)
             print("Received: {}".format(new_entry))
-            l = [1, 0, 0, 1]
-            li = json.dumps(l)
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST',
-                                        {'delete': '0', 'element_id': None, 'entry': new_entry, 'list': li}))
+            self.batcher.add({'delete': '0', 'element_id': None, 'entry': new_entry})
         except Exception as e:
             print("[ERROR] " + str(e))
 
@@ -176,12 +365,24 @@ class Server(Bottle):
             else:
                 self.blackboard.del_content(index=element_id)
             print("Received: {}".format(new_entry))
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST',
-                                        {'delete': delete, 'element_id': element_id, 'entry': new_entry}))
+            self.batcher.add({'delete': delete, 'element_id': element_id, 'entry': new_entry})
         except Exception as e:
             print("[ERROR] " + str(e))
 
+    # get on ('/heartbeat')
+    def get_heartbeat(self):
+        return 'ok'
+
+    # get on ('/stats')
+    def get_stats(self):
+        return {'peers': self.peer_client.health_report(),
+                'failure_detector': self.failure_detector.metrics(),
+                'workers': self.worker_pool.metrics(),
+                'streams': len(self.blackboard.changes.subscribers),
+                'thread_streams': self.thread_streams.metrics(),
+                'render_cache': self.render_cache.metrics(),
+                'journal': self.blackboard.journal.metrics() if self.blackboard.journal is not None else None}
+
     def get_template(self, filename):
         return static_file(filename, root='./server/templates/')
 
@@ -201,18 +402,175 @@ def main():
                         dest='srv_list',
                         default="10.1.0.1,10.1.0.2",
                         help='List of all servers present in the network')
+    parser.add_argument('--server-mode',
+                        nargs='?',
+                        dest='server_mode',
+                        default='threadpool',
+                        choices=sorted(SERVER_MODES),
+                        help='How requests are served: wsgiref (one at a time), threadpool or asyncio '
+                             '(idle /board/stream clients don\'t hold a thread)')
+    parser.add_argument('--server-threads',
+                        nargs='?',
+                        dest='server_threads',
+                        default=DEFAULT_POOL_SIZE,
+                        type=int,
+                        help='Number of threads serving requests in threadpool and asyncio mode')
+    parser.add_argument('--max-thread-streams',
+                        nargs='?',
+                        dest='max_thread_streams',
+                        default=MAX_THREAD_STREAMS,
+                        type=int,
+                        help='Number of /board/stream clients served at the same time in threadpool mode, every one '
+                             'holds a request thread; more are refused. None in wsgiref mode, a stream would block '
+                             'the server')
+    parser.add_argument('--peer-pool-size',
+                        nargs='?',
+                        dest='peer_pool_size',
+                        default=DEFAULT_PEER_POOL_SIZE,
+                        type=int,
+                        help='Number of keep-alive connections kept open to every other server')
+    parser.add_argument('--connect-timeout',
+                        nargs='?',
+                        dest='connect_timeout',
+                        default=CONNECT_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for a connection to another server')
+    parser.add_argument('--read-timeout',
+                        nargs='?',
+                        dest='read_timeout',
+                        default=READ_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for the answer of another server')
+    parser.add_argument('--retries',
+                        nargs='?',
+                        dest='retries',
+                        default=DEFAULT_RETRIES,
+                        type=int,
+                        help='Retries of a message to another server that could not be reached')
+    parser.add_argument('--retry-ratio',
+                        nargs='?',
+                        dest='retry_ratio',
+                        default=DEFAULT_RETRY_RATIO,
+                        type=float,
+                        help='Fraction of the messages to another server that may be retried')
+    parser.add_argument('--breaker-threshold',
+                        nargs='?',
+                        dest='breaker_threshold',
+                        default=DEFAULT_BREAKER_THRESHOLD,
+                        type=int,
+                        help='Consecutive failures after which messages to another server fail at once')
+    parser.add_argument('--breaker-reset',
+                        nargs='?',
+                        dest='breaker_reset',
+                        default=DEFAULT_BREAKER_RESET,
+                        type=float,
+                        help='Seconds until another server is tried again after its circuit was opened')
+    parser.add_argument('--fanout-concurrency',
+                        nargs='?',
+                        dest='fanout_concurrency',
+                        default=DEFAULT_MAX_CONCURRENCY,
+                        type=int,
+                        help='Maximum number of servers contacted at the same time during a broadcast')
+    parser.add_argument('--fanout-deadline',
+                        nargs='?',
+                        dest='fanout_deadline',
+                        default=None,
+                        type=float,
+                        help='Seconds after which a server that hasn\'t answered a broadcast counts as failed')
+    parser.add_argument('--workers',
+                        nargs='?',
+                        dest='workers',
+                        default=DEFAULT_WORKERS,
+                        type=int,
+                        help='Number of threads running background tasks')
+    parser.add_argument('--task-queue-size',
+                        nargs='?',
+                        dest='task_queue_size',
+                        default=DEFAULT_MAX_QUEUE,
+                        type=int,
+                        help='Maximum number of waiting background tasks before requests are slowed down')
+    parser.add_argument('--batch-window',
+                        nargs='?',
+                        dest='batch_window',
+                        default=DEFAULT_BATCH_WINDOW,
+                        type=float,
+                        help='Seconds board operations are collected before they are propagated together')
+    parser.add_argument('--batch-size',
+                        nargs='?',
+                        dest='batch_size',
+                        default=DEFAULT_BATCH_SIZE,
+                        type=int,
+                        help='Maximum number of board operations propagated in one message')
+    parser.add_argument('--data-dir',
+                        nargs='?',
+                        dest='data_dir',
+                        default=None,
+                        help='Directory of the write-ahead log and snapshots of the board, '
+                             'the board is only kept in memory if not given')
+    parser.add_argument('--fsync-interval',
+                        nargs='?',
+                        dest='fsync_interval',
+                        default=DEFAULT_FSYNC_INTERVAL,
+                        type=float,
+                        help='Seconds board changes are collected before they are written and fsynced together, '
+                             'at most this window is lost in a crash')
+    parser.add_argument('--snapshot-every',
+                        nargs='?',
+                        dest='snapshot_every',
+                        default=DEFAULT_SNAPSHOT_EVERY,
+                        type=int,
+                        help='Number of logged changes after which a snapshot of the board is written')
+    parser.add_argument('--heartbeat-interval',
+                        nargs='?',
+                        dest='heartbeat_interval',
+                        default=DEFAULT_HEARTBEAT_INTERVAL,
+                        type=float,
+                        help='Seconds between two heartbeats sent to every other server')
+    parser.add_argument('--phi-threshold',
+                        nargs='?',
+                        dest='phi_threshold',
+                        default=DEFAULT_PHI_THRESHOLD,
+                        type=float,
+                        help='Suspicion level (phi) above which another server is treated as failed')
     args = parser.parse_args()
     server_id = args.id
     server_ip = "10.1.0.{}".format(server_id)
     servers_list = args.srv_list.split(",")
 
     try:
+        peer_client = PeerClient(pool_size=args.peer_pool_size,
+                                 connect_timeout=args.connect_timeout,
+                                 read_timeout=args.read_timeout,
+                                 retries=args.retries,
+                                 retry_ratio=args.retry_ratio,
+                                 breaker_threshold=args.breaker_threshold,
+                                 breaker_reset=args.breaker_reset)
+        worker_pool = WorkerPool(workers=args.workers, max_queue=args.task_queue_size)
+        journal = Journal(args.data_dir,
+                          worker_pool,
+                          fsync_interval=args.fsync_interval,
+                          snapshot_every=args.snapshot_every) if args.data_dir else None
         server = Server(server_id,
                         server_ip,
-                        servers_list)
+                        servers_list,
+                        peer_client=peer_client,
+                        fan_out=FanOut(max_concurrency=args.fanout_concurrency,
+                                       deadline=args.fanout_deadline),
+                        worker_pool=worker_pool,
+                        batch_window=args.batch_window,
+                        batch_size=args.batch_size,
+                        journal=journal,
+                        heartbeat_interval=args.heartbeat_interval,
+                        phi_threshold=args.phi_threshold,
+                        # a stream in wsgiref mode would hold the only thread serving requests
+                        max_thread_streams=0 if args.server_mode == 'wsgiref' else args.max_thread_streams)
         bottle.run(server,
+                   server=SERVER_MODES[args.server_mode],
                    host=server_ip,
-                   port=PORT)
+                   port=PORT,
+                   pool_size=args.server_threads)
+        if journal is not None:
+            journal.close()
     except Exception as e:
         print("[ERROR] " + str(e))
 
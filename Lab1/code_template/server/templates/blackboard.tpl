@@ -1,4 +1,4 @@
-                    <div id="boardcontents_placeholder">
+                    <div id="boardcontents_placeholder" data-epoch="{{board_epoch}}" data-version="{{board_version}}"{{!' data-stream' if board_stream else ''}}>
                     <div class="row">
                     <!-- this place will show the actual contents of the blackboard. 
                     It will be reloaded automatically from the server -->
@@ -9,6 +9,7 @@
                             <div class="card-body">
                                 <input type="text" name="id" value="ID" readonly>
                                 <input type="text" name="entry" value="Entry" size="70%%" readonly>
+                                <div id="board_entries">
                                 % for board_entry, board_element in board_dict:
                                     <form class="entryform" target="noreload" method="post" action="/board/{{board_entry}}/">
                                         <input type="text" name="id" value="{{board_entry}}" readonly disabled> <!-- disabled field won’t be sent -->
@@ -17,6 +18,7 @@
                                         <button type="submit" name="delete" value="1">X</button>
                                     </form>
                                 %end
+                                </div>
                             </div>
                         </div>
                     </div>
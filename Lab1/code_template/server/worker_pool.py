@@ -0,0 +1,124 @@
+# coding=utf-8
+import heapq
+import itertools
+import queue
+import time
+from threading import Condition, Lock, Thread, current_thread
+
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_QUEUE = 1000
+
+
+# ------------------------------------------------------------------------------------------------------
+class WorkerPool:
+    """ Fixed number of worker threads taking tasks from a bounded queue, instead of one new thread per task.
+        A full queue blocks the submitter (backpressure); tasks submitted by a worker itself run inline then,
+        so the workers can never deadlock waiting for each other.
+        Delayed tasks wait on a single scheduler thread ordered by a heap; the scheduler never blocks on a full
+        queue, it runs the due task inline instead.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, submit_timeout=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        # seconds a submitter waits for space in the queue before queue.Full is raised, None waits forever
+        self.submit_timeout = submit_timeout
+        self.tasks = queue.Queue(maxsize=max_queue)
+
+        self.metrics_lock = Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+        self.busy = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+        # heap of (due_time, sequence_number, method, args)
+        self.delayed = list()
+        self.sequence = itertools.count()
+        self.delayed_condition = Condition()
+
+        self.threads = list()
+        for i in range(workers):
+            thread = Thread(target=self._work, name='worker-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        scheduler = Thread(target=self._schedule, name='scheduler')
+        scheduler.daemon = True
+        scheduler.start()
+
+    def submit(self, method, args=()):
+        # usage: pool.submit(server.contact_another_server, args=("10.1.0.2", "/index", "POST", params_dict))
+        with self.metrics_lock:
+            self.submitted += 1
+        task = (time.time(), method, tuple(args or ()))
+        if current_thread() in self.threads:
+            try:
+                self.tasks.put_nowait(task)
+            except queue.Full:
+                with self.metrics_lock:
+                    self.inline += 1
+                self._run(task)
+        else:
+            self.tasks.put(task, timeout=self.submit_timeout)
+
+    def submit_after_delay(self, delay, method, args=()):
+        # runs the task on the pool once delay seconds have passed
+        with self.delayed_condition:
+            heapq.heappush(self.delayed, (time.time() + delay, next(self.sequence), method, tuple(args or ())))
+            self.delayed_condition.notify()
+
+    def _work(self):
+        while True:
+            self._run(self.tasks.get())
+
+    def _run(self, task):
+        submitted_at, method, args = task
+        started_at = time.time()
+        with self.metrics_lock:
+            self.busy += 1
+        failed = False
+        try:
+            method(*args)
+        except Exception as e:
+            failed = True
+            print("[ERROR] " + str(e))
+        run_time = time.time() - started_at
+        with self.metrics_lock:
+            self.busy -= 1
+            self.completed += 1
+            self.failed += failed
+            self.total_wait += started_at - submitted_at
+            self.total_run += run_time
+            self.max_run = max(self.max_run, run_time)
+
+    def _schedule(self):
+        while True:
+            with self.delayed_condition:
+                while not self.delayed or self.delayed[0][0] > time.time():
+                    timeout = self.delayed[0][0] - time.time() if self.delayed else None
+                    self.delayed_condition.wait(timeout)
+                _, _, method, args = heapq.heappop(self.delayed)
+            with self.metrics_lock:
+                self.submitted += 1
+            task = (time.time(), method, args)
+            try:
+                self.tasks.put_nowait(task)
+            except queue.Full:
+                # blocking here would hold back every other delayed task, and with a submit_timeout
+                # queue.Full would end the scheduler thread
+                with self.metrics_lock:
+                    self.inline += 1
+                self._run(task)
+
+    def metrics(self) -> dict:
+        with self.metrics_lock:
+            completed = max(self.completed, 1)
+            return {'workers': self.workers, 'busy': self.busy, 'queue_depth': self.tasks.qsize(),
+                    'max_queue': self.max_queue, 'delayed': len(self.delayed), 'submitted': self.submitted,
+                    'completed': self.completed, 'failed': self.failed, 'run_inline': self.inline,
+                    'avg_wait': self.total_wait / completed, 'avg_run': self.total_run / completed,
+                    'max_run': self.max_run}
@@ -0,0 +1,113 @@
+# coding=utf-8
+import argparse
+import collections
+import random
+import sys
+import time
+from threading import Lock
+
+# the server code is run as a script from ./server, so its modules are imported the same way;
+# this directory is left out of the path, its concurrent.py would shadow the standard library's concurrent package
+sys.path[0] = 'server'
+import server
+
+
+# ------------------------------------------------------------------------------------------------------
+# Time to apply replicated operations on a follower, with the blackboard re-sorted on every write (as before)
+# and with the sorted key list.
+# usage (from Lab2/JerominMeierhofer/code_template): python3 benchmark_blackboard.py --ops 10000 100000
+# Every blackboard is run at every number of operations, so the us / op compare row by row. The re-sorting
+# blackboard is quadratic and skipped above --baseline-max-ops (--baseline-max-ops 100000 takes about 9 minutes).
+
+
+class SortingBlackboard:
+    """ The follower's blackboard before: every write rebuilds the ordered dict """
+
+    def __init__(self):
+        self.content = dict()
+        self.counter = 0
+        self.lock = Lock()
+
+    def set_content(self, index: str, new_content: str):
+        with self.lock:
+            self.content[int(index)] = new_content
+            self.counter = len(self.content)
+            # ordering the dict
+            self.content = collections.OrderedDict(sorted(self.content.items()))
+
+    def del_content(self, index: str):
+        with self.lock:
+            self.content.pop(int(index))
+            self.counter = len(self.content)
+
+
+def make_operations(n):
+    # mostly submits with increasing ids, which arrive slightly out of order, some modifies and deletes
+    ops = list()
+    ids = list()
+    next_id = 0
+    for _ in range(n):
+        r = random.random()
+        if r < 0.8 or not ids:
+            element_id = next_id + random.randint(0, 3)
+            next_id += 1
+            ops.append({'action': 'submit', 'element_id': str(element_id), 'entry': 'entry {}'.format(element_id)})
+            ids.append(element_id)
+        elif r < 0.95:
+            element_id = random.choice(ids)
+            ops.append({'action': 'modify', 'element_id': str(element_id), 'entry': 'modified {}'.format(element_id)})
+        else:
+            element_id = ids.pop(random.randrange(len(ids)))
+            ops.append({'action': 'delete', 'element_id': str(element_id)})
+    return ops
+
+
+def apply_one_by_one(blackboard, ops):
+    # like the follower's /propagate before batching: one set_content or del_content per operation
+    for op in ops:
+        if op['action'] == 'delete':
+            if int(op['element_id']) in blackboard.content:
+                blackboard.del_content(op['element_id'])
+        else:
+            blackboard.set_content(op['element_id'], op['entry'])
+
+
+def apply_batched(blackboard, ops, batch_size):
+    for i in range(0, len(ops), batch_size):
+        blackboard.apply_operations(ops[i:i + batch_size])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark applying replicated operations to the blackboard')
+    parser.add_argument('--ops', dest='ops', default=[10000, 100000], type=int, nargs='+',
+                        help='Numbers of operations, every blackboard is run with each')
+    parser.add_argument('--baseline-max-ops', dest='baseline_max_ops', default=10000, type=int,
+                        help='Largest number of operations the re-sorting blackboard is run with')
+    parser.add_argument('--batch', dest='batch', default=50, type=int, help='Operations per /propagate batch')
+    args = parser.parse_args()
+
+    runs = [('re-sort on every write', SortingBlackboard, apply_one_by_one),
+            ('sorted keys, one by one', server.Blackboard, apply_one_by_one),
+            ('sorted keys, batches of {}'.format(args.batch), server.Blackboard,
+             lambda blackboard, ops: apply_batched(blackboard, ops, args.batch))]
+
+    print('{:<28}{:>10}{:>12}{:>14}'.format('blackboard', 'ops', 'seconds', 'us / op'))
+    for n in args.ops:
+        random.seed(0)
+        ops = make_operations(n)
+        results = list()
+        for name, blackboard_class, apply in runs:
+            if blackboard_class is SortingBlackboard and n > args.baseline_max_ops:
+                print('{:<28}{:>10}  {}'.format(name, n, 'skipped, see --baseline-max-ops'))
+                continue
+            blackboard = blackboard_class()
+            start = time.time()
+            apply(blackboard, ops)
+            elapsed = time.time() - start
+            results.append(sorted(blackboard.content.items()))
+            print('{:<28}{:>10}{:>12.2f}{:>14.2f}'.format(name, n, elapsed, 10 ** 6 * elapsed / n))
+        if any(result != results[0] for result in results):
+            print('[ERROR] the blackboards differ')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# coding=utf-8
+import argparse
+import heapq
+import random
+import sys
+from urllib.parse import urlencode
+
+# the server code is run as a script from ./server, so its modules are imported the same way;
+# this directory is left out of the path, its concurrent.py would shadow the standard library's concurrent package
+sys.path[0] = 'server'
+from election import ELECTIONS, NEXT
+
+
+# ------------------------------------------------------------------------------------------------------
+# Messages, bytes and time until every server knows the leader, for each election algorithm, when all servers of
+# the ring start an election at boot (as main does). The ring is simulated: every message takes --latency ms
+# plus its size over --bandwidth, so the time is that of a network without the HTTP overhead.
+# usage (from Lab2/JerominMeierhofer/code_template): python3 benchmark_election.py --servers 8 16 64
+
+
+class SimulatedRing:
+    """ Delivers the messages of the elections of all servers in the order they arrive """
+
+    def __init__(self, algorithm, servers: int, latency: float, bandwidth: float, spread: float, rng):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ips = ['10.1.0.{}'.format(i + 1) for i in range(servers)]
+        self.now = 0.0
+        self.queue = []
+        # order of the events at the same time
+        self.events = 0
+        self.messages = 0
+        self.bytes = 0
+        self.known = dict()
+        self.elections = [ELECTIONS[algorithm](ip, rng.randint(0, 10 ** 6), self.sender(i), self.elected(ip))
+                          for i, ip in enumerate(self.ips)]
+        for i, election in enumerate(self.elections):
+            self.schedule(rng.uniform(0, spread), i, None)
+
+    def schedule(self, delay: float, index: int, fields):
+        self.events += 1
+        heapq.heappush(self.queue, (self.now + delay, self.events, index, fields))
+
+    def sender(self, index: int):
+        def send(fields: dict, direction: str, srv_ip=None):
+            size = len(urlencode(fields))
+            self.messages += 1
+            self.bytes += size
+            if srv_ip is not None:
+                target = self.ips.index(srv_ip)
+            else:
+                target = (index + (1 if direction == NEXT else -1)) % len(self.ips)
+            self.schedule(self.latency + size * 8 / self.bandwidth, target, fields)
+        return send
+
+    def elected(self, ip):
+        def set_leader(leader_ip, members):
+            self.known[ip] = (leader_ip, self.now)
+        return set_leader
+
+    def run(self) -> tuple:
+        while self.queue:
+            self.now, _, index, fields = heapq.heappop(self.queue)
+            if fields is None:
+                self.elections[index].start()
+            else:
+                self.elections[index].receive(fields)
+        leader = max(self.elections, key=lambda election: election.rank(election.ip, election.rnd_number)).ip
+        agreed = len(self.known) == len(self.ips) and all(known[0] == leader for known in self.known.values())
+        return agreed, max(known[1] for known in self.known.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the leader election algorithms')
+    parser.add_argument('--servers', dest='servers', default=[8, 16, 64], type=int, nargs='+',
+                        help='Numbers of servers in the ring')
+    parser.add_argument('--latency', dest='latency', default=1.0, type=float, help='Milliseconds per message')
+    parser.add_argument('--bandwidth', dest='bandwidth', default=10.0, type=float, help='Mbit/s of every link')
+    parser.add_argument('--spread', dest='spread', default=0.0, type=float,
+                        help='Milliseconds over which the servers start their elections')
+    parser.add_argument('--runs', dest='runs', default=20, type=int, help='Random rings per algorithm')
+    args = parser.parse_args()
+
+    print('{:<22}{:>8}{:>12}{:>12}{:>10}'.format('election', 'servers', 'messages', 'kbytes', 'ms'))
+    for servers in args.servers:
+        for algorithm in ELECTIONS:
+            rng = random.Random(servers)
+            messages = kbytes = elapsed = 0
+            for _ in range(args.runs):
+                ring = SimulatedRing(algorithm, servers, args.latency / 1000, args.bandwidth * 10 ** 6,
+                                     args.spread / 1000, rng)
+                agreed, took = ring.run()
+                if not agreed:
+                    print('[ERROR] {} servers did not agree on the leader'.format(algorithm))
+                messages += ring.messages / args.runs
+                kbytes += ring.bytes / 1000 / args.runs
+                elapsed += took * 1000 / args.runs
+            print('{:<22}{:>8}{:>12.0f}{:>12.1f}{:>10.1f}'.format(algorithm, servers, messages, kbytes, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# coding=utf-8
+import argparse
+import subprocess
+import sys
+from threading import Thread
+import time
+
+import requests
+
+# the server code is run as a script from ./server, so its modules are imported the same way;
+# this directory is left out of the path, its concurrent.py would shadow the standard library's concurrent package
+sys.path[0] = 'server'
+from replication import DEFAULT_FORWARD_WINDOW
+
+
+# ------------------------------------------------------------------------------------------------------
+# Leader CPU and end-to-end latency of writes sent to the followers, with every write forwarded to the leader on
+# its own (--forward-size 1) and with the writes of a follower forwarded together. Every server runs in its own
+# process on 127.0.0.1, the leader reports the CPU time of its process in /stats; the CPU time the leader spends
+# without writes (heartbeats, lease renewals), measured for --idle seconds before, is subtracted.
+# usage (from Lab2/JerominMeierhofer/code_template): python3 benchmark_forwarding.py --servers 8 --clients 32
+
+
+def serve(server_id: int, ips: list, forward_window: float, forward_size: int):
+    import bottle
+    from server import Server
+    from server_adapters import SERVER_MODES
+    server = Server(server_id, ips[server_id - 1], ips, forward_window=forward_window, forward_size=forward_size)
+    server.do_parallel_task_after_delay(delay=1, method=server.start_leader_election, args=[])
+    host, port = ips[server_id - 1].split(':')
+    bottle.run(server, server=SERVER_MODES['threadpool'], host=host, port=int(port), quiet=True)
+
+
+def start_servers(ips: list, forward_window: float, forward_size: int) -> list:
+    processes = [subprocess.Popen([sys.executable, __file__, '--serve', str(server_id), '--base-port',
+                                   ips[0].split(':')[1], '--servers', str(len(ips)),
+                                   '--forward-window', str(forward_window), '--forward-size', str(forward_size)],
+                                  stdout=subprocess.DEVNULL)
+                 for server_id in range(1, len(ips) + 1)]
+    return processes
+
+
+def wait_for_leader(ips: list, timeout=30.0):
+    # returns the ip all servers agree on as leader
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            leaders = {requests.get('http://{}/stats'.format(srv_ip)).json()['election']['leader'] for srv_ip in ips}
+            if len(leaders) == 1 and None not in leaders:
+                return leaders.pop()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    return None
+
+
+def write(srv_ip, writes: int, latencies: list):
+    session = requests.Session()
+    for i in range(writes):
+        start = time.time()
+        res = session.post('http://{}/board'.format(srv_ip), data={'entry': 'benchmark {}'.format(i)})
+        if res.status_code == 200:
+            latencies.append(time.time() - start)
+
+
+def leader_cpu(leader_ip) -> float:
+    return requests.get('http://{}/stats'.format(leader_ip)).json()['cpu']
+
+
+def run(ips: list, leader_ip, clients: int, writes: int, idle: float) -> tuple:
+    # the clients write to the followers only, every one its share of writes
+    followers = [srv_ip for srv_ip in ips if srv_ip != leader_ip]
+    latencies = list()
+    cpu = leader_cpu(leader_ip)
+    time.sleep(idle)
+    idle_cpu = (leader_cpu(leader_ip) - cpu) / idle
+    cpu = leader_cpu(leader_ip)
+    start = time.time()
+    threads = [Thread(target=write, args=(followers[i % len(followers)], writes // clients, latencies))
+               for i in range(clients)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    elapsed = time.time() - start
+    cpu = leader_cpu(leader_ip) - cpu - idle_cpu * elapsed
+    forwarded = [requests.get('http://{}/stats'.format(srv_ip)).json()['forwarded'] for srv_ip in followers]
+    batch = sum(stats['writes'] for stats in forwarded) / max(sum(stats['requests'] for stats in forwarded), 1)
+    return len(latencies), elapsed, cpu, batch, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the forwarding of writes from the followers to the leader')
+    parser.add_argument('--servers', dest='servers', default=8, type=int, help='Number of servers')
+    parser.add_argument('--base-port', dest='base_port', default=9900, type=int, help='Port of server 1')
+    parser.add_argument('--clients', dest='clients', default=32, type=int, help='Clients writing at the same time')
+    parser.add_argument('--writes', dest='writes', default=4000, type=int, help='Writes of all clients together')
+    parser.add_argument('--idle', dest='idle', default=3.0, type=float,
+                        help='Seconds the CPU time of the leader without writes is measured')
+    parser.add_argument('--forward-window', dest='forward_window', default=DEFAULT_FORWARD_WINDOW, type=float,
+                        help='Seconds a follower collects writes before forwarding them')
+    parser.add_argument('--forward-sizes', dest='forward_sizes', default=[1, 100], type=int, nargs='+',
+                        help='Maximum numbers of writes forwarded in one request to compare, 1 forwards every write '
+                             'on its own')
+    parser.add_argument('--serve', dest='serve', default=None, type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--forward-size', dest='forward_size', default=1, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    ips = ['127.0.0.1:{}'.format(args.base_port + i) for i in range(args.servers)]
+    if args.serve is not None:
+        serve(args.serve, ips, args.forward_window, args.forward_size)
+        return
+
+    print('{:<14}{:>10}{:>12}{:>10}{:>10}{:>10}{:>18}'.format('forward size', 'writes', 'writes/req', 'writes/s',
+                                                              'p50 ms', 'p99 ms', 'leader cpu ms/w'))
+    for forward_size in args.forward_sizes:
+        processes = start_servers(ips, args.forward_window, forward_size)
+        try:
+            leader_ip = wait_for_leader(ips)
+            if leader_ip is None:
+                print('[ERROR] The servers did not agree on a leader')
+                continue
+            written, elapsed, cpu, batch, latencies = run(ips, leader_ip, args.clients, args.writes, args.idle)
+            if not latencies:
+                print('[ERROR] No write succeeded')
+                continue
+            print('{:<14}{:>10}{:>12.1f}{:>10.0f}{:>10.1f}{:>10.1f}{:>18.3f}'.format(
+                forward_size, written, batch, written / elapsed, latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.99)] * 1000, cpu * 1000 / written))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+
+if __name__ == '__main__':
+    main()
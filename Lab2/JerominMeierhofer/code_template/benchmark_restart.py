@@ -0,0 +1,74 @@
+# coding=utf-8
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+# the server code is run as a script from ./server, so its modules are imported the same way;
+# this directory is left out of the path, its concurrent.py would shadow the standard library's concurrent package
+sys.path[0] = 'server'
+import server
+from journal import Journal
+from worker_pool import WorkerPool
+
+
+# ------------------------------------------------------------------------------------------------------
+# Time to restart a server with a board of --entries entries from its journal: from the latest snapshot plus the
+# records after it, and from the log alone (no snapshot was written yet).
+# usage (from Lab2/JerominMeierhofer/code_template): python3 benchmark_restart.py --entries 1000000
+
+
+def fill(data_dir, worker_pool, entries, tail, snapshot_every):
+    # writes a journal with entries submits, of which the last tail come after the latest snapshot
+    blackboard = server.Blackboard(Journal(data_dir, worker_pool, snapshot_every=snapshot_every))
+    blackboard.restore()
+    start = time.time()
+    for i in range(entries - tail):
+        blackboard.add_content('entry {}'.format(i))
+    if snapshot_every <= entries:
+        with blackboard.lock:
+            blackboard.journal.snapshot(blackboard._state())
+    for i in range(entries - tail, entries):
+        blackboard.add_content('entry {}'.format(i))
+    # the snapshot is written on the worker pool
+    while snapshot_every <= entries and blackboard.journal.snapshots == 0:
+        time.sleep(0.01)
+    blackboard.journal.close()
+    return time.time() - start
+
+
+def restart(data_dir, worker_pool) -> tuple:
+    start = time.time()
+    blackboard = server.Blackboard(Journal(data_dir, worker_pool))
+    blackboard.restore()
+    elapsed = time.time() - start
+    blackboard.journal.close()
+    return elapsed, len(blackboard.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark restarting a server from its journal')
+    parser.add_argument('--entries', dest='entries', default=1000000, type=int, help='Number of entries on the board')
+    parser.add_argument('--tail', dest='tail', default=10000, type=int,
+                        help='Number of records after the latest snapshot')
+    args = parser.parse_args()
+
+    worker_pool = WorkerPool()
+    runs = [('snapshot + {} records'.format(args.tail), args.entries),
+            ('log only', args.entries + 1)]
+    print('{:<28}{:>10}{:>12}{:>12}'.format('journal', 'entries', 'write s', 'restart s'))
+    for name, snapshot_every in runs:
+        data_dir = tempfile.mkdtemp()
+        try:
+            written = fill(data_dir, worker_pool, args.entries, args.tail, snapshot_every)
+            elapsed, entries = restart(data_dir, worker_pool)
+        finally:
+            shutil.rmtree(data_dir)
+        if entries != args.entries:
+            print('[ERROR] restored {} of {} entries'.format(entries, args.entries))
+        print('{:<28}{:>10}{:>12.2f}{:>12.2f}'.format(name, entries, written, elapsed))
+
+
+if __name__ == '__main__':
+    main()
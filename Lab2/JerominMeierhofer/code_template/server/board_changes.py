@@ -0,0 +1,95 @@
+# coding=utf-8
+import collections
+import itertools
+import uuid
+from threading import Lock
+
+from event_stream import Subscription, format_event
+
+DEFAULT_MAX_CHANGES = 1000
+
+INSERT = 'insert'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+
+# ------------------------------------------------------------------------------------------------------
+class ChangeLog:
+    """ Version counter of a blackboard and its last max_changes changes, so a browser that has seen version v
+        only downloads what happened since instead of the whole board.
+        A change is a dict of shape {'op': insert/update/remove, 'index': position of the row on the board,
+        'id': element id, 'entry': text}. Changes are recorded while the blackboard's lock is held, so applying
+        them in order to the rows of version v gives the rows of the current version.
+    """
+
+    def __init__(self, max_changes=DEFAULT_MAX_CHANGES):
+        # changes the version on every restart, versions of an earlier run are never mixed up with this one
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        # deque of type tuple of (version, change)
+        self.changes = collections.deque(maxlen=max_changes)
+        # set of type event_stream.Subscription, clients of /board/stream
+        self.subscribers = set()
+        self.subscribers_lock = Lock()
+
+    def record(self, op: str, index: int, element_id, entry=None, **extra):
+        self.version += 1
+        change = {'op': op, 'index': index, 'id': element_id, 'entry': entry}
+        change.update(extra)
+        self.changes.append((self.version, change))
+        with self.subscribers_lock:
+            if self.subscribers:
+                # encoded once for all subscribers
+                event = format_event('change', change, self.version)
+                for subscription in self.subscribers:
+                    subscription.push(event)
+
+    def reset(self):
+        # the board was replaced as a whole, e.g. restored from disk: every browser has to reload it
+        self.version += 1
+        self.changes.clear()
+        with self.subscribers_lock:
+            event = format_event('reset', {'epoch': self.epoch, 'version': self.version}, self.version)
+            for subscription in self.subscribers:
+                subscription.push(event)
+
+    def _since(self, version: int):
+        # list of type tuple of (version, change) after version, None if they are not known anymore
+        if version == self.version:
+            return []
+        if version > self.version or not self.changes or self.changes[0][0] > version + 1:
+            return None
+        return list(itertools.islice(self.changes, version + 1 - self.changes[0][0], None))
+
+    def since(self, version: int):
+        # list of the changes after version, None if they are not known anymore and the whole board has to be sent
+        changes = self._since(version)
+        return None if changes is None else [change for _, change in changes]
+
+    def delta(self, since: int, epoch: str) -> dict:
+        # answer to /board/changes: the changes after version since of epoch, or reset if the browser has to reload
+        changes = self.since(since) if epoch == self.epoch else None
+        if changes is None:
+            return {'epoch': self.epoch, 'version': self.version, 'reset': True}
+        return {'epoch': self.epoch, 'version': self.version, 'changes': changes}
+
+    def subscribe(self, since: int, epoch: str) -> Subscription:
+        # stream of /board/stream, starting with the changes after version since of epoch (or reset if the browser
+        # has to reload) followed by every recorded change; call while the blackboard's lock is held
+        subscription = Subscription(on_close=self.unsubscribe)
+        changes = self._since(since) if epoch == self.epoch else None
+        if changes is None:
+            subscription.push(format_event('reset', {'epoch': self.epoch, 'version': self.version}, self.version))
+        else:
+            for version, change in changes:
+                subscription.push(format_event('change', change, version))
+        with self.subscribers_lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.subscribers_lock:
+            self.subscribers.discard(subscription)
+
+    def etag(self, version: int) -> str:
+        return '"{}-{}"'.format(self.epoch, version)
@@ -0,0 +1,259 @@
+# coding=utf-8
+import abc
+import time
+from threading import Lock
+
+DEFAULT_ELECTION = 'chang-roberts'
+# seconds after which a server that took part in an election that never ended may start a new one
+ELECTION_TIMEOUT = 10
+# servers probed at the same time when the next server in the ring doesn't answer
+DEFAULT_RING_PROBES = 3
+# directions in the ring
+NEXT = 'next'
+PREVIOUS = 'previous'
+# messages carrying a candidacy; once the round is decided they are answered with the leader instead
+CANDIDACIES = ('election', 'probe')
+
+
+# ------------------------------------------------------------------------------------------------------
+class Election(abc.ABC):
+    """ Leader election in the ring of servers. Messages are dictionaries of strings (the form fields of
+        /leader_election), sent with send(fields, direction) to the next or previous live server in the ring, or with
+        send(fields, None, srv_ip) to srv_ip only. Every message carries the ip of the server that sent it last.
+        elected(leader_ip, members) is called once the leader is known; members is the list of (server_ip,
+        rnd_number) in ring order if the algorithm collects the members of the ring, None otherwise.
+        Every election has a round, its id: a server starting an election takes the next round and messages of
+        older rounds are dropped, so elections started at the same time or over and over don't run side by side.
+        A server that starts after the election ended, or missed it, gets the leader back from the first server that
+        knows it instead of running the election around the ring again.
+    """
+    name = None
+
+    def __init__(self, ip, rnd_number, send, elected):
+        self.ip = ip
+        self.rnd_number = rnd_number
+        self.send_message = send
+        self.elected = elected
+        self.round = 0
+        self.participant = False
+        self.started_at = None
+        self.leader_ip = None
+        self.members = None
+        self.elected_round = None
+        self.sent = 0
+        self.received = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def rank(ip, rnd_number) -> tuple:
+        # the server with the highest random number wins, the highest ip among equal random numbers
+        return int(rnd_number), ip
+
+    def start(self) -> bool:
+        # False if an election is running already
+        with self.lock:
+            if self.participant and time.time() - self.started_at < ELECTION_TIMEOUT:
+                return False
+            self.round += 1
+            self._reset()
+            self._join()
+            self._start()
+            return True
+
+    def receive(self, fields: dict):
+        with self.lock:
+            self.received += 1
+            election_round = int(fields.get('round') or 0)
+            sender = fields.get('sender')
+            if (election_round <= self.round and fields.get('action') in CANDIDACIES and not self.participant
+                    and self.elected_round == self.round and sender and sender != self.ip):
+                # the round of the sender is over already, it only has to learn the leader
+                self.reply(sender, {'action': 'leader', 'leader': self.leader_ip})
+                return
+            if election_round < self.round:
+                # the sender missed the latest election, e.g. it restarted; a new one tells it the leader
+                if not self.participant and fields.get('action') != 'leader':
+                    self.round += 1
+                    self._reset()
+                    self._join()
+                    self._start()
+                return
+            if election_round > self.round:
+                self.round = election_round
+                self.participant = False
+                self._reset()
+            if fields.get('action') == 'leader':
+                self.announce(fields['leader'])
+            else:
+                self._receive(fields)
+
+    def _join(self):
+        self.participant = True
+        self.started_at = time.time()
+
+    def _reset(self):
+        # state of the algorithm kept for one round
+        pass
+
+    @abc.abstractmethod
+    def _start(self):
+        # call holding self.lock; this server starts the election of the current round
+        pass
+
+    @abc.abstractmethod
+    def _receive(self, fields: dict):
+        # call holding self.lock; a message of the current round that doesn't announce the leader
+        pass
+
+    def send(self, fields: dict, direction=NEXT):
+        # call holding self.lock
+        self.sent += 1
+        self.send_message(dict(fields, round=str(self.round), sender=self.ip), direction)
+
+    def reply(self, srv_ip, fields: dict):
+        # call holding self.lock; sends to srv_ip only, not along the ring
+        self.sent += 1
+        self.send_message(dict(fields, round=str(self.round), sender=self.ip), None, srv_ip)
+
+    def announce(self, leader_ip, members=None):
+        # call holding self.lock; elected is called once per round, again only if other members were collected
+        changed = self.elected_round != self.round or leader_ip != self.leader_ip or members != self.members
+        self.leader_ip = leader_ip
+        self.members = members
+        self.elected_round = self.round
+        self.participant = False
+        if changed:
+            self.elected(leader_ip, members)
+
+    def forward_coordination(self, fields: dict):
+        # the coordination message goes around the ring once, from the leader back to the leader
+        if fields['leader'] != self.ip:
+            self.send({'action': 'coordination', 'leader': fields['leader']})
+            self.announce(fields['leader'])
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {'algorithm': self.name, 'round': self.round, 'participant': self.participant,
+                    'leader': self.leader_ip, 'sent': self.sent, 'received': self.received}
+
+
+class RingElection(Election):
+    """ The original election: the election message collects the ip and random number of every server it passes and
+        once back at its initiator goes around the ring a second time as coordination message, so every server
+        learns the members of the ring. Every election started takes 2n messages, which grow with the ring.
+    """
+    name = 'ring'
+
+    def _start(self):
+        self.send({'action': 'election', 'servers_dict': '{}|{}|'.format(self.ip, self.rnd_number),
+                   'initiator_ip': self.ip})
+
+    def _receive(self, fields: dict):
+        servers_str = fields['servers_dict']
+        init_ip = fields['initiator_ip']
+        if fields['action'] == 'election':
+            if init_ip == self.ip:
+                self.send({'action': 'coordination', 'servers_dict': servers_str, 'initiator_ip': init_ip})
+            else:
+                self._join()
+                self.send({'action': 'election', 'initiator_ip': init_ip,
+                           'servers_dict': servers_str + '{}|{}|'.format(self.ip, self.rnd_number)})
+        elif fields['action'] == 'coordination':
+            servers_list = servers_str.rstrip('|').split('|')
+            members = list(zip(servers_list[0::2], [int(rnd) for rnd in servers_list[1::2]]))
+            leader_ip = max(members, key=lambda member: self.rank(*member))[0]
+            self.announce(leader_ip, members)
+            if init_ip != self.ip:
+                self.send({'action': 'coordination', 'servers_dict': servers_str, 'initiator_ip': init_ip})
+
+
+class ChangRobertsElection(Election):
+    """ Chang and Roberts: a server only forwards candidates ranked above itself, the others are dropped, so of the
+        elections started at the same time only the message of the highest ranked candidate goes all around the
+        ring; n log n messages on average. The coordination message only carries the leader.
+    """
+    name = 'chang-roberts'
+
+    def _start(self):
+        self.send({'action': 'election', 'candidate': self.ip, 'rank': str(self.rnd_number)})
+
+    def _receive(self, fields: dict):
+        if fields['action'] == 'election':
+            candidate = self.rank(fields['candidate'], fields['rank'])
+            own = self.rank(self.ip, self.rnd_number)
+            if candidate > own:
+                self._join()
+                self.send({'action': 'election', 'candidate': fields['candidate'], 'rank': fields['rank']})
+            elif candidate == own:
+                # the own candidacy went around the ring
+                self.send({'action': 'coordination', 'leader': self.ip})
+                self.announce(self.ip)
+            elif not self.participant:
+                # replaced by the own candidacy; if this server is a candidate already the message is dropped
+                self._join()
+                self._start()
+        elif fields['action'] == 'coordination':
+            self.forward_coordination(fields)
+
+
+class HirschbergSinclairElection(Election):
+    """ Hirschberg and Sinclair: in phase k a candidate sends probes both ways around the ring, 2^k servers far.
+        A server ranked above the candidate drops the probe, the last server of the stretch sends it back as a reply.
+        A candidate getting both replies goes on with the next phase; the one whose probe comes back around the
+        ring is the leader. At most 8n log n messages, also when Chang and Roberts takes n^2 / 2 (candidates
+        ranked in the order of the ring).
+    """
+    name = 'hirschberg-sinclair'
+
+    def _reset(self):
+        self.phase = 0
+        self.replies = 0
+        self.candidate = False
+
+    def _start(self):
+        self.phase = 0
+        self.candidate = True
+        self._probe()
+
+    def _probe(self):
+        self.replies = 0
+        for direction in (NEXT, PREVIOUS):
+            self.send({'action': 'probe', 'candidate': self.ip, 'rank': str(self.rnd_number),
+                       'phase': str(self.phase), 'hop': '1', 'direction': direction}, direction)
+
+    def _receive(self, fields: dict):
+        if fields['action'] == 'probe':
+            candidate = self.rank(fields['candidate'], fields['rank'])
+            own = self.rank(self.ip, self.rnd_number)
+            phase, hop, direction = int(fields['phase']), int(fields['hop']), fields['direction']
+            if candidate == own:
+                # the probe went around the ring; the probe of the other direction may have as well
+                if self.candidate:
+                    self.candidate = False
+                    self.send({'action': 'coordination', 'leader': self.ip})
+                    self.announce(self.ip)
+            elif candidate > own:
+                self._join()
+                if hop < 2 ** phase:
+                    self.send(dict(fields, hop=str(hop + 1)), direction)
+                else:
+                    back = PREVIOUS if direction == NEXT else NEXT
+                    self.send({'action': 'reply', 'candidate': fields['candidate'], 'phase': fields['phase'],
+                               'direction': back}, back)
+            elif not self.participant:
+                self._join()
+                self._start()
+        elif fields['action'] == 'reply':
+            if fields['candidate'] != self.ip:
+                self.send(fields, fields['direction'])
+            elif int(fields['phase']) == self.phase:
+                self.replies += 1
+                if self.replies == 2:
+                    self.phase += 1
+                    self._probe()
+        elif fields['action'] == 'coordination':
+            self.forward_coordination(fields)
+
+
+# name: class of the election algorithm, all servers have to use the same
+ELECTIONS = {election.name: election for election in (RingElection, ChangRobertsElection, HirschbergSinclairElection)}
@@ -0,0 +1,43 @@
+# coding=utf-8
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+# ------------------------------------------------------------------------------------------------------
+class FanOut:
+    """ Sends a message to many peers in parallel, so a broadcast takes as long as the slowest peer instead of
+        the sum of all peers. At most max_concurrency requests are in flight at the same time.
+        A peer that hasn't answered by the deadline is reported as None, not as failed: its request may still
+        arrive, so resending the message may deliver it twice.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, deadline=None):
+        self.max_concurrency = max_concurrency
+        # seconds after which the broadcast stops waiting for a peer, None waits for the client timeouts
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='fanout')
+
+    def broadcast(self, peers, send, deadline=None) -> dict:
+        # calls send(srv_ip) -> bool for every peer and returns a dictionary of shape srv_ip: success, where
+        # success is None for the peers still running at the deadline (maybe delivered)
+        # usage: fan_out.broadcast(['10.1.0.2', '10.1.0.3'], lambda ip: server.contact_another_server(ip, '/index'))
+        if deadline is None:
+            deadline = self.deadline
+        futures = {srv_ip: self.executor.submit(send, srv_ip) for srv_ip in peers}
+        wait(futures.values(), timeout=deadline)
+
+        results = dict()
+        for srv_ip, future in futures.items():
+            if not future.done():
+                # missed the deadline, don't start it anymore if it is still waiting for a free slot; a request
+                # that was sent already may still be applied by the peer
+                results[srv_ip] = False if future.cancel() else None
+            elif future.cancelled() or future.exception() is not None:
+                results[srv_ip] = False
+            else:
+                results[srv_ip] = bool(future.result())
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,225 @@
+# coding=utf-8
+import json
+import mmap
+import os
+import time
+from threading import Lock
+
+DEFAULT_FSYNC_INTERVAL = 0.05  # in sec
+DEFAULT_SNAPSHOT_EVERY = 100000  # records
+
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.json'
+SEGMENT_PREFIX = 'wal-'
+SEGMENT_SUFFIX = '.log'
+
+
+def _read_mapped(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+def _file_seq(name: str, prefix: str, suffix: str):
+    # the sequence number in the name of a snapshot or segment, None for other files
+    if name.startswith(prefix) and name.endswith(suffix):
+        try:
+            return int(name[len(prefix):-len(suffix)])
+        except ValueError:
+            pass
+    return None
+
+
+# ------------------------------------------------------------------------------------------------------
+class Journal:
+    """ Write-ahead log of a blackboard in data_dir, so a restarted server comes back with its board.
+        Records are json lines [seq, record] in append-only segments wal-<first seq>.log. They are buffered and
+        written + fsynced together at most every fsync_interval seconds on the worker pool, a crash loses at most
+        that window. Every snapshot_every records the owner hands over a copy of its whole state, which is written
+        to snapshot-<seq>.json; afterwards the older segments and snapshots are deleted.
+    """
+
+    def __init__(self, data_dir, worker_pool, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.worker_pool = worker_pool
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        # sequence number of the last appended record and of the last snapshot
+        self.seq = 0
+        self.snapshot_seq = 0
+        # list of encoded records (bytes) and first sequence numbers of new segments (int), in order
+        self.pending = list()
+        self.flush_scheduled = False
+        self.lock = Lock()
+        # held while the segment file is written, keeps the flushes in order
+        self.io_lock = Lock()
+        # held while a snapshot is written, snapshots are written one at a time and in order
+        self.snapshot_lock = Lock()
+        self.written_snapshot_seq = 0
+        self.file = None
+        self.flushes = 0
+        self.snapshots = 0
+        self.last_fsync = None
+
+    def _path(self, prefix: str, seq: int, suffix: str) -> str:
+        return os.path.join(self.data_dir, '{}{:020d}{}'.format(prefix, seq, suffix))
+
+    def _files(self, prefix: str, suffix: str) -> list:
+        # list of type tuple of (seq, path), ordered by seq
+        files = list()
+        for name in os.listdir(self.data_dir):
+            seq = _file_seq(name, prefix, suffix)
+            if seq is not None:
+                files.append((seq, os.path.join(self.data_dir, name)))
+        return sorted(files)
+
+    def load(self) -> tuple:
+        # returns the state of the latest snapshot (None if there is none) and the list of records after it;
+        # call once before the first append, new records go to a new segment
+        state = None
+        for seq, path in reversed(self._files(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)):
+            try:
+                snapshot = json.loads(_read_mapped(path))
+                state = snapshot['state']
+                self.seq = self.snapshot_seq = snapshot['seq']
+                break
+            except (ValueError, KeyError) as e:
+                print('[WARNING ]Skipping damaged snapshot {}: {}'.format(path, e))
+
+        records = list()
+        stale = list()
+        for first_seq, path in self._files(SEGMENT_PREFIX, SEGMENT_SUFFIX):
+            if first_seq > self.seq + 1:
+                # records are missing before this segment, it can't be replayed
+                stale.append(path)
+                continue
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter(mm.readline, b''):
+                        try:
+                            seq, record = json.loads(line)
+                        except ValueError:
+                            # the last write before a crash may be incomplete
+                            print('[WARNING ]Ignoring the rest of {} after record {}'.format(path, self.seq))
+                            break
+                        if seq == self.seq + 1:
+                            records.append(record)
+                            self.seq = seq
+        for path in stale:
+            print('[WARNING ]Removing {}, the records before it are missing'.format(path))
+            os.remove(path)
+
+        self._open_segment(self.seq + 1)
+        return state, records
+
+    def _open_segment(self, first_seq: int):
+        # call holding io_lock (or before the journal is used)
+        if self.file is not None:
+            self.file.close()
+        # a segment with this name can only hold an incomplete record, which was skipped on load
+        self.file = open(self._path(SEGMENT_PREFIX, first_seq, SEGMENT_SUFFIX), 'wb')
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        # makes new and renamed files in data_dir durable
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, record) -> bool:
+        # call in the order the records are applied, i.e. holding the blackboard's lock
+        # returns True if a snapshot is due, see snapshot
+        data = json.dumps(record)
+        schedule = False
+        with self.lock:
+            self.seq += 1
+            self.pending.append('[{}, {}]\n'.format(self.seq, data).encode('utf-8'))
+            if not self.flush_scheduled:
+                self.flush_scheduled = schedule = True
+            due = self.seq - self.snapshot_seq >= self.snapshot_every
+        if schedule:
+            self.worker_pool.submit_after_delay(self.fsync_interval, self.flush)
+        return due
+
+    def flush(self):
+        # writes and fsyncs all pending records
+        with self.io_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = list()
+                self.flush_scheduled = False
+            if not pending:
+                return
+            chunk = list()
+            for item in pending:
+                if isinstance(item, int):
+                    self._write(chunk)
+                    chunk = list()
+                    self._open_segment(item)
+                else:
+                    chunk.append(item)
+            self._write(chunk)
+            self.flushes += 1
+            self.last_fsync = time.time()
+
+    def _write(self, chunk: list):
+        # call holding io_lock
+        self.file.write(b''.join(chunk))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def snapshot(self, state: dict):
+        # state is a copy of the owner's state after the last appended record, call holding the blackboard's lock
+        # the snapshot is written on the worker pool, the following records go to a new segment
+        with self.lock:
+            seq = self.seq
+            self.snapshot_seq = seq
+            self.pending.append(seq + 1)
+        self.worker_pool.submit(self._write_snapshot, (seq, state))
+
+    def _write_snapshot(self, seq: int, state: dict):
+        with self.snapshot_lock:
+            if seq > self.written_snapshot_seq:
+                self._write_snapshot_locked(seq, state)
+
+    def _write_snapshot_locked(self, seq: int, state: dict):
+        # the records up to seq are written first, so the segment after the snapshot exists before older ones go
+        self.flush()
+        path = self._path(SNAPSHOT_PREFIX, seq, SNAPSHOT_SUFFIX)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(json.dumps({'seq': seq, 'state': state}).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            self._fsync_dir()
+        except OSError as e:
+            print('[ERROR] Could not write snapshot {}: {}'.format(path, e))
+            return
+        self.snapshots += 1
+        self.written_snapshot_seq = seq
+        # everything up to seq is in the snapshot, the segments starting at or before seq end before seq + 1
+        old_files = [path for old_seq, path in self._files(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX) if old_seq < seq]
+        old_files += [path for first_seq, path in self._files(SEGMENT_PREFIX, SEGMENT_SUFFIX) if first_seq <= seq]
+        for old_path in old_files:
+            os.remove(old_path)
+
+    def close(self):
+        self.flush()
+        with self.io_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {'seq': self.seq, 'snapshot_seq': self.snapshot_seq, 'pending': len(self.pending),
+                    'flushes': self.flushes, 'snapshots': self.snapshots, 'last_fsync': self.last_fsync}
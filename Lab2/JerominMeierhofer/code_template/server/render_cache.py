@@ -0,0 +1,68 @@
+# coding=utf-8
+import collections
+import gzip
+from threading import Lock
+
+from bottle import request, response
+
+DEFAULT_MAX_PAGES = 16
+# level 6 is the default of gzip, compressing a page costs less than a millisecond
+GZIP_LEVEL = 6
+
+
+# ------------------------------------------------------------------------------------------------------
+class CachedPage:
+    """ A rendered page, encoded and gzipped once """
+    __slots__ = ('body', 'gzipped')
+
+    def __init__(self, text: str):
+        self.body = text.encode('utf-8')
+        self.gzipped = gzip.compress(self.body, GZIP_LEVEL)
+
+    def send(self) -> bytes:
+        # body of the bottle response, gzipped if the client accepts it
+        response.set_header('Vary', 'Accept-Encoding')
+        if 'gzip' in request.get_header('Accept-Encoding', ''):
+            response.set_header('Content-Encoding', 'gzip')
+            return self.gzipped
+        return self.body
+
+
+class RenderCache:
+    """ The last max_pages rendered pages by key. A key must contain everything the page depends on, e.g. the
+        version of the blackboard, so a page is rendered once per version instead of once per request.
+    """
+
+    def __init__(self, max_pages=DEFAULT_MAX_PAGES):
+        self.max_pages = max_pages
+        # ordered dictionary of shape key: CachedPage, least recently used first
+        self.pages = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        # the cached page or None
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.pages.move_to_end(key)
+            return page
+
+    def put(self, key, text: str) -> CachedPage:
+        page = CachedPage(text)
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        return page
+
+    def metrics(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'pages': len(self.pages),
+                    'hit_rate': self.hits / requests if requests else None}
@@ -0,0 +1,288 @@
+# coding=utf-8
+import random
+import time
+import uuid
+from threading import Lock
+
+DEFAULT_MAX_BATCH = 1000  # operations per request
+DEFAULT_MAX_IN_FLIGHT = 4  # requests per follower, at most the keep-alive connections per peer are used
+# operations kept for followers that haven't acknowledged them; a follower falling further behind is caught up
+# with anti-entropy instead
+MAX_LOG = 100000
+# operations a follower keeps that arrived before the ones preceding them
+REORDER_WINDOW = 10000
+BASE_BACKOFF = 0.1  # in sec
+MAX_BACKOFF = 5.0  # in sec
+# a follower without new operations is sent an empty request this often, which renews how fresh its board is
+DEFAULT_LEASE_RENEWAL = 0.5  # in sec
+# sequence numbers a follower remembers it was sent before it applied them, see ReplicationFollower.staleness
+MAX_PENDING_FRESHNESS = 100
+# writes of its clients a follower forwards to the leader in one request; they are collected for the window and
+# while the previous request is on its way, so a write waits at most for the window or one round trip
+DEFAULT_FORWARD_WINDOW = 0.01  # in sec
+DEFAULT_FORWARD_SIZE = 100
+
+
+# ------------------------------------------------------------------------------------------------------
+class FollowerStream:
+    """ Progress of the replication to one follower """
+
+    def __init__(self, srv_ip):
+        self.srv_ip = srv_ip
+        # highest sequence number the follower applied (cumulative ack) and the next one to send
+        self.acked = 0
+        self.next_seq = 1
+        self.in_flight = 0
+        # the operations before next_seq were dropped from the log before the follower had them
+        self.skipped = False
+        self.failures = 0
+        self.retry_at = None
+        # a pump of the stream is waiting on the worker pool, operations appended meanwhile are sent with it
+        self.pump_scheduled = False
+        self.sent = 0
+
+    def to_dict(self, last_seq: int) -> dict:
+        return {'acked': self.acked, 'lag': last_seq - self.acked, 'in_flight': self.in_flight,
+                'failures': self.failures, 'sent': self.sent,
+                'retry_in': max(self.retry_at - time.time(), 0) if self.retry_at is not None else None}
+
+
+class ReplicationLog:
+    """ Leader side of the replication: every operation gets the next sequence number of the leader's epoch and
+        stays in the log until all followers acknowledged it. Every follower has its own stream with up to
+        max_in_flight requests of up to max_batch operations on the way, so a follower is sent new operations
+        while the previous ones are still being applied instead of one blocking request per batch.
+        Followers acknowledge the highest sequence number they applied in order; after a failed request the
+        stream goes back to the first operation not acknowledged (duplicates are ignored by the follower).
+        Every request carries the last sequence number of the leader, and a follower that has all operations is
+        sent an empty request every lease_renewal seconds, so followers know how stale their board is.
+    """
+
+    def __init__(self, worker_pool, send, max_batch=DEFAULT_MAX_BATCH, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_log=MAX_LOG, suspected=None, lease_renewal=DEFAULT_LEASE_RENEWAL):
+        self.worker_pool = worker_pool
+        # called as send(srv_ip, epoch, first_seq, operations, skipped, last_seq) -> ack, None if the request failed
+        self.send = send
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+        self.max_log = max_log
+        # called as suspected(srv_ip) -> bool, nothing is sent to a suspected follower until it's back
+        self.suspected = suspected
+        self.lease_renewal = lease_renewal
+        self.epoch = None
+        # operations with the sequence numbers first_seq, first_seq + 1, ...
+        self.log = []
+        self.first_seq = 1
+        # dictionary of shape srv_ip: FollowerStream, empty unless this server is the leader
+        self.streams = dict()
+        self.lock = Lock()
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.log) - 1
+
+    def start(self, followers: list):
+        # this server became the leader: a new epoch, whose sequence numbers start at 1
+        with self.lock:
+            self.epoch = uuid.uuid4().hex[:8]
+            self.log = []
+            self.first_seq = 1
+            self.streams = {srv_ip: FollowerStream(srv_ip) for srv_ip in followers}
+            streams = list(self.streams.values())
+        for stream in streams:
+            self._renew(stream)
+
+    def stop(self):
+        # another server became the leader; requests on the way end in the stream that is dropped here
+        with self.lock:
+            self.epoch = None
+            self.log = []
+            self.streams = dict()
+
+    def append(self, operations: list) -> tuple:
+        # returns the epoch and the sequence number of the last operation, (None, None) if not the leader
+        with self.lock:
+            if self.epoch is None:
+                return None, None
+            self.log.extend(operations)
+            epoch, last_seq = self.epoch, self.last_seq
+            streams = [stream for stream in self.streams.values() if not stream.pump_scheduled]
+            for stream in streams:
+                stream.pump_scheduled = True
+        # submitted outside the lock, submit() may block while the worker pool is busy
+        for stream in streams:
+            self.worker_pool.submit(self._scheduled_pump, (stream,))
+        return epoch, last_seq
+
+    def _scheduled_pump(self, stream: FollowerStream):
+        with self.lock:
+            stream.pump_scheduled = False
+        self._pump(stream)
+
+    def _pump(self, stream: FollowerStream):
+        # starts requests for the operations not sent yet, as long as the stream has room for them
+        batches = []
+        with self.lock:
+            if self.streams.get(stream.srv_ip) is not stream or stream.retry_at is not None:
+                return
+            if self.suspected is not None and self.suspected(stream.srv_ip) and stream.in_flight == 0:
+                # checked again after a while, the follower catches up once it's back
+                stream.retry_at = time.time() + BASE_BACKOFF
+                self.worker_pool.submit_after_delay(BASE_BACKOFF, self._resume, (stream,))
+                return
+            if stream.next_seq < self.first_seq:
+                # the operations it misses were dropped from the log, it has to get them with anti-entropy
+                stream.next_seq = self.first_seq
+                stream.skipped = True
+            while stream.in_flight < self.max_in_flight and stream.next_seq <= self.last_seq:
+                first = stream.next_seq
+                operations = self.log[first - self.first_seq:first - self.first_seq + self.max_batch]
+                batches.append((self.epoch, first, operations, stream.skipped, self.last_seq))
+                stream.next_seq += len(operations)
+                stream.in_flight += 1
+                stream.skipped = False
+        for batch in batches:
+            self.worker_pool.submit(self._send, (stream,) + batch)
+
+    def _send(self, stream: FollowerStream, epoch: str, first_seq: int, operations: list, skipped: bool,
+              last_seq: int):
+        ack = self.send(stream.srv_ip, epoch, first_seq, operations, skipped, last_seq)
+        with self.lock:
+            stream.in_flight -= 1
+            if self.streams.get(stream.srv_ip) is not stream:
+                return
+            if ack is None:
+                stream.failures += 1
+                # go back to the first operation the follower doesn't have
+                stream.next_seq = min(stream.next_seq, stream.acked + 1)
+                if stream.retry_at is None:
+                    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (stream.failures - 1))
+                    delay = random.uniform(delay / 2, delay)
+                    stream.retry_at = time.time() + delay
+                    self.worker_pool.submit_after_delay(delay, self._resume, (stream,))
+                return
+            stream.sent += len(operations)
+            stream.failures = 0
+            stream.acked = max(stream.acked, ack)
+            if stream.in_flight == 0 and stream.acked < stream.next_seq - 1:
+                # all answers are in and the follower still misses operations (e.g. it restarted, or they didn't
+                # fit in its reorder buffer), they are sent again
+                stream.next_seq = stream.acked + 1
+            self._trim()
+        self._pump(stream)
+
+    def _resume(self, stream: FollowerStream):
+        with self.lock:
+            stream.retry_at = None
+        self._pump(stream)
+
+    def _renew(self, stream: FollowerStream):
+        # runs every lease_renewal as long as the stream exists; a follower that was sent all operations and
+        # answered gets an empty request, otherwise the requests on the way renew its lease
+        with self.lock:
+            if self.streams.get(stream.srv_ip) is not stream:
+                return
+            idle = (stream.in_flight == 0 and stream.retry_at is None and stream.next_seq > self.last_seq
+                    and not (self.suspected is not None and self.suspected(stream.srv_ip)))
+            if idle:
+                stream.in_flight += 1
+                batch = (self.epoch, stream.next_seq, [], False, self.last_seq)
+        if idle:
+            self._send(stream, *batch)
+        self.worker_pool.submit_after_delay(self.lease_renewal, self._renew, (stream,))
+
+    def _trim(self):
+        # call holding self.lock; drops the operations all followers have, and the oldest beyond max_log
+        acked = min((stream.acked for stream in self.streams.values()), default=self.last_seq)
+        drop = max(acked - self.first_seq + 1, len(self.log) - self.max_log, 0)
+        if drop:
+            del self.log[:drop]
+            self.first_seq += drop
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {'epoch': self.epoch, 'last_seq': self.last_seq, 'log': len(self.log),
+                    'followers': {srv_ip: stream.to_dict(self.last_seq) for srv_ip, stream in self.streams.items()}}
+
+
+class ReplicationFollower:
+    """ Follower side of the replication: applies the operations of the leader's epoch strictly in the order of
+        their sequence numbers. Operations arriving ahead of a missing one wait in a reorder buffer of up to
+        window operations, duplicates are dropped.
+        The board of the follower is as fresh as the leader's was when the last request arrived whose last_seq the
+        follower has applied: the leader had no other operations then (up to the time the request was on its way).
+    """
+
+    def __init__(self, apply, window=REORDER_WINDOW):
+        # called with the list of operations that are next in order
+        self.apply = apply
+        self.window = window
+        self.epoch = None
+        self.applied = 0
+        # dictionary of shape seq: operation
+        self.buffer = dict()
+        # time from which on the follower had all operations of the leader, None until it had them once
+        self.fresh_at = None
+        # (last_seq, arrival time) of the requests whose last_seq wasn't applied yet, oldest first
+        self.pending = []
+        # set while the follower gets the operations the leader skipped with anti-entropy, see resynced
+        self.resyncing = False
+        self.lock = Lock()
+
+    def receive(self, epoch: str, first_seq: int, operations: list, skipped=False, last_seq=None) -> tuple:
+        # returns the highest sequence number applied in order (the ack) and whether the follower has to catch up
+        # with anti-entropy, because the leader no longer has operations it misses
+        received_at = time.time()
+        with self.lock:
+            if epoch != self.epoch:
+                # a new leader, its sequence numbers start at 1
+                self.epoch = epoch
+                self.applied = 0
+                self.buffer.clear()
+                self.pending = []
+            resync = skipped and first_seq > self.applied + 1
+            if resync:
+                self.applied = first_seq - 1
+                self.buffer = {seq: op for seq, op in self.buffer.items() if seq > self.applied}
+                # the board is only fresh again once anti-entropy got the operations that were skipped
+                self.pending = []
+                self.resyncing = True
+            for seq, operation in enumerate(operations, first_seq):
+                if self.applied < seq <= self.applied + self.window:
+                    self.buffer[seq] = operation
+            ready = []
+            while self.applied + 1 in self.buffer:
+                self.applied += 1
+                ready.append(self.buffer.pop(self.applied))
+            if ready:
+                self.apply(ready)
+            if last_seq is not None and not self.resyncing:
+                self.pending.append((last_seq, received_at))
+                del self.pending[:-MAX_PENDING_FRESHNESS]
+            while self.pending and self.pending[0][0] <= self.applied:
+                self.fresh_at = max(self.fresh_at or 0, self.pending.pop(0)[1])
+            return self.applied, resync
+
+    def resynced(self):
+        # called once anti-entropy got the operations the leader skipped
+        with self.lock:
+            self.resyncing = False
+
+    def staleness(self):
+        # seconds the board may be behind the leader's, None if it never had all operations of a leader
+        with self.lock:
+            return time.time() - self.fresh_at if self.fresh_at is not None else None
+
+    def apply_ahead(self, epoch: str, seq: int, operation: dict):
+        # applies an operation of a client of this server the leader answered with its sequence number, before the
+        # leader replicates it; the replicated operation is then a duplicate. Not applied if the operations up to
+        # seq were applied already, a later one of the leader may have changed the entry again
+        with self.lock:
+            if epoch == self.epoch and seq <= self.applied:
+                return
+            self.apply([operation])
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {'epoch': self.epoch, 'applied': self.applied, 'buffered': len(self.buffer),
+                    'staleness': time.time() - self.fresh_at if self.fresh_at is not None else None}
@@ -1,293 +1,800 @@
 # coding=utf-8
 import argparse
+import bisect
 import json
 import sys
-from threading import Lock, Thread
+from threading import Event, Lock
 import time
+from types import MappingProxyType
 import traceback
 from typing import Any
 
 import bottle
-from bottle import Bottle, request, template, run, static_file
-import requests
+from bottle import Bottle, HTTPResponse, request, response, template, run, static_file
+from batching import Batcher
+from board_changes import ChangeLog, INSERT, UPDATE, REMOVE
+from anti_entropy import BucketDigest, DEFAULT_SYNC_INTERVAL
+from election import ELECTIONS, DEFAULT_ELECTION, DEFAULT_RING_PROBES, ELECTION_TIMEOUT, NEXT
+from event_stream import Subscription, ThreadStreams, async_streams, stream_response, MAX_THREAD_STREAMS
+from failure_detector import FailureDetector, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_PHI_THRESHOLD
+from fanout import FanOut, DEFAULT_MAX_CONCURRENCY
+from journal import Journal, DEFAULT_FSYNC_INTERVAL, DEFAULT_SNAPSHOT_EVERY
+from peer_client import (PeerClient, DEFAULT_PEER_POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, DEFAULT_RETRIES,
+                         DEFAULT_RETRY_RATIO, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_RESET)
+from render_cache import RenderCache
+from replication import (ReplicationLog, ReplicationFollower, DEFAULT_MAX_IN_FLIGHT, DEFAULT_LEASE_RENEWAL,
+                         DEFAULT_FORWARD_WINDOW, DEFAULT_FORWARD_SIZE)
+from server_adapters import SERVER_MODES, DEFAULT_POOL_SIZE
+from worker_pool import WorkerPool, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
 import random
-import collections
 
+# operations are sent in batches of form fields, bottle refuses form bodies above MEMFILE_MAX (100 KiB) with a 413
+bottle.BaseRequest.MEMFILE_MAX = 16 * 1024 * 1024
 
 # ------------------------------------------------------------------------------------------------------
 
 class Blackboard:
+    """ Ordered map of element id: entry. The ids are kept in a sorted list next to the dict, so a write finds its
+        position with a bisect instead of re-sorting the whole board.
+    """
 
-    def __init__(self):
+    def __init__(self, journal=None):
         self.content = dict()
+        # sorted list of the keys of self.content, the order of the board
+        self.keys = list()
         self.counter = 0
         self.lock = Lock()  # use lock when you modify the content
+        # write-ahead log of every change, None if the board is only kept in memory
+        self.journal = journal
+        # digest of the entries for anti-entropy with the leader
+        self.digest = BucketDigest()
+        # version of the board and the changes browsers still have to apply
+        self.changes = ChangeLog()
+        # tuple of (version, read-only view of a copy of the content)
+        self.snapshot = (self.changes.version, MappingProxyType(dict()))
 
     def get_content(self) -> dict:
+        # immutable snapshot of the content, see get_versioned_content
+        return self.get_versioned_content()[1]
+
+    def get_versioned_content(self) -> tuple:
+        # the version and an immutable snapshot of the content. Writers change the content in place and only bump
+        # the version; readers of an unchanged board never wait for the lock. The first reader after a write
+        # captures the keys and content with two C-level copies under the lock and builds the ordered snapshot
+        # outside of it, so writers wait only for the capture (about 1 of 10 ms at 100k entries). The snapshot
+        # still costs O(n) once per version, and readers racing on the same version may each build one
+        snapshot = self.snapshot
+        if snapshot[0] == self.changes.version:
+            return snapshot
+        with self.lock:
+            version, keys, content = self.changes.version, list(self.keys), dict(self.content)
+        snapshot = (version, MappingProxyType({key: content[key] for key in keys}))
+        with self.lock:
+            # a reader that captured a later version may have published first
+            if self.snapshot[0] < version:
+                self.snapshot = snapshot
+        return snapshot
+
+    def get_changes(self, since: int, epoch: str) -> dict:
+        with self.lock:
+            return self.changes.delta(since, epoch)
+
+    def subscribe(self, since: int, epoch: str) -> Subscription:
         with self.lock:
-            cnt = self.content
-        return cnt
+            return self.changes.subscribe(since, epoch)
+
+    def restore(self):
+        # loads the latest snapshot of the journal and replays the records after it
+        journal, self.journal = self.journal, None
+        state, records = journal.load()
+        if state is not None:
+            with self.lock:
+                self.keys = state['keys']
+                self.content = dict(zip(state['keys'], state['values']))
+                self.counter = state['counter']
+                self.digest.hashes = state['digest']
+        for record in records:
+            if record[0] == 'add':
+                self.add_content(record[1])
+            elif record[0] == 'set':
+                self.set_content(record[1], record[2])
+            elif record[0] == 'del':
+                self.del_content(record[1])
+            elif record[0] == 'ops':
+                self.apply_operations(record[1])
+            elif record[0] == 'lead':
+                self.apply_operations(record[1])
+                with self.lock:
+                    self.counter = max(self.counter, record[2])
+            elif record[0] == 'sync':
+                with self.lock:
+                    self._apply_synced(record[1])
+        with self.lock:
+            # browsers showing an older version have to reload the board
+            self.changes.reset()
+        self.journal = journal
+        print('Restored {} entries ({} records replayed)'.format(len(self.content), len(records)))
+
+    def _state(self) -> dict:
+        # call with the lock held; a copy of the board for a snapshot of the journal
+        return {'keys': list(self.keys), 'values': [self.content[key] for key in self.keys], 'counter': self.counter,
+                'digest': self.digest.to_list()}
+
+    def _journal(self, record: list):
+        # call with the lock held, after the change was applied
+        if self.journal is not None and self.journal.append(record):
+            self.journal.snapshot(self._state())
 
     def add_content(self, new_entry: str) -> str:
         with self.lock:
-            self.content[self.counter] = new_entry
+            self._apply('submit', self.counter, new_entry)
             element_id = str(self.counter)
             self.counter += 1
+            self._journal(['add', new_entry])
         return element_id
 
     def set_content(self, index: str, new_content: str):
         with self.lock:
-            self.content[int(index)] = new_content
-            self.counter = len(self.content)
-            # ordering the dict
-            self.content = collections.OrderedDict(sorted(self.content.items()))
+            self._apply('modify', int(index), new_content)
+            self._journal(['set', index, new_content])
         return
 
     def del_content(self, index: str):
         with self.lock:
-            self.content.pop(int(index))
-            self.counter = len(self.content)
+            if int(index) not in self.content:
+                raise KeyError(int(index))
+            self._apply('delete', int(index))
+            self._journal(['del', index])
         return
 
+    def lead_operations(self, operations: list) -> list:
+        # applies operations of shape {'action': ..., 'element_id': ..., 'entry': ...} as leader, acquiring the
+        # lock once; new entries get the next ids in bulk. Returns the operations applied, with the ids of the new
+        # entries, and None for a delete of an entry that doesn't exist
+        with self.lock:
+            applied = list()
+            for op in operations:
+                if op['action'] == 'submit':
+                    element_id = self.counter
+                    self.counter += 1
+                else:
+                    element_id = int(op['element_id'])
+                    if op['action'] == 'delete' and element_id not in self.content:
+                        applied.append(None)
+                        continue
+                self._apply(op['action'], element_id, op.get('entry'))
+                applied.append({'action': op['action'], 'element_id': str(element_id), 'entry': op.get('entry')})
+            done = [op for op in applied if op is not None]
+            if done:
+                self._journal(['lead', done, self.counter])
+        return applied
+
+    def apply_operations(self, operations: list):
+        # applies operations propagated by the leader of shape {'action': ..., 'element_id': ..., 'entry': ...}
+        # in order, acquiring the lock only once for the whole batch
+        with self.lock:
+            for op in operations:
+                self._apply(op['action'], int(op['element_id']), op.get('entry'))
+            if self.keys:
+                self.counter = max(self.counter, self.keys[-1] + 1)
+            self._journal(['ops', operations])
+        return
+
+    def get_digest(self) -> list:
+        with self.lock:
+            return self.digest.to_list()
+
+    def get_entries(self, digest: list) -> tuple:
+        # the buckets in which digest (of another server) differs from this board's and the entries in them,
+        # as list of [element id, entry]
+        with self.lock:
+            buckets = self.digest.differing(digest)
+            entries = [[key, self.content[key]] for key in self.keys if self.digest.bucket(key) in buckets]
+        return sorted(buckets), entries
+
+    def sync_entries(self, buckets: list, entries: list, replace: bool) -> int:
+        # takes over the entries another server sent for buckets, see get_entries. With replace the buckets end up
+        # the same as on the other server, otherwise only the entries missing here are added
+        # returns the number of operations applied
+        buckets = set(buckets)
+        entries = {int(key): entry for key, entry in entries}
+        with self.lock:
+            operations = list()
+            if replace:
+                operations += [{'action': 'delete', 'element_id': key} for key in self.keys
+                               if key not in entries and self.digest.bucket(key) in buckets]
+            for key, entry in sorted(entries.items()):
+                if key not in self.content:
+                    operations.append({'action': 'submit', 'element_id': key, 'entry': entry})
+                elif replace and self.content[key] != entry:
+                    operations.append({'action': 'modify', 'element_id': key, 'entry': entry})
+            if operations:
+                self._apply_synced(operations)
+                self._journal(['sync', operations])
+        return len(operations)
+
+    def _apply_synced(self, operations: list):
+        # call with the lock held; the counter stays above every id on the board, so this server hands out new ids
+        # if it becomes the leader
+        for op in operations:
+            self._apply(op['action'], op['element_id'], op.get('entry'))
+        if self.keys:
+            self.counter = max(self.counter, self.keys[-1] + 1)
+
+    def _apply(self, action: str, index: int, entry=None):
+        # call with the lock held; the position of the entry on the board is a bisect of the sorted keys
+        if action == 'delete':
+            if index in self.content:
+                position = bisect.bisect_left(self.keys, index)
+                self.digest.toggle(index, self.content.pop(index))
+                del self.keys[position]
+                self.changes.record(REMOVE, position, index)
+        elif index in self.content:
+            self.digest.toggle(index, self.content[index])
+            self.digest.toggle(index, entry)
+            self.content[index] = entry
+            self.changes.record(UPDATE, bisect.bisect_left(self.keys, index), index, entry)
+        else:
+            position = bisect.bisect_left(self.keys, index)
+            self.digest.toggle(index, entry)
+            self.content[index] = entry
+            self.keys.insert(position, index)
+            self.changes.record(INSERT, position, index, entry)
+
 
 # ------------------------------------------------------------------------------------------------------
 class ServerDict(dict):
     """ Dictionary of shape server_ip: (rnd_number, next_ip).
-        Stores all servers' ip addresses in the ring with its rnd_number and its successor's ip address
+        Stores all servers' ip addresses in the ring with its rnd_number and its successor's ip address.
+        The servers following this one are kept in ring order in successors, so a message for the next server
+        can skip any number of failed servers at once instead of following the next_ip of every one of them.
     """
 
-    def __init__(self, ip, rnd_number):
+    def __init__(self, ip, rnd_number, servers_list=()):
         super().__init__()
         self.__ip = ip
         self.__rnd_number = rnd_number
         self.leader_ip = None
+        # ips of the other servers, the next server first
+        self.successors = []
+        # the random numbers of the others are only known after an election collecting them
+        self.set_ring([(srv_ip, rnd_number if srv_ip == ip else None) for srv_ip in servers_list])
+
+    def set_ring(self, members: list):
+        # members is the list of (server_ip, rnd_number) in ring order, the own server is added if missing
+        ips = [srv_ip for srv_ip, _ in members]
+        if self.__ip not in ips:
+            members = list(members) + [(self.__ip, self.__rnd_number)]
+            ips.append(self.__ip)
+        self.clear()
+        for i, (srv_ip, rnd_number) in enumerate(members):
+            self[srv_ip] = (rnd_number, ips[(i + 1) % len(ips)])
+        index = ips.index(self.__ip)
+        self.successors = ips[index + 1:] + ips[:index]
 
     @property
     def next_ip(self):
-        return self.__getitem__(self.__ip)[1]
+        return self.successors[0] if self.successors else self.__ip
+
+    def ring(self) -> list:
+        # ips of the ring in order, starting with the own ip
+        return [self.__ip] + self.successors
+
 
-    @next_ip.setter
-    def next_ip(self, value: str):
-        self.__setitem__(self.__ip, (self.__rnd_number, value))
+# ------------------------------------------------------------------------------------------------------
+class ForwardedWrite:
+    """ A write of a client of this follower on its way to the leader, see Server.forward_to_leader """
+
+    def __init__(self, operation: dict):
+        self.operation = operation
+        # answer of the leader of shape {'element_id': ..., 'epoch': ..., 'seq': ...}, None if it failed
+        self.answer = None
+        # status and body for the client if the write failed
+        self.status = 503
+        self.error = 'no leader, try again'
+        self.done = Event()
 
 
 # ------------------------------------------------------------------------------------------------------
 class Server(Bottle):
 
-    def __init__(self, ID, IP, servers_list: list):
+    def __init__(self, ID, IP, servers_list: list, peer_client=None, fan_out=None, worker_pool=None,
+                 journal=None,
+                 sync_interval=DEFAULT_SYNC_INTERVAL, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 phi_threshold=DEFAULT_PHI_THRESHOLD, election=DEFAULT_ELECTION, ring_probes=DEFAULT_RING_PROBES,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, lease_renewal=DEFAULT_LEASE_RENEWAL,
+                 forward_window=DEFAULT_FORWARD_WINDOW, forward_size=DEFAULT_FORWARD_SIZE,
+                 max_thread_streams=MAX_THREAD_STREAMS):
         super(Server, self).__init__()
-        self.blackboard = Blackboard()
+        self.blackboard = Blackboard(journal)
+        if journal is not None:
+            self.blackboard.restore()
         self.id = int(ID)
         self.ip = str(IP)
+        # keep-alive connections to the other servers, shared by all outgoing messages
+        self.peer_client = peer_client or PeerClient()
+        # parallel broadcasts to the other servers
+        self.fan_out = fan_out or FanOut()
+        # threads running all background tasks
+        self.worker_pool = worker_pool or WorkerPool()
+        # pages rendered from the blackboard, by version of the blackboard
+        self.render_cache = RenderCache()
+        # /board/stream clients held by request threads, the browsers only stream if the server runs asyncio
+        self.thread_streams = ThreadStreams(max_thread_streams)
+        # held by the leader while it applies operations and appends them to the replication log, so both have
+        # the same order
+        self.leader_lock = Lock()
+        # writes of the clients of a follower forwarded to the leader together, None to send every one on its own
+        self.forwarder = (Batcher(self.worker_pool, self.forward_to_leader, window=forward_window,
+                                  max_size=forward_size) if forward_size > 1 else None)
         # LE attribute
         self.rnd_number = random.randint(0, 10 ** 6)
         # dictionary of shape server_ip: (rnd_number, next_ip) to store all ips and random numbers of
         # all servers
-        self.svrs_dict = ServerDict(ip=self.ip, rnd_number=self.rnd_number)
-        # create the ring structure
-        index = servers_list.index(self.ip)
-        self.svrs_dict.next_ip = servers_list[(index + 1) % len(servers_list)]
+        self.svrs_dict = ServerDict(ip=self.ip, rnd_number=self.rnd_number, servers_list=servers_list)
         print(self.svrs_dict)
+        # number of the servers following a failed one that are probed at the same time
+        self.ring_probes = ring_probes
+        # leader election in the ring, see election.ELECTIONS
+        self.election = ELECTIONS[election](self.ip, self.rnd_number, self.send_election_message_async,
+                                            self.set_leader)
+        # suspicion level of every other server from heartbeats
+        self.failure_detector = FailureDetector(self.worker_pool, self.peer_client,
+                                                [srv_ip for srv_ip in servers_list if srv_ip != self.ip],
+                                                interval=heartbeat_interval, threshold=phi_threshold, ip=self.ip)
+        self.failure_detector.start()
+        # the leader's numbered operations with the progress of every follower, and this server's progress
+        # as follower
+        self.replication = ReplicationLog(self.worker_pool, self.send_replicated, max_in_flight=max_in_flight,
+                                          suspected=self.failure_detector.suspected, lease_renewal=lease_renewal)
+        self.follower = ReplicationFollower(self.blackboard.apply_operations)
+        # reads with max_staleness served by this server, redirected to the leader or refused without a leader
+        self.reads = {'local': 0, 'redirected': 0, 'unavailable': 0}
+        # requests a follower sent to the leader and the writes in them
+        self.forwarded = {'requests': 0, 'writes': 0}
+        self.metrics_lock = Lock()
+        # set once this server, as newly elected leader, took over the entries only its followers have;
+        # until then it doesn't let followers replace their boards with its own
+        self.leader_synced = Event()
+        # seconds between two anti-entropy rounds of a follower with the leader, 0 to only sync after elections
+        self.sync_interval = sync_interval
+        if sync_interval > 0:
+            self.do_parallel_task_after_delay(sync_interval, self.sync_periodically)
         # list all REST URIs
         # if you add new URIs to the server, you need to add them here
         self.route('/', callback=self.index)
         self.get('/board', callback=self.get_board)
+        # changes of the board since the version a browser shows
+        self.get('/board/changes', callback=self.get_board_changes)
+        # server-sent events with the changes of the board
+        self.get('/board/stream', callback=self.get_board_stream)
         self.post('/board', callback=self.post_board)
         self.post('/board/<element_id:int>/', callback=self.post_modify)
         # we give access to the templates elements
         self.get('/templates/<filename:path>', callback=self.get_template)
+        # health of the connections to the other servers
+        self.get('/stats', callback=self.get_stats)
+        # the failure detectors of the other servers check that this server is alive
+        self.get('/heartbeat', callback=self.get_heartbeat)
         # leader propagates new entries to all followers
         self.post('/propagate', callback=self.post_propagate)
         # propagate submit, modify or delete an entry to the leader
         self.post('/propagate_leader', callback=self.post_propagate_leader)
         # send election messages to the next server in the ring
         self.post('/leader_election', callback=self.post_leader_election)
+        # anti-entropy: another server sends the digest of its board and gets the entries which differ
+        self.post('/sync', callback=self.post_sync)
         # You can have variables in the URI, here's an example self.post('/board/<element_id:int>/',
         # callback=self.post_board) where post_board takes an argument (integer) called element_id
 
     def do_parallel_task(self, method, args=None):
-        # create a thread running a new task Usage example: self.do_parallel_task(self.contact_another_server,
-        # args=("10.1.0.2", "/index", "POST", params_dict)) this would start a thread sending a post request to
-        # server 10.1.0.2 with URI /index and with params params_dict
-        thread = Thread(target=method,
-                        args=args)
-        thread.daemon = True
-        thread.start()
+        # run a task on the worker pool Usage example: self.do_parallel_task(self.contact_another_server,
+        # args=("10.1.0.2", "/index", "POST", params_dict)) this would send a post request to
+        # server 10.1.0.2 with URI /index and with params params_dict from one of the pool's threads
+        self.worker_pool.submit(method, args)
 
     def do_parallel_task_after_delay(self, delay, method, args=None):
-        # create a thread, and run a task after a specified delay
+        # run a task on the worker pool after a specified delay
         # Usage example: self.do_parallel_task_after_delay(10, self.start_election, args=(,))
-        # this would start a thread starting an election after 10 seconds
-        thread = Thread(target=self._wrapper_delay_and_execute,
-                        args=(delay, method, args))
-        thread.daemon = True
-        thread.start()
-
-    def _wrapper_delay_and_execute(self, delay, method, args):
-        time.sleep(delay)  # in sec
-        method(*args)
+        # this would start an election after 10 seconds
+        self.worker_pool.submit_after_delay(delay, method, args)
 
     def contact_another_server(self, srv_ip, URI, req='POST', params_dict=None):
-        # Try to contact another server through a POST or GET
+        # Try to contact another server through a POST or GET, reusing the pooled connections to that server
         # usage: server.contact_another_server("10.1.1.1", "/index", "POST", params_dict)
-        success = False
-        try:
-            res = 0
-            if 'POST' in req:
-                res = requests.post('http://{}{}'.format(srv_ip, URI),
-                                    data=params_dict)
-            elif 'GET' in req:
-                res = requests.get('http://{}{}'.format(srv_ip, URI))
-            # result can be accessed res.json()
-            if res.status_code == 200:
-                success = True
-        except Exception as e:
-            print("[ERROR] " + str(e))
-        return success
+        return self.peer_client.contact(srv_ip, URI, req, params_dict)
 
     def start_leader_election(self):
-        # put ip and random number in a string separated by "|" and send it to the next server
-        # every server concatenates the string with its own ip and random number
-        # the own ip is send to check if the message travelled around the ring
-        servers_str = self.ip + '|' + str(self.rnd_number) + '|'
-        self.do_parallel_task(self.send_election_message,
-                              args=('election', servers_str, self.ip))
-
-    def send_election_message(self, action, servers_str, init_ip):
-        # sends an election message to the next server and if it fails to the next's next server
-        success = self.contact_another_server(self.svrs_dict.next_ip, '/leader_election', 'POST',
-                                              {'action': action,
-                                               'servers_dict': servers_str,
-                                               'initiator_ip': init_ip})
-        if not success:
-            # Set own next_ip to the next server's next_ip in the ring and try again
-            self.svrs_dict.next_ip = self.svrs_dict[self.svrs_dict.next_ip][1]
-            self.send_election_message(action, servers_str, init_ip)
+        if self.election.start():
+            self.do_parallel_task_after_delay(ELECTION_TIMEOUT, self.check_leader_election)
+
+    def check_leader_election(self):
+        # an election that didn't end, e.g. its messages were lost, is started again until a leader is known
+        if self.svrs_dict.leader_ip is None or self.election.participant:
+            self.election.start()
+            self.do_parallel_task_after_delay(ELECTION_TIMEOUT, self.check_leader_election)
+
+    def send_election_message_async(self, fields: dict, direction: str, srv_ip=None):
+        # called by the election holding its lock, the message is sent from the worker pool
+        self.do_parallel_task(self.send_election_message, args=(fields, direction, srv_ip))
+
+    def send_election_message(self, fields: dict, direction=NEXT, srv_ip=None):
+        # sends an election message to the nearest live server in direction. Suspected servers are skipped at once;
+        # if the nearest server fails, the following ones are probed ring_probes at a time in parallel and the
+        # message goes to the nearest that answered, so failed servers cost one timeout per window, not one each.
+        # A message for srv_ip, an answer, goes to srv_ip only
+        if srv_ip is not None:
+            self.contact_another_server(srv_ip, '/leader_election', 'POST', fields)
+            return
+        ring = self.svrs_dict.successors if direction == NEXT else self.svrs_dict.successors[::-1]
+        # if every server is suspected the failure detector is probably wrong, e.g. right after the start
+        candidates = [srv_ip for srv_ip in ring if not self.failure_detector.suspected(srv_ip)] or ring
+        if candidates and self.contact_another_server(candidates[0], '/leader_election', 'POST', fields):
+            return
+        for start in range(1, len(candidates), self.ring_probes):
+            window = candidates[start:start + self.ring_probes]
+            alive = self.fan_out.broadcast(window, self.probe)
+            for srv_ip in window:
+                if alive[srv_ip] and self.contact_another_server(srv_ip, '/leader_election', 'POST', fields):
+                    return
+        # no other server answered, this one is alone in the ring
+        self.election.receive(fields)
+
+    def probe(self, srv_ip) -> bool:
+        # True if srv_ip answers at all
+        return self.contact_another_server(srv_ip, '/heartbeat', 'GET')
 
     def post_leader_election(self):
-        action = request.forms.get('action')
-        servers_str = request.forms.get('servers_dict')
-        init_ip = request.forms.get('initiator_ip')
-
-        if action == 'election':
-            # add own ip and random number to the string and send the message to the next server
-            # if the message travelled around the ring the message type changes to coordination
-            print('election')
-            if init_ip == self.ip:
-                action = 'coordination'
+        fields = {key: request.forms.get(key) for key in request.forms.keys()}
+        if fields.get('sender'):
+            # the answer of the election may go straight back to the sender, e.g. a server that just restarted
+            self.peer_seen(fields['sender'])
+        self.election.receive(fields)
+
+    def peer_seen(self, srv_ip):
+        # srv_ip sent this server a request, so it is up again: it isn't suspected anymore and its circuit is closed
+        self.failure_detector.seen(srv_ip)
+        self.peer_client.reachable(srv_ip)
+
+    def set_leader(self, leader_ip, members):
+        # called by the election once the leader is known, members are the live servers in ring order if the
+        # election collected them
+        if members is not None:
+            # remove all servers from the ring inclusive the dead ones
+            self.svrs_dict.set_ring(members)
+        # the replication log has its epoch before operations are taken as leader
+        if leader_ip == self.ip:
+            self.replication.start(self.svrs_dict.successors)
+        else:
+            self.replication.stop()
+        self.svrs_dict.leader_ip = leader_ip
+        print('leader ' + leader_ip)
+        self.do_parallel_task(self.sync_after_election)
+
+    def sync_with(self, srv_ip, replace: bool) -> bool:
+        # pulls the entries which differ from srv_ip in one round trip, see Blackboard.sync_entries
+        try:
+            res = self.peer_client.request(srv_ip, '/sync', 'POST',
+                                           {'digest': json.dumps(self.blackboard.get_digest()),
+                                            'replace': '1' if replace else '0'})
+            res.raise_for_status()
+            answer = res.json()
+        except Exception as e:
+            print("[WARNING ]Could not sync with server {}: {}".format(srv_ip, e))
+            return False
+        applied = self.blackboard.sync_entries(answer['buckets'], answer['entries'], replace)
+        if applied > 0:
+            print('Applied {} operations from server {}'.format(applied, srv_ip))
+        return True
+
+    def sync_after_election(self, attempts=10):
+        # a new leader first takes over the entries only its followers have (e.g. it restarted with an empty board),
+        # then the followers replace their boards with the leader's
+        if self.svrs_dict.leader_ip == self.ip:
+            self.leader_synced.clear()
+            peers = [srv_ip for srv_ip in list(self.svrs_dict) if srv_ip != self.ip]
+            self.fan_out.broadcast(peers, lambda srv_ip: self.sync_with(srv_ip, replace=False))
+            self.leader_synced.set()
+        elif not self.sync_with(self.svrs_dict.leader_ip, replace=True) and attempts > 1:
+            # the leader may not know yet that it was elected
+            self.do_parallel_task_after_delay(1, self.sync_after_election, args=(attempts - 1,))
+
+    def sync_periodically(self):
+        # repairs operations this follower missed, e.g. a /propagate that failed; while no leader is known, e.g.
+        # during an election or after starting late, the entries of a random live server are merged instead
+        leader_ip = self.svrs_dict.leader_ip
+        if leader_ip is None:
+            peers = [srv_ip for srv_ip in self.svrs_dict.successors if not self.failure_detector.suspected(srv_ip)]
+            if peers:
+                self.sync_with(random.choice(peers), replace=False)
+        elif leader_ip != self.ip:
+            self.sync_with(leader_ip, replace=True)
+        self.do_parallel_task_after_delay(self.sync_interval, self.sync_periodically)
+
+    def resync_with_leader(self, leader_ip, attempts=10):
+        # gets the operations the leader skipped when replicating to this follower, the board counts as stale
+        # until they are here
+        if self.sync_with(leader_ip, replace=True):
+            self.follower.resynced()
+        elif attempts > 1 and leader_ip == self.svrs_dict.leader_ip:
+            self.do_parallel_task_after_delay(1, self.resync_with_leader, args=(leader_ip, attempts - 1))
+
+    # post to ('/sync')
+    def post_sync(self):
+        try:
+            digest = json.loads(request.forms.get('digest'))
+        except (TypeError, ValueError):
+            response.status = 400
+            return 'digest missing'
+        if request.forms.get('replace') == '1' and not (self.svrs_dict.leader_ip == self.ip
+                                                        and self.leader_synced.is_set()):
+            # only the leader's board replaces a follower's, once it has all entries of the followers
+            response.status = 503
+            return 'not the leader or not synced yet'
+        buckets, entries = self.blackboard.get_entries(digest)
+        return {'buckets': buckets, 'entries': entries}
+
+    def propagate_to_all_servers(self, URI='/propagate', req='POST', params_dict=None) -> dict:
+        # the leader contacts all followers in parallel and returns a dictionary of shape server_ip: success, None
+        # for the followers that didn't answer in time and may still apply the message, see FanOut.broadcast
+        # followers suspected by the failure detector count as failed without waiting for a timeout,
+        # they catch up with anti-entropy once they are back
+        peers = [srv_ip for srv_ip in list(self.svrs_dict) if srv_ip != self.ip]  # don't propagate to yourself
+        suspected = [srv_ip for srv_ip in peers if self.failure_detector.suspected(srv_ip)]
+        results = self.fan_out.broadcast([srv_ip for srv_ip in peers if srv_ip not in suspected],
+                                         lambda srv_ip: self.contact_another_server(srv_ip, URI, req, params_dict))
+        for srv_ip, success in results.items():
+            if success is None:
+                print("[WARNING ]No answer of server {} in time, it may still apply the message".format(srv_ip))
+            elif not success:
+                print("[WARNING ]Could not contact server {}".format(srv_ip))
+        for srv_ip in suspected:
+            print("[WARNING ]Skipping suspected server {}".format(srv_ip))
+            results[srv_ip] = False
+        return results
+
+    def send_replicated(self, srv_ip, epoch: str, first_seq: int, operations: list, skipped: bool, last_seq: int):
+        # sends operations of the replication log to a follower, returns its ack or None if the request failed
+        try:
+            res = self.peer_client.request(srv_ip, '/propagate', 'POST',
+                                           {'leader': self.ip, 'epoch': epoch, 'first_seq': str(first_seq),
+                                            'batch': json.dumps(operations), 'skipped': '1' if skipped else '0',
+                                            'last_seq': str(last_seq)})
+            res.raise_for_status()
+            return int(res.json()['ack'])
+        except Exception as e:
+            print("[WARNING ]Could not replicate to server {}: {}".format(srv_ip, e))
+            return None
+
+    def lead(self, operations: list) -> list:
+        # the leader applies operations and appends them to the replication log, which numbers them and sends them
+        # to every follower; returns for every operation the element id (new for a submit) and the epoch and
+        # sequence number it is replicated with, None for a delete of an entry that doesn't exist
+        with self.leader_lock:
+            applied = self.blackboard.lead_operations(operations)
+            done = [op for op in applied if op is not None]
+            epoch, last_seq = self.replication.append(done)
+        answers = list()
+        seq = last_seq - len(done) if last_seq is not None else None
+        for op in applied:
+            if op is None:
+                answers.append(None)
+                continue
+            seq = seq + 1 if seq is not None else None
+            answers.append({'element_id': op['element_id'], 'epoch': epoch, 'seq': seq})
+        return answers
+
+    def propagate_to_leader(self, action, element_id=None, entry=None):
+        # the write of a client of this server is applied by the leader, which answers with the element id;
+        # a follower applies it at once, so the client sees its write without waiting for the replication
+        operation = {'action': action, 'element_id': element_id, 'entry': entry}
+        if self.svrs_dict.leader_ip == self.ip:
+            answer = self.lead([operation])[0]
+            if answer is None:
+                response.status = 404
+                return 'no entry {}'.format(element_id)
+            return answer
+        write = ForwardedWrite(operation)
+        if self.forwarder is None:
+            self.forward_to_leader([write])
+        else:
+            self.forwarder.add(write)
+        # the client waits for one request to the leader at most, including the time the write is collected;
+        # the write may still be applied if the leader answers later
+        if not write.done.wait(sum(self.peer_client.timeout)):
+            print("[WARNING ]No answer of leader {} in time".format(self.svrs_dict.leader_ip))
+            response.status = 503
+            return 'no answer of the leader in time, try again'
+        if write.answer is None:
+            response.status = write.status
+            return write.error
+        return write.answer
+
+    def forward_to_leader(self, writes: list):
+        # sends the writes of the clients of this follower to the leader in one request and applies them as the
+        # leader answers; if the leader can't be reached a new election is started and the clients get 503,
+        # a leader suspected by the failure detector isn't waited for
+        leader_ip = self.svrs_dict.leader_ip
+        try:
+            if leader_ip is None or self.failure_detector.suspected(leader_ip):
+                raise ConnectionError('leader {} is suspected'.format(leader_ip))
+            with self.metrics_lock:
+                self.forwarded['requests'] += 1
+                self.forwarded['writes'] += len(writes)
+            res = self.peer_client.request(leader_ip, '/propagate_leader', 'POST',
+                                           {'batch': json.dumps([write.operation for write in writes])})
+            if res.status_code == 200:
+                for write, answer in zip(writes, res.json()['results']):
+                    if answer is None:
+                        write.status, write.error = 404, 'no entry {}'.format(write.operation['element_id'])
+                        continue
+                    operation = dict(write.operation, element_id=answer['element_id'])
+                    self.follower.apply_ahead(answer['epoch'], answer['seq'], operation)
+                    write.answer = answer
             else:
-                servers_str += str(self.ip) + '|' + str(self.rnd_number) + '|'
-            self.do_parallel_task(self.send_election_message, args=(action, servers_str, init_ip))
-        elif action == 'coordination':
-            # the election message travelled around the ring and collected all ips and random numbers.
-            # these information will be stored in svrs_dict
-
-            # remove all servers from the dictionary inclusive the dead ones
-            self.svrs_dict.clear()
-            if servers_str[-1] == '|':
-                servers_str = servers_str[:-1]
-            servers_list = servers_str.split('|')
-            # list of all server_ip's
-            ip_list = servers_list[0::2]
-            # list of all rnd_number's
-            rnd_list = [int(i) for i in servers_list[1::2]]
-            # make a dictionary of shape server_ip: (rnd_number, next_ip)
-            for i in range(0, len(ip_list)):
-                self.svrs_dict[ip_list[i]] = (rnd_list[i], ip_list[(i + 1) % len(ip_list)])
-            # get a list of all indices of rnd_list where rnd_number max is
-            max_indices = [i for i, j in enumerate(rnd_list) if j == max(rnd_list)]
-            # get a list of IPs where rnd_number max is
-            max_ip_list = [ip_list[i] for i in max_indices]
-            # leader_ip is the max ip where rnd_number max is
-            self.svrs_dict.leader_ip = max(max_ip_list)
-            print('leader ' + self.svrs_dict.leader_ip)
-
-            if self.ip != init_ip:
-                # send coordination message to the next server
-                self.do_parallel_task(self.contact_another_server,
-                                      args=(self.svrs_dict.next_ip, '/leader_election', 'POST',
-                                            {'action': 'coordination',
-                                             'servers_dict': servers_str,
-                                             'initiator_ip': init_ip}))
-
-    def propagate_to_all_servers(self, URI='/propagate', req='POST', params_dict=None):
-        for srv_ip in self.svrs_dict:
-            if srv_ip != self.ip:  # don't propagate to yourself
-                success = self.contact_another_server(srv_ip, URI, req, params_dict)
-                if not success:
-                    print("[WARNING ]Could not contact server {}".format(srv_ip))
-
-    def propagate_to_leader(self, URI, req='POST', params_dict=None):
-        # tries to connect to the leader and if it fails starts a new election
-        success = self.contact_another_server(self.svrs_dict.leader_ip, URI, req, params_dict)
-        if not success:
-            print("[WARNING ]Could not contact leader {}. \nStarting election".format(
-                self.svrs_dict.leader_ip))
+                # e.g. the server isn't the leader any more
+                for write in writes:
+                    write.status, write.error = res.status_code, res.text
+        except Exception as e:
+            print("[WARNING ]Could not contact leader {}: {} \nStarting election".format(leader_ip, e))
             self.start_leader_election()
+        finally:
+            for write in writes:
+                write.done.set()
 
     # post to ('/propagate_leader')
     def post_propagate_leader(self):
-        # followers sends to this uri.
-        # information will be stored locally and propagated to all followers
-        action = request.forms.get('action')
-
-        if action == 'submit':
-            entry = request.forms.get('entry')
-            element_id = self.blackboard.add_content(entry)
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST',
-                                        {'action': 'submit', 'entry': entry, 'element_id': element_id}))
-        elif action == 'modify':
-            entry = request.forms.get('entry')
-            element_id = request.forms.get('element_id')
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST',
-                                        {'action': 'modify', 'element_id': element_id, 'entry': entry}))
-            self.blackboard.set_content(element_id, entry)
-        elif action == 'delete':
-            element_id = request.forms.get('element_id')
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST',
-                                        {'action': 'delete', 'element_id': element_id}))
-            self.blackboard.del_content(element_id)
+        # followers send the writes of their clients to this uri, as json list of operations or a single operation
+        # as form fields; they are answered with the element ids, in the same order
+        if self.svrs_dict.leader_ip != self.ip:
+            response.status = 503
+            return 'not the leader'
+        batch = request.forms.get('batch')
+        if batch is not None:
+            operations = json.loads(batch)
+        else:
+            operations = [{'action': request.forms.get('action'),
+                           'element_id': request.forms.get('element_id'),
+                           'entry': request.forms.get('entry')}]
+        return {'results': self.lead(operations)}
 
     # post to ('/propagate')
     def post_propagate(self):
         # follower stores the information received by the leader in the local blackboard
-        action = request.forms.get('action')
-        element_id = request.forms.get('element_id')
-
-        if action == 'submit':
-            entry = request.forms.get('entry')
-            self.blackboard.set_content(element_id, entry)
-        elif action == 'modify':
-            entry = request.forms.get('entry')
-            self.blackboard.set_content(element_id, entry)
-        elif action == 'delete':
-            self.blackboard.del_content(element_id)
+        # a batch is sent as json list of operations, a single operation as form fields
+        batch = request.forms.get('batch')
+        if request.forms.get('first_seq') is not None:
+            # numbered operations of the leader's replication log, applied in order and acknowledged
+            leader_ip = request.forms.get('leader')
+            if leader_ip != self.svrs_dict.leader_ip:
+                response.status = 409
+                return 'not the leader'
+            last_seq = request.forms.get('last_seq')
+            ack, resync = self.follower.receive(request.forms.get('epoch'), int(request.forms.get('first_seq')),
+                                                json.loads(batch), request.forms.get('skipped') == '1',
+                                                int(last_seq) if last_seq is not None else None)
+            if resync:
+                self.do_parallel_task(self.resync_with_leader, args=(leader_ip,))
+            return {'ack': ack}
+        if batch is not None:
+            operations = json.loads(batch)
+        else:
+            operations = [{'action': request.forms.get('action'),
+                           'element_id': request.forms.get('element_id'),
+                           'entry': request.forms.get('entry')}]
+        self.blackboard.apply_operations(operations)
+
+    def board_page(self, name: str, render, *key):
+        # the page rendered from the current version of the blackboard, render(board, version) is only called if
+        # the page isn't in the render cache yet; key are the other values the page depends on
+        # returns the version and the page
+        version = self.blackboard.changes.version
+        page = self.render_cache.get((name, version) + key)
+        if page is None:
+            # we must transform the blackboard as a dict for compatibility reasons
+            version, board = self.blackboard.get_versioned_content()
+            page = self.render_cache.put((name, version) + key, render(board, version))
+        return version, page
 
     # route to ('/')
     def index(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
         role = 'leader' if self.svrs_dict.leader_ip == self.ip else 'follower'
-        return template('server/templates/index.tpl',
-                        board_title='Server {} ({}) - #: {} - {}'.format(self.id, self.ip,
-                                                                         self.rnd_number, role),
-                        board_dict=board.items(),
-                        members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        board_title = 'Server {} ({}) - #: {} - {}'.format(self.id, self.ip, self.rnd_number, role)
+        # browsers open /board/stream only if an open stream doesn't hold a request thread
+        stream = async_streams(request.environ)
+
+        def render(board, version):
+            return template('server/templates/index.tpl',
+                            board_title=board_title,
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream,
+                            members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        return self.board_page('index', render, board_title, stream)[1].send()
+
+    def staleness(self):
+        # seconds the board of this server may be behind the leader's, None if not known;
+        # a newly elected leader is up to date once it took over the entries only its followers have
+        if self.svrs_dict.leader_ip == self.ip:
+            return 0.0 if self.leader_synced.is_set() else None
+        return self.follower.staleness()
+
+    def count_read(self, kind: str):
+        with self.metrics_lock:
+            self.reads[kind] += 1
 
     # get on ('/board')
     def get_board(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
-        role = 'leader' if self.svrs_dict.leader_ip == self.ip else 'follower'
-        return template('server/templates/blackboard.tpl',
-                        board_title='Server {} ({}) - #: {} - {}'.format(self.id, self.ip,
-                                                                         self.rnd_number, role),
-                        board_dict=board.items())
+        # ?max_staleness=<ms>: served by this server if its board is at most that far behind the leader's,
+        # otherwise the client is redirected to the leader; the X-Staleness header has the staleness in ms
+        headers = dict()
+        max_staleness = request.query.get('max_staleness')
+        if max_staleness is not None:
+            try:
+                max_staleness = float(max_staleness) / 1000
+            except ValueError:
+                return HTTPResponse(status=400, body='max_staleness has to be a number of milliseconds')
+            staleness = self.staleness()
+            if staleness is None or staleness > max_staleness:
+                leader_ip = self.svrs_dict.leader_ip
+                if leader_ip is None or leader_ip == self.ip:
+                    self.count_read('unavailable')
+                    return HTTPResponse(status=503, body='no leader to read from, try again')
+                self.count_read('redirected')
+                return HTTPResponse(status=307, headers={
+                    'Location': 'http://{}/board?{}'.format(leader_ip, request.query_string),
+                    'Cache-Control': 'no-cache'})
+            self.count_read('local')
+            headers['X-Staleness'] = '{:.0f}'.format(staleness * 1000)
+        # browsers revalidate the board on every reload and get 304 Not Modified if it didn't change
+        etag = self.blackboard.changes.etag(self.blackboard.changes.version)
+        if request.get_header('If-None-Match') == etag:
+            return HTTPResponse(status=304, headers=dict(headers, **{'ETag': etag, 'Cache-Control': 'no-cache'}))
+
+        def render(board, version):
+            return template('server/templates/blackboard.tpl',
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream)
+        stream = async_streams(request.environ)
+        version, page = self.board_page('board', render, stream)
+        response.set_header('ETag', self.blackboard.changes.etag(version))
+        response.set_header('Cache-Control', 'no-cache')
+        for name, value in headers.items():
+            response.set_header(name, value)
+        return page.send()
+
+    # get on ('/board/changes')
+    def get_board_changes(self):
+        # ?since=<version>&epoch=<epoch> of the board shown by the browser, see board_changes.ChangeLog
+        try:
+            since = int(request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        response.set_header('Cache-Control', 'no-cache')
+        return self.blackboard.get_changes(since, request.query.get('epoch'))
+
+    # get on ('/board/stream')
+    def get_board_stream(self):
+        # every change of the board after ?since=<version>&epoch=<epoch> as it is applied,
+        # a reconnecting browser continues after the Last-Event-ID it received
+        try:
+            since = int(request.get_header('Last-Event-ID') or request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        threaded = not async_streams(request.environ)
+        if threaded and not self.thread_streams.acquire():
+            # every stream holds a request thread until THREAD_STREAM_DURATION; the browser polls /board/changes
+            response.status = 503
+            return 'too many streams, poll /board/changes'
+        response.content_type = 'text/event-stream'
+        response.set_header('Cache-Control', 'no-cache')
+        subscription = self.blackboard.subscribe(since, request.query.get('epoch'))
+        if threaded:
+            subscription.when_closed(self.thread_streams.release)
+        return stream_response(request.environ, subscription)
 
     # post on ('/board')
     def post_board(self):
@@ -295,9 +802,7 @@ class Server(Bottle):
             # we read the POST form, and check for an element called 'entry'
             new_entry = request.forms.get('entry')
             print("Received: {}".format(new_entry))
-            self.do_parallel_task(self.propagate_to_leader,
-                                  args=('/propagate_leader', 'POST',
-                                        {'action': 'submit', 'entry': new_entry}))
+            return self.propagate_to_leader('submit', entry=new_entry)
         except Exception as e:
             print("[ERROR] " + str(e))
 
@@ -313,12 +818,31 @@ class Server(Bottle):
             else:
                 action = 'modify'
             print("Received: {}".format(new_entry))
-            self.do_parallel_task(self.propagate_to_leader,
-                                  args=('/propagate_leader', 'POST',
-                                        {'action': action, 'element_id': element_id, 'entry': new_entry}))
+            return self.propagate_to_leader(action, element_id, new_entry)
         except Exception as e:
             print("[ERROR] " + str(e))
 
+    # get on ('/heartbeat')
+    def get_heartbeat(self):
+        if request.query.get('sender'):
+            self.peer_seen(request.query.get('sender'))
+        return 'ok'
+
+    # get on ('/stats')
+    def get_stats(self):
+        return {'peers': self.peer_client.health_report(),
+                'failure_detector': self.failure_detector.metrics(),
+                'election': self.election.metrics(),
+                'replication': {'leader': self.replication.metrics(), 'follower': self.follower.metrics()},
+                'reads': dict(self.reads),
+                'forwarded': dict(self.forwarded),
+                'cpu': time.process_time(),
+                'workers': self.worker_pool.metrics(),
+                'streams': len(self.blackboard.changes.subscribers),
+                'thread_streams': self.thread_streams.metrics(),
+                'render_cache': self.render_cache.metrics(),
+                'journal': self.blackboard.journal.metrics() if self.blackboard.journal is not None else None}
+
     def get_template(self, filename):
         return static_file(filename, root='./server/templates/')
 
@@ -338,19 +862,214 @@ def main():
                         dest='srv_list',
                         default="10.1.0.1,10.1.0.2",
                         help='List of all servers present in the network')
+    parser.add_argument('--server-mode',
+                        nargs='?',
+                        dest='server_mode',
+                        default='threadpool',
+                        choices=sorted(SERVER_MODES),
+                        help='How requests are served: wsgiref (one at a time), threadpool or asyncio '
+                             '(idle /board/stream clients don\'t hold a thread)')
+    parser.add_argument('--server-threads',
+                        nargs='?',
+                        dest='server_threads',
+                        default=DEFAULT_POOL_SIZE,
+                        type=int,
+                        help='Number of threads serving requests in threadpool and asyncio mode')
+    parser.add_argument('--max-thread-streams',
+                        nargs='?',
+                        dest='max_thread_streams',
+                        default=MAX_THREAD_STREAMS,
+                        type=int,
+                        help='Number of /board/stream clients served at the same time in threadpool mode, every one '
+                             'holds a request thread; more are refused. None in wsgiref mode, a stream would block '
+                             'the server')
+    parser.add_argument('--peer-pool-size',
+                        nargs='?',
+                        dest='peer_pool_size',
+                        default=DEFAULT_PEER_POOL_SIZE,
+                        type=int,
+                        help='Number of keep-alive connections kept open to every other server')
+    parser.add_argument('--connect-timeout',
+                        nargs='?',
+                        dest='connect_timeout',
+                        default=CONNECT_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for a connection to another server')
+    parser.add_argument('--read-timeout',
+                        nargs='?',
+                        dest='read_timeout',
+                        default=READ_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for the answer of another server')
+    parser.add_argument('--retries',
+                        nargs='?',
+                        dest='retries',
+                        default=DEFAULT_RETRIES,
+                        type=int,
+                        help='Retries of a message to another server that could not be reached')
+    parser.add_argument('--retry-ratio',
+                        nargs='?',
+                        dest='retry_ratio',
+                        default=DEFAULT_RETRY_RATIO,
+                        type=float,
+                        help='Fraction of the messages to another server that may be retried')
+    parser.add_argument('--breaker-threshold',
+                        nargs='?',
+                        dest='breaker_threshold',
+                        default=DEFAULT_BREAKER_THRESHOLD,
+                        type=int,
+                        help='Consecutive failures after which messages to another server fail at once')
+    parser.add_argument('--breaker-reset',
+                        nargs='?',
+                        dest='breaker_reset',
+                        default=DEFAULT_BREAKER_RESET,
+                        type=float,
+                        help='Seconds until another server is tried again after its circuit was opened')
+    parser.add_argument('--fanout-concurrency',
+                        nargs='?',
+                        dest='fanout_concurrency',
+                        default=DEFAULT_MAX_CONCURRENCY,
+                        type=int,
+                        help='Maximum number of servers contacted at the same time during a broadcast')
+    parser.add_argument('--fanout-deadline',
+                        nargs='?',
+                        dest='fanout_deadline',
+                        default=None,
+                        type=float,
+                        help='Seconds after which a server that hasn\'t answered a broadcast counts as failed')
+    parser.add_argument('--workers',
+                        nargs='?',
+                        dest='workers',
+                        default=DEFAULT_WORKERS,
+                        type=int,
+                        help='Number of threads running background tasks')
+    parser.add_argument('--task-queue-size',
+                        nargs='?',
+                        dest='task_queue_size',
+                        default=DEFAULT_MAX_QUEUE,
+                        type=int,
+                        help='Maximum number of waiting background tasks before requests are slowed down')
+    parser.add_argument('--data-dir',
+                        nargs='?',
+                        dest='data_dir',
+                        default=None,
+                        help='Directory of the write-ahead log and snapshots of the board, '
+                             'the board is only kept in memory if not given')
+    parser.add_argument('--fsync-interval',
+                        nargs='?',
+                        dest='fsync_interval',
+                        default=DEFAULT_FSYNC_INTERVAL,
+                        type=float,
+                        help='Seconds board changes are collected before they are written and fsynced together, '
+                             'at most this window is lost in a crash')
+    parser.add_argument('--snapshot-every',
+                        nargs='?',
+                        dest='snapshot_every',
+                        default=DEFAULT_SNAPSHOT_EVERY,
+                        type=int,
+                        help='Number of logged changes after which a snapshot of the board is written')
+    parser.add_argument('--sync-interval',
+                        nargs='?',
+                        dest='sync_interval',
+                        default=DEFAULT_SYNC_INTERVAL,
+                        type=float,
+                        help='Seconds between two anti-entropy rounds of a follower with the leader, 0 to only '
+                             'sync after elections')
+    parser.add_argument('--heartbeat-interval',
+                        nargs='?',
+                        dest='heartbeat_interval',
+                        default=DEFAULT_HEARTBEAT_INTERVAL,
+                        type=float,
+                        help='Seconds between two heartbeats sent to every other server')
+    parser.add_argument('--phi-threshold',
+                        nargs='?',
+                        dest='phi_threshold',
+                        default=DEFAULT_PHI_THRESHOLD,
+                        type=float,
+                        help='Suspicion level (phi) above which another server is treated as failed')
+    parser.add_argument('--election',
+                        nargs='?',
+                        dest='election',
+                        default=DEFAULT_ELECTION,
+                        choices=sorted(ELECTIONS),
+                        help='Leader election algorithm, the same on all servers: ring (collects all servers), '
+                             'chang-roberts or hirschberg-sinclair')
+    parser.add_argument('--ring-probes',
+                        nargs='?',
+                        dest='ring_probes',
+                        default=DEFAULT_RING_PROBES,
+                        type=int,
+                        help='Servers probed at the same time when the next server in the ring does not answer')
+    parser.add_argument('--max-in-flight',
+                        nargs='?',
+                        dest='max_in_flight',
+                        default=DEFAULT_MAX_IN_FLIGHT,
+                        type=int,
+                        help='Requests with operations the leader has on the way to every follower')
+    parser.add_argument('--forward-window',
+                        nargs='?',
+                        dest='forward_window',
+                        default=DEFAULT_FORWARD_WINDOW,
+                        type=float,
+                        help='Seconds a follower collects the writes of its clients before it forwards them together')
+    parser.add_argument('--forward-size',
+                        nargs='?',
+                        dest='forward_size',
+                        default=DEFAULT_FORWARD_SIZE,
+                        type=int,
+                        help='Maximum number of writes a follower forwards to the leader in one request, '
+                             '1 sends every write on its own')
+    parser.add_argument('--lease-renewal',
+                        nargs='?',
+                        dest='lease_renewal',
+                        default=DEFAULT_LEASE_RENEWAL,
+                        type=float,
+                        help='Seconds after which the leader renews the lease of a follower it has nothing to send')
     args = parser.parse_args()
     server_id = args.id
     server_ip = "10.1.0.{}".format(server_id)
     servers_list = args.srv_list.split(",")
 
     try:
+        peer_client = PeerClient(pool_size=args.peer_pool_size,
+                                 connect_timeout=args.connect_timeout,
+                                 read_timeout=args.read_timeout,
+                                 retries=args.retries,
+                                 retry_ratio=args.retry_ratio,
+                                 breaker_threshold=args.breaker_threshold,
+                                 breaker_reset=args.breaker_reset)
+        worker_pool = WorkerPool(workers=args.workers, max_queue=args.task_queue_size)
+        journal = Journal(args.data_dir,
+                          worker_pool,
+                          fsync_interval=args.fsync_interval,
+                          snapshot_every=args.snapshot_every) if args.data_dir else None
         server = Server(server_id,
                         server_ip,
-                        servers_list)
+                        servers_list,
+                        peer_client=peer_client,
+                        fan_out=FanOut(max_concurrency=args.fanout_concurrency,
+                                       deadline=args.fanout_deadline),
+                        worker_pool=worker_pool,
+                        journal=journal,
+                        heartbeat_interval=args.heartbeat_interval,
+                        phi_threshold=args.phi_threshold,
+                        sync_interval=args.sync_interval,
+                        election=args.election,
+                        ring_probes=args.ring_probes,
+                        max_in_flight=args.max_in_flight,
+                        lease_renewal=args.lease_renewal,
+                        forward_window=args.forward_window,
+                        forward_size=args.forward_size,
+                        # a stream in wsgiref mode would hold the only thread serving requests
+                        max_thread_streams=0 if args.server_mode == 'wsgiref' else args.max_thread_streams)
         server.do_parallel_task_after_delay(delay=2, method=server.start_leader_election, args=[])
         bottle.run(server,
+                   server=SERVER_MODES[args.server_mode],
                    host=server_ip,
-                   port=PORT)
+                   port=PORT,
+                   pool_size=args.server_threads)
+        if journal is not None:
+            journal.close()
     except Exception as e:
         raise Exception(str(e))
 
@@ -1,3 +1,3 @@
 % include('server/templates/header.tpl', board_title=board_title)
-% include('server/templates/blackboard.tpl',board_title=board_title, board_dict=board_dict)
+% include('server/templates/blackboard.tpl',board_title=board_title, board_dict=board_dict, board_epoch=board_epoch, board_version=board_version, board_stream=board_stream)
 % include('server/templates/footer.tpl',members_name_string=members_name_string)
\ No newline at end of file
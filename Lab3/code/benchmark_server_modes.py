@@ -0,0 +1,87 @@
+# coding=utf-8
+import argparse
+import socket
+import sys
+import time
+from threading import Thread
+
+import requests
+
+# the server code is run as a script from ./server, so its modules are imported the same way
+sys.path.insert(0, 'server')
+import bottle
+import server
+from server_adapters import SERVER_MODES
+from vector_clock import VectorClock
+
+
+# ------------------------------------------------------------------------------------------------------
+# Requests/sec of the Lab3 Server for every --server-mode.
+# Half of the clients reload /board, the other half post /propagate messages like the other servers do.
+# usage (from Lab3/code): python3 benchmark_server_modes.py --entries 300 --clients 16 --duration 5
+
+
+def start_server(mode, port, entries):
+    ip = '127.0.0.1:{}'.format(port)
+    srv = server.Server(1, ip, [ip])
+    for i in range(entries):
+        srv.blackboard.add_entry(server.Entry(VectorClock({1: i + 1}), 'entry {}'.format(i), server.SUBMIT))
+    thread = Thread(target=bottle.run, kwargs={'app': srv, 'server': SERVER_MODES[mode], 'host': '127.0.0.1',
+                                               'port': port, 'quiet': True})
+    thread.daemon = True
+    thread.start()
+    # wait until the server accepts connections
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def client(port, client_id, stop_at, latencies):
+    session = requests.Session()
+    counter = 0
+    while time.time() < stop_at:
+        counter += 1
+        start = time.time()
+        if client_id % 2 == 0:
+            session.get('http://127.0.0.1:{}/board'.format(port))
+        else:
+            msg = server.Message(server.SUBMIT, VectorClock({client_id % 8 + 1: counter}), client_id % 8 + 1,
+                                 'bench {}'.format(counter))
+            session.post('http://127.0.0.1:{}/propagate'.format(port), data=msg.to_dict())
+        latencies.append(time.time() - start)
+
+
+def run_mode(mode, port, args):
+    start_server(mode, port, args.entries)
+    latencies = list()
+    stop_at = time.time() + args.duration
+    threads = [Thread(target=client, args=(port, i, stop_at, latencies)) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    n = len(latencies)
+    print('{:<12}{:>10}{:>12.1f}{:>12.1f}{:>12.1f}'.format(mode, n, n / args.duration,
+                                                        1000 * latencies[n // 2], 1000 * latencies[int(n * 0.99)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the server modes against the Lab3 Server')
+    parser.add_argument('--entries', dest='entries', default=300, type=int,
+                        help='Number of entries on the blackboard, makes /board slower to render')
+    parser.add_argument('--clients', dest='clients', default=16, type=int, help='Number of concurrent clients')
+    parser.add_argument('--duration', dest='duration', default=5, type=float, help='Seconds per mode')
+    parser.add_argument('--port', dest='port', default=8100, type=int, help='First port to use')
+    args = parser.parse_args()
+
+    print('{:<12}{:>10}{:>12}{:>12}{:>12}'.format('mode', 'requests', 'req/s', 'p50 [ms]', 'p99 [ms]'))
+    for i, mode in enumerate(sorted(SERVER_MODES)):
+        run_mode(mode, args.port + i, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+import argparse
+import json
+import random
+import sys
+import time
+from urllib.parse import urlencode, parse_qsl
+
+# the server code is run as a script from ./server, so its modules are imported the same way
+sys.path.insert(0, 'server')
+import bottle
+import server
+import wire_format
+from vector_clock import VectorClock
+
+
+# ------------------------------------------------------------------------------------------------------
+# Encode + decode cost and size of /propagate messages in the old form encoding and in every wire format.
+# usage (from Lab3/code): python3 benchmark_wire_format.py --messages 10000 --batch 20
+
+
+def make_messages(n):
+    msgs = list()
+    for i in range(n):
+        clock = VectorClock(random.randint(0, 5000) for _ in range(8))
+        if i % 3 == 0:
+            msgs.append(server.Message(server.SUBMIT, clock, random.randint(1, 8), 'entry number {}'.format(i)))
+        else:
+            entry_clock = VectorClock(random.randint(0, 5000) for _ in range(8))
+            msgs.append(server.Message(server.MODIFY, clock, random.randint(1, 8), 'modified {}'.format(i),
+                                       entry_clock))
+    return msgs
+
+
+def form_round_trip(batch):
+    # one form encoded request per message, parsed like bottle does and converted with request_to_msg
+    size = 0
+    for msg in batch:
+        body = urlencode(msg.to_dict())
+        size += len(body)
+        form = bottle.FormsDict(parse_qsl(body))
+        server.Message.request_to_msg(form)
+    return size
+
+
+def form_batch_round_trip(batch):
+    # one form encoded request for the whole batch, json list in the field 'batch'
+    body = urlencode({'batch': json.dumps([msg.to_dict() for msg in batch])})
+    form = bottle.FormsDict(parse_qsl(body))
+    [server.Message.request_to_msg(msg_dict) for msg_dict in json.loads(form.get('batch'))]
+    return len(body)
+
+
+def wire_round_trip(content_type):
+    def round_trip(batch):
+        body = wire_format.encode([msg.to_wire() for msg in batch], content_type)
+        [server.Message.from_wire(msg_dict) for msg_dict in wire_format.decode(body, content_type)]
+        return len(body)
+    return round_trip
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the encodings of /propagate messages')
+    parser.add_argument('--messages', dest='messages', default=10000, type=int, help='Number of messages')
+    parser.add_argument('--batch', dest='batch', default=20, type=int, help='Messages per request')
+    args = parser.parse_args()
+
+    msgs = make_messages(args.messages)
+    batches = [msgs[i:i + args.batch] for i in range(0, len(msgs), args.batch)]
+    codecs = [('form', form_round_trip), ('form batch', form_batch_round_trip),
+              ('binary', wire_round_trip(wire_format.BINARY)), ('json', wire_round_trip(wire_format.JSON))]
+    if wire_format.msgpack is not None:
+        codecs.append(('msgpack', wire_round_trip(wire_format.MSGPACK)))
+
+    print('{:<12}{:>16}{:>16}'.format('format', 'us / message', 'bytes / message'))
+    for name, round_trip in codecs:
+        start = time.time()
+        size = sum(round_trip(batch) for batch in batches)
+        elapsed = time.time() - start
+        print('{:<12}{:>16.2f}{:>16.1f}'.format(name, 10 ** 6 * elapsed / len(msgs), size / len(msgs)))
+
+
+if __name__ == '__main__':
+    main()
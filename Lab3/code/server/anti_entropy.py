@@ -0,0 +1,42 @@
+# coding=utf-8
+import zlib
+
+DEFAULT_SYNC_BUCKETS = 256
+DEFAULT_SYNC_INTERVAL = 30  # in sec
+
+
+def item_hash(key, value) -> int:
+    # 64 bit hash of an item, the same on every server (unlike hash(), which is salted per process)
+    data = '{!r}:{!r}'.format(key, value).encode('utf-8')
+    return zlib.crc32(data) << 32 | zlib.adler32(data)
+
+
+# ------------------------------------------------------------------------------------------------------
+class BucketDigest:
+    """ Compact digest of a set of (key, value) items: the items are spread over a fixed number of buckets by key
+        and every bucket holds the xor of the hashes of its items. The hashes don't depend on the order the items
+        were added in, so two servers holding the same items have the same digest, and comparing two digests tells
+        which buckets differ; only the items of those buckets have to be sent.
+        Adding and removing an item is the same xor, see toggle.
+    """
+
+    def __init__(self, buckets=DEFAULT_SYNC_BUCKETS):
+        self.hashes = [0] * buckets
+
+    def bucket(self, key) -> int:
+        return zlib.crc32(repr(key).encode('utf-8')) % len(self.hashes)
+
+    def toggle(self, key, value) -> int:
+        # adds the item if it isn't in the digest, removes it otherwise; returns the bucket of the item
+        bucket = self.bucket(key)
+        self.hashes[bucket] ^= item_hash(key, value)
+        return bucket
+
+    def differing(self, hashes: list) -> set:
+        # buckets in which the digest of another server differs; all buckets if it was built with another size
+        if len(hashes) != len(self.hashes):
+            return set(range(len(self.hashes)))
+        return {b for b, (own, other) in enumerate(zip(self.hashes, hashes)) if own != other}
+
+    def to_list(self) -> list:
+        return list(self.hashes)
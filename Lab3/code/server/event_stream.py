@@ -0,0 +1,155 @@
+# coding=utf-8
+import asyncio
+import collections
+import json
+import time
+from threading import Condition, Lock
+
+from server_adapters import ASYNC_STREAM
+
+# seconds between comments keeping an idle stream open, a closed connection is noticed on the next write
+HEARTBEAT_INTERVAL = 15
+# seconds a stream may occupy a request thread in threadpool and wsgiref mode, the browser reconnects afterwards
+THREAD_STREAM_DURATION = 30
+# milliseconds the browser waits before it reconnects
+RETRY = 1000
+# streams held by request threads at the same time in threadpool mode; more are refused with 503 and
+# the browsers poll /board/changes instead
+MAX_THREAD_STREAMS = 4
+
+
+def format_event(event: str, data, event_id=None) -> bytes:
+    # one server-sent event, data is sent as json
+    lines = list()
+    if event_id is not None:
+        lines.append('id: {}'.format(event_id))
+    lines.append('event: {}'.format(event))
+    lines.append('data: {}'.format(json.dumps(data)))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+# ------------------------------------------------------------------------------------------------------
+class Subscription:
+    """ Server-sent events for one client. Events are pushed from any thread; the subscription is iterated either
+        by the thread serving the request (blocking, for at most THREAD_STREAM_DURATION seconds) or, in asyncio
+        mode, by the event loop, so an idle client doesn't hold on to a thread.
+    """
+
+    def __init__(self, on_close=None):
+        self.events = collections.deque()
+        self.closed = False
+        self.condition = Condition()
+        # called once when the client is gone, see when_closed
+        self.on_close = [on_close] if on_close is not None else []
+        # set when iterated by an event loop
+        self.loop = None
+        self.ready = None
+        self.push('retry: {}\n\n'.format(RETRY).encode('utf-8'))
+
+    def push(self, event: bytes):
+        with self.condition:
+            if self.closed:
+                return
+            self.events.append(event)
+            self.condition.notify()
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.ready.set)
+
+    def when_closed(self, callback):
+        # callback(subscription) is called once when the client is gone
+        self.on_close.append(callback)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.ready.set)
+        for callback in self.on_close:
+            callback(self)
+
+    def _take(self) -> bytes:
+        # call with the condition held
+        chunk = b''.join(self.events)
+        self.events.clear()
+        return chunk
+
+    def __iter__(self):
+        end = time.time() + THREAD_STREAM_DURATION
+        try:
+            while True:
+                with self.condition:
+                    remaining = end - time.time()
+                    if not self.events and not self.closed and remaining > 0:
+                        self.condition.wait(min(HEARTBEAT_INTERVAL, remaining))
+                    if self.closed or (not self.events and time.time() >= end):
+                        return
+                    chunk = self._take() or b': heartbeat\n\n'
+                yield chunk
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        with self.condition:
+            self.loop = asyncio.get_running_loop()
+            self.ready = asyncio.Event()
+            if self.events or self.closed:
+                self.ready.set()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.ready.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                with self.condition:
+                    self.ready.clear()
+                    if self.closed:
+                        return
+                    chunk = self._take() or b': heartbeat\n\n'
+                yield chunk
+        finally:
+            self.close()
+
+
+class ThreadStreams:
+    """ Streams held by request threads, at most limit at the same time. In threadpool and wsgiref mode every open
+        stream holds one of the server's threads, so a few browser tabs would leave no thread for /propagate.
+    """
+
+    def __init__(self, limit=MAX_THREAD_STREAMS):
+        self.limit = limit
+        self.open = 0
+        self.refused = 0
+        self.lock = Lock()
+
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.open >= self.limit:
+                self.refused += 1
+                return False
+            self.open += 1
+            return True
+
+    def release(self, subscription=None):
+        # usable as Subscription.when_closed callback
+        with self.lock:
+            self.open -= 1
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {'open': self.open, 'limit': self.limit, 'refused': self.refused}
+
+
+def async_streams(environ: dict) -> bool:
+    # True if the server sends streams from its event loop (asyncio mode), so an open stream doesn't hold a thread
+    return ASYNC_STREAM in environ
+
+
+def stream_response(environ: dict, subscription: Subscription):
+    # body of a bottle route sending the subscription; the asyncio server streams it from its event loop
+    if ASYNC_STREAM in environ:
+        environ[ASYNC_STREAM](subscription)
+        return b''
+    return subscription
@@ -0,0 +1,160 @@
+# coding=utf-8
+import collections
+import json
+import os
+import random
+import time
+from threading import Lock
+
+DEFAULT_MAX_BATCH = 200  # messages per request
+DEFAULT_MAX_QUEUED = 10000  # messages per peer kept in memory
+BASE_BACKOFF = 0.5  # in sec
+MAX_BACKOFF = 30.0  # in sec
+
+
+# ------------------------------------------------------------------------------------------------------
+class PeerQueue:
+    """ Messages waiting to be sent to one peer, oldest first """
+
+    def __init__(self, srv_ip, spill_path=None):
+        self.srv_ip = srv_ip
+        self.pending = collections.deque()
+        # messages appended to the spill file and not read back yet; while there are any, new messages go to the
+        # file as well, so the order is kept
+        self.spill_path = spill_path
+        self.spilled = 0
+        self.spill_offset = 0
+        # a sender is running or waiting for its retry, there is at most one per peer
+        self.sending = False
+        self.failures = 0
+        self.retry_at = None
+        self.sent = 0
+        self.dropped = 0
+        self.lock = Lock()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'queued': len(self.pending), 'spilled': self.spilled, 'failures': self.failures,
+                    'retry_in': max(self.retry_at - time.time(), 0) if self.retry_at is not None else None,
+                    'sent': self.sent, 'dropped': self.dropped}
+
+
+class OutboundQueues:
+    """ One queue per peer, each with its own sender on the worker pool, so a dead or slow peer only delays its
+        own messages. A sender sends everything queued for its peer in batches of up to max_batch messages and
+        after a failure retries with exponential backoff and jitter instead of once per message.
+        At most max_queued messages per peer are kept in memory; the rest is spilled to a file in spill_dir,
+        or, without spill_dir, the messages exceeding it are dropped (anti-entropy repairs them later).
+    """
+
+    def __init__(self, worker_pool, send, max_batch=DEFAULT_MAX_BATCH, max_queued=DEFAULT_MAX_QUEUED,
+                 spill_dir=None, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF, suspected=None):
+        self.worker_pool = worker_pool
+        # called as send(srv_ip, messages) -> bool
+        self.send = send
+        # called as suspected(srv_ip) -> bool; nothing is sent to a suspected peer, its sender just checks again
+        # after base_backoff
+        self.suspected = suspected
+        self.max_batch = max_batch
+        self.max_queued = max_queued
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # dictionary of shape srv_ip: PeerQueue
+        self.queues = dict()
+        self.lock = Lock()
+
+    def _queue(self, srv_ip) -> PeerQueue:
+        with self.lock:
+            if srv_ip not in self.queues:
+                spill_path = None
+                if self.spill_dir is not None:
+                    spill_path = os.path.join(self.spill_dir, 'outbound-{}.jsonl'.format(srv_ip.replace(':', '_')))
+                    # messages spilled before a restart can't be told apart from sent ones, anti-entropy covers them
+                    if os.path.exists(spill_path):
+                        os.remove(spill_path)
+                self.queues[srv_ip] = PeerQueue(srv_ip, spill_path)
+            return self.queues[srv_ip]
+
+    def enqueue(self, srv_ip, messages: list):
+        queue = self._queue(srv_ip)
+        with queue.lock:
+            if queue.spilled or len(queue.pending) + len(messages) > self.max_queued:
+                self._overflow(queue, messages)
+            else:
+                queue.pending.extend(messages)
+            start = not queue.sending
+            queue.sending = True
+        if start:
+            self.worker_pool.submit(self._drain, (queue,))
+
+    def _overflow(self, queue: PeerQueue, messages: list):
+        # call holding queue.lock
+        if queue.spill_path is not None:
+            with open(queue.spill_path, 'ab') as f:
+                f.write(b''.join(json.dumps(msg).encode('utf-8') + b'\n' for msg in messages))
+            queue.spilled += len(messages)
+            return
+        # the oldest messages may be in flight, the new ones are dropped
+        room = max(self.max_queued - len(queue.pending), 0)
+        queue.pending.extend(messages[:room])
+        if queue.dropped == 0:
+            print('[WARNING ]Outbound queue of server {} is full, dropping messages'.format(queue.srv_ip))
+        queue.dropped += len(messages) - room
+
+    def _refill(self, queue: PeerQueue):
+        # call holding queue.lock; reads spilled messages back once the queue in memory is empty
+        with open(queue.spill_path, 'rb') as f:
+            f.seek(queue.spill_offset)
+            while queue.spilled and len(queue.pending) < self.max_queued:
+                queue.pending.append(json.loads(f.readline()))
+                queue.spilled -= 1
+            queue.spill_offset = f.tell()
+        if not queue.spilled:
+            os.remove(queue.spill_path)
+            queue.spill_offset = 0
+
+    def _drain(self, queue: PeerQueue):
+        # sends batches until the queue is empty or the peer fails
+        while True:
+            with queue.lock:
+                if not queue.pending and queue.spilled:
+                    self._refill(queue)
+                if not queue.pending:
+                    queue.sending = False
+                    queue.retry_at = None
+                    return
+                batch = [queue.pending[i] for i in range(min(self.max_batch, len(queue.pending)))]
+
+            if self.suspected is not None and self.suspected(queue.srv_ip):
+                with queue.lock:
+                    queue.retry_at = time.time() + self.base_backoff
+                self.worker_pool.submit_after_delay(self.base_backoff, self._drain, (queue,))
+                return
+
+            if not self.send(queue.srv_ip, batch):
+                with queue.lock:
+                    queue.failures += 1
+                    # exponential backoff with jitter, so peers coming back aren't hit by all senders at once
+                    delay = min(self.max_backoff, self.base_backoff * 2 ** (queue.failures - 1))
+                    delay = random.uniform(delay / 2, delay)
+                    queue.retry_at = time.time() + delay
+                    waiting = len(queue.pending) + queue.spilled
+                print("[WARNING ]Could not contact server {}, retrying {} messages in {:.1f}s".format(
+                    queue.srv_ip, waiting, delay))
+                self.worker_pool.submit_after_delay(delay, self._drain, (queue,))
+                return
+
+            with queue.lock:
+                # only this sender removes messages, the batch is still at the head of the queue
+                for _ in batch:
+                    queue.pending.popleft()
+                queue.sent += len(batch)
+                queue.failures = 0
+
+    def metrics(self) -> dict:
+        with self.lock:
+            queues = list(self.queues.values())
+        return {queue.srv_ip: queue.to_dict() for queue in queues}
@@ -1,46 +1,90 @@
 # coding=utf-8
 import argparse
-import copy
+import bisect
 import json
+import random
 import sys
-from threading import Lock, Thread, RLock
-import time
+from threading import Lock, RLock
 import traceback
 from typing import Any
 
 import bottle
-from bottle import Bottle, request, template, run, static_file
-import requests
+from bottle import Bottle, HTTPResponse, request, response, template, run, static_file
+from batching import Batcher, DEFAULT_BATCH_WINDOW, DEFAULT_BATCH_SIZE
+from board_changes import ChangeLog, INSERT, REMOVE
+from event_stream import Subscription, ThreadStreams, async_streams, stream_response, MAX_THREAD_STREAMS
+from anti_entropy import BucketDigest, DEFAULT_SYNC_INTERVAL
+from failure_detector import FailureDetector, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_PHI_THRESHOLD
+from fanout import FanOut, DEFAULT_MAX_CONCURRENCY
+from journal import Journal, DEFAULT_FSYNC_INTERVAL, DEFAULT_SNAPSHOT_EVERY
+from outbound import OutboundQueues, DEFAULT_MAX_QUEUED
+from peer_client import (PeerClient, DEFAULT_PEER_POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, DEFAULT_RETRIES,
+                         DEFAULT_RETRY_RATIO, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_RESET)
+from render_cache import RenderCache
+from server_adapters import SERVER_MODES, DEFAULT_POOL_SIZE
+from vector_clock import VectorClock, LocalClock
+import wire_format
+from worker_pool import WorkerPool, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
 
 SUBMIT = 'submit'
 MODIFY = 'modify'
 DELETE = 'delete'
-SERVER_COUNT = 8
 
 
 # ------------------------------------------------------------------------------------------------------
 class Entry:
 
-    def __init__(self, vector_clock: list, text: str, action: str):
+    def __init__(self, vector_clock: VectorClock, text: str, action: str):
         self.vector_clock = vector_clock
         self.text = text
         self.action = action
         self.log = list()
 
 
+def _encode_entry(entry: Entry) -> list:
+    # shape of an entry in the journal
+    return [entry.vector_clock.to_list(), entry.text, entry.action]
+
+
+def _decode_entry(values: list) -> Entry:
+    return Entry(VectorClock(values[0]), values[1], values[2])
+
+
 # ------------------------------------------------------------------------------------------------------
 class Blackboard:
+    """ Entries in total order with hash indexes, so finding the entry of a (superseded) vector clock is O(1)
+        and inserting an entry is a bisect instead of a scan over the whole board.
+    """
 
-    def __init__(self):
-        # list of type Entry
+    def __init__(self, journal=None):
+        # list of type Entry, in total order
         self.entries = list()
-        # list of vector_clocks
-        self.deleted = list()
+        # sort keys of self.entries, same order
+        self.keys = list()
+        # dictionary of shape VectorClock: Entry for the current vector clock of every entry
+        self.by_clock = dict()
+        # dictionary of shape superseded VectorClock: log, the log list is shared by all versions of an entry
+        self.by_log = dict()
+        # dictionary of shape id(log): Entry, the current version of the entry owning the log
+        self.log_owner = dict()
+        # set of VectorClocks
+        self.deleted = set()
         # list of type tuple of (Entry, vector_clock)
         self.to_be_applied = list()
         self.counter = 0
         # RLock, because it can be acquired multiple times by the same thread
         self.lock = RLock()  # use lock when you modify the content
+        # write-ahead log of every change, None if the board is only kept in memory
+        self.journal = journal
+        # merge of the vector clocks of all writes applied to the board, None before the first
+        self.clock = None
+        # dictionary of shape VectorClock: record for every write applied to the board, see _journal
+        self.writes = dict()
+        # digest of the writes for anti-entropy with the other servers and the list of records in every bucket
+        self.digest = BucketDigest()
+        self.write_buckets = [list() for _ in self.digest.hashes]
+        # version of the board and the changes browsers still have to apply, the id of a row is its position
+        self.changes = ChangeLog()
 
     def get_content(self) -> dict:
         with self.lock:
@@ -49,103 +93,211 @@ class Blackboard:
             cnt = dict(zip(clock_list, text_list))
         return cnt
 
-    def get_index(self, entry_clock: list) -> int:
-        for i in range(0, len(self.entries)):
-            if self.entries[i].vector_clock == entry_clock:
-                return i
-        return -1
+    def get_versioned_content(self) -> tuple:
+        # the content and the version it belongs to
+        with self.lock:
+            return self.changes.version, self.get_content()
+
+    def get_changes(self, since: int, epoch: str) -> dict:
+        with self.lock:
+            return self.changes.delta(since, epoch)
+
+    def subscribe(self, since: int, epoch: str) -> Subscription:
+        with self.lock:
+            return self.changes.subscribe(since, epoch)
+
+    def restore(self):
+        # loads the latest snapshot of the journal and replays the records after it
+        journal, self.journal = self.journal, None
+        state, records = journal.load()
+        if state is not None:
+            with self.lock:
+                self._load_state(state)
+        for record in records:
+            self._apply_record(record)
+        with self.lock:
+            # browsers showing an older version have to reload the board
+            self.changes.reset()
+        self.journal = journal
+        print('Restored {} entries ({} records replayed)'.format(len(self.entries), len(records)))
+
+    def _apply_record(self, record: list):
+        # applies a write recorded by _journal, here or on another server
+        if record[0] == 'add':
+            self.add_entry(_decode_entry(record[1]))
+        elif record[0] == 'integrate':
+            self.integrate_entry(_decode_entry(record[1]))
+        elif record[0] == 'modify':
+            self.modify_entry(_decode_entry(record[1]), VectorClock(record[2]))
+        elif record[0] == 'delete':
+            self.del_entry(_decode_entry(record[1]), VectorClock(record[2]))
+
+    def get_digest(self) -> list:
+        with self.lock:
+            return self.digest.to_list()
 
-    def search_logs(self, entry_clock: list) -> int:
-        for i in range(0, len(self.entries)):
-            for v in self.entries[i].log:
-                if entry_clock == v:
-                    return i
-        return -1
+    def get_writes(self, digest: list) -> list:
+        # the records of all writes in the buckets in which digest (of another server) differs from this board's
+        with self.lock:
+            return [record for bucket in sorted(self.digest.differing(digest))
+                    for record in self.write_buckets[bucket]]
 
-    def modify_entry(self, entry: Entry, entry_clock: list, from_apply=False) -> bool:
+    def apply_writes(self, records: list) -> int:
+        # applies the writes pulled from another server which aren't on this board yet, in causal order
+        # returns the number of writes applied
+        applied = 0
+        with self.lock:
+            for record in sorted(records, key=lambda r: VectorClock(r[1][0]).key):
+                if VectorClock(record[1][0]) in self.writes:
+                    continue
+                if record[0] == 'add':
+                    # a local submit of the other server
+                    record = ['integrate'] + record[1:]
+                self._apply_record(record)
+                applied += 1
+        return applied
+
+    def _state(self) -> dict:
+        # call with the lock held; a copy of the board for a snapshot of the journal
+        return {'entries': [_encode_entry(e) + [[c.to_list() for c in e.log]] for e in self.entries],
+                'deleted': [c.to_list() for c in self.deleted],
+                'to_be_applied': [[_encode_entry(e), c.to_list()] for e, c in self.to_be_applied],
+                'clock': self.clock.to_list() if self.clock is not None else None,
+                'writes': list(self.writes.values())}
+
+    def _load_state(self, state: dict):
+        # call with the lock held; the entries of a snapshot are already in total order
+        self.entries = list()
+        for values in state['entries']:
+            entry = _decode_entry(values)
+            entry.log = [VectorClock(c) for c in values[3]]
+            self.entries.append(entry)
+            self.by_clock[entry.vector_clock] = entry
+            self.log_owner[id(entry.log)] = entry
+            for clock in entry.log:
+                self.by_log[clock] = entry.log
+        self.keys = [e.vector_clock.key for e in self.entries]
+        self.deleted = set(VectorClock(c) for c in state['deleted'])
+        self.to_be_applied = [(_decode_entry(e), VectorClock(c)) for e, c in state['to_be_applied']]
+        self.clock = VectorClock(state['clock']) if state['clock'] is not None else None
+        for record in state['writes']:
+            self._add_write(VectorClock(record[1][0]), record)
+
+    def _add_write(self, clock: VectorClock, record: list):
+        # call with the lock held
+        self.writes[clock] = record
+        self.write_buckets[self.digest.toggle(clock.items, record[1][2])].append(record)
+
+    def _journal(self, entry: Entry, record: list):
+        # call with the lock held, after the write of entry was applied
+        self.clock = entry.vector_clock if self.clock is None else self.clock.merge(entry.vector_clock)
+        self._add_write(entry.vector_clock, record)
+        if self.journal is not None and self.journal.append(record):
+            self.journal.snapshot(self._state())
+
+    def get_index(self, entry_clock: VectorClock) -> int:
+        entry = self.find_entry(entry_clock)
+        return self._position(entry) if entry is not None else -1
+
+    def find_entry(self, entry_clock: VectorClock):
+        # the entry whose current vector clock or one of whose superseded vector clocks is entry_clock, or None
+        entry = self.by_clock.get(entry_clock)
+        if entry is None and entry_clock in self.by_log:
+            entry = self.log_owner[id(self.by_log[entry_clock])]
+        return entry
+
+    def _position(self, entry: Entry) -> int:
+        index = bisect.bisect_left(self.keys, entry.vector_clock.key)
+        while self.entries[index] is not entry:
+            index += 1
+        return index
+
+    def _insert(self, entry: Entry):
+        index = bisect.bisect_right(self.keys, entry.vector_clock.key)
+        self.entries.insert(index, entry)
+        self.keys.insert(index, entry.vector_clock.key)
+        self.by_clock[entry.vector_clock] = entry
+        self.log_owner[id(entry.log)] = entry
+        self.changes.record(INSERT, index, index, entry.text, clock=str(tuple(entry.vector_clock)))
+
+    def _remove(self, entry: Entry):
+        index = self._position(entry)
+        self.entries.pop(index)
+        self.keys.pop(index)
+        self.by_clock.pop(entry.vector_clock, None)
+        self.log_owner.pop(id(entry.log), None)
+        self.changes.record(REMOVE, index, index)
+
+    def _replace(self, current: Entry, entry: Entry):
+        # entry becomes the new version of current and takes over its log
+        self._remove(current)
+        entry.log = current.log
+        entry.log.append(current.vector_clock)
+        self.by_log[current.vector_clock] = entry.log
+        self._insert(entry)
+
+    def modify_entry(self, entry: Entry, entry_clock: VectorClock, from_apply=False) -> bool:
         success = False
 
         with self.lock:
-            index = self.get_index(entry_clock)
+            if not from_apply and entry.vector_clock in self.writes:
+                # delivered twice, e.g. retried after a lost answer and pulled by anti-entropy
+                return True
+            current = self.by_clock.get(entry_clock)
 
             # entry clock is a current vector clock of an entry
-            if index >= 0:
+            if current is not None:
                 print('To be modified vector clock {} is a current vector clock of an entry.'.format(entry_clock))
-                entry.log = self.entries[index].log
-                entry.log.append(self.entries[index].vector_clock)
-                self.entries.pop(index)
-                self.integrate_entry(entry)
+                self._replace(current, entry)
                 print(entry.log)
                 success = True
             # entry clock is in the log of an entry
-            elif self.search_logs(entry_clock) >= 0:
+            elif entry_clock in self.by_log:
                 print('To be modified vector clock {} is in the log of an entry.'.format(entry_clock))
-                index = self.search_logs(entry_clock)
-
-                new_entry_clock = entry.vector_clock
-                new_entry_sum = 0
-                for element in new_entry_clock:
-                    new_entry_sum += element
-
-                current_clock = self.entries[index].vector_clock
-                current_entry_sum = 0
-                for element in current_clock:
-                    current_entry_sum += element
-
-                print('new: {} | old: {}'.format(new_entry_sum, current_entry_sum))
-
-                apply_new_entry = False
-
-                if new_entry_sum > current_entry_sum:
-                    apply_new_entry = True
-                elif new_entry_sum < current_entry_sum:
-                    apply_new_entry = False
-                else:
-                    for j in range(SERVER_COUNT):
-                        if new_entry_clock[j] == current_clock[j]:
-                            continue
-                        elif new_entry_clock[j] > current_clock[j]:
-                            apply_new_entry = True
-                            break
-                        elif new_entry_clock[j] < current_clock[j]:
-                            apply_new_entry = False
-                            break
+                current = self.log_owner[id(self.by_log[entry_clock])]
+                apply_new_entry = entry.vector_clock.is_newer(current.vector_clock)
                 success = True
                 print('apply new {}'.format(apply_new_entry))
                 if apply_new_entry:
-                    entry.log = self.entries[index].log
-                    entry.log.append(self.entries[index].vector_clock)
-                    self.entries.pop(index)
-                    self.integrate_entry(entry)
+                    self._replace(current, entry)
                 else:
-                    self.entries[index].log.append(entry_clock)
+                    # the concurrent modification lost, but later modifications of it must still find the entry
+                    current.log.append(entry.vector_clock)
+                    self.by_log[entry.vector_clock] = current.log
             # entry clock belongs to an entry which was deleted
             elif entry_clock in self.deleted:
                 print('To be modified vector clock {} is a vector clock of an deleted entry.'.format(entry_clock))
-                self.deleted.append(entry_clock)
+                self.deleted.add(entry.vector_clock)
                 success = True
             # entry clock is neither the current vector clock or in the log of an entry
             elif not from_apply:
                 print('To be modified vector clock {} couldn\'t be found.'.format(entry_clock))
                 self.to_be_applied.append((entry, entry_clock,))
+            if not from_apply:
+                self._journal(entry, ['modify', _encode_entry(entry), entry_clock.to_list()])
         return success
 
-    def del_entry(self, entry: Entry, entry_clock: list, from_apply=False):
+    def del_entry(self, entry: Entry, entry_clock: VectorClock, from_apply=False):
         success = True
 
         with self.lock:
-            index = self.get_index(entry_clock)
-            if index < 0:
-                index = self.search_logs(entry_clock)
-                if index < 0:
-                    success = False
-                    if not from_apply:
-                        self.to_be_applied.append((entry, entry_clock))
+            if not from_apply and entry.vector_clock in self.writes:
+                # delivered twice, e.g. retried after a lost answer and pulled by anti-entropy
+                return True
+            current = self.find_entry(entry_clock)
+            if current is None:
+                success = False
+                if not from_apply:
+                    self.to_be_applied.append((entry, entry_clock))
 
             if success:
-                self.deleted.append(self.entries[index].vector_clock)
-                self.deleted += self.entries[index].log
-                self.entries.pop(index)
+                self._remove(current)
+                self.deleted.add(current.vector_clock)
+                for clock in current.log:
+                    self.deleted.add(clock)
+                    self.by_log.pop(clock, None)
+            if not from_apply:
+                self._journal(entry, ['delete', _encode_entry(entry), entry_clock.to_list()])
         return success
 
     def apply_entries_from_queue(self):
@@ -170,40 +322,18 @@ class Blackboard:
 
     def add_entry(self, new_entry: Entry):
         with self.lock:
-            self.entries.append(new_entry)
+            self._insert(new_entry)
+            self._journal(new_entry, ['add', _encode_entry(new_entry)])
         return
 
     def integrate_entry(self, entry: Entry):
         clock = entry.vector_clock
-
-        sum_arg = 0
-        for element in clock:
-            sum_arg += element
         with self.lock:
-            # index at which to insert clock and entry
-            index = len(self.entries)
-            for timestamp in reversed([e.vector_clock for e in self.entries]):
-                sum = 0
-                for element in timestamp:
-                    sum += element
-                if sum_arg > sum:
-                    break
-                if sum_arg < sum:
-                    # the entry needs to be inserted before the currently checked stamp
-                    # (according to the total ordering defined by this function)
-                    index -= 1
-                    continue
-                if sum_arg == sum:
-                    for j in range(SERVER_COUNT):
-                        if clock[j] == timestamp[j]:
-                            continue
-                        elif clock[j] > timestamp[j]:
-                            index -= 1
-                            break
-                        elif clock[j] < timestamp[j]:
-                            break
-
-            self.entries.insert(index, entry)
+            # a message delivered twice (e.g. retried after a lost answer) must not add the entry again
+            if clock in self.by_clock or clock in self.by_log or clock in self.deleted:
+                return
+            self._insert(entry)
+            self._journal(entry, ['integrate', _encode_entry(entry)])
 
         if len(self.to_be_applied) > 0:
             self.apply_entries_from_queue()
@@ -212,16 +342,13 @@ class Blackboard:
 # ------------------------------------------------------------------------------------------------------
 class Message:
 
-    def __init__(self, action: str, vector_clock: list, from_id: int, entry=None, entry_clock=None):
+    def __init__(self, action: str, vector_clock: VectorClock, from_id: int, entry=None, entry_clock=None):
         if entry_clock is None:
-            entry_clock = []
-        vector_clock = vector_clock.copy()
-        entry_clock = entry_clock.copy()
+            entry_clock = VectorClock()
         self.action = action
         self.vector_clock = vector_clock
         self.entry = Entry(vector_clock, entry, action)
         self.entry_clock = entry_clock
-        self.to_ip = None
         self.from_id = from_id
 
     def to_dict(self):
@@ -230,145 +357,299 @@ class Message:
 
     @staticmethod
     def request_to_msg(form: bottle.FormsDict):
-        return Message(form.get('action'), json.loads(form.get('vector_clock').replace("'", '"')),
+        return Message(form.get('action'), VectorClock(json.loads(form.get('vector_clock').replace("'", '"'))),
                        int(form.get('from_id')), form.get('entry'),
-                       json.loads(form.get('entry_clock').replace("'", '"')))
+                       VectorClock(json.loads(form.get('entry_clock').replace("'", '"'))))
+
+    def to_wire(self) -> dict:
+        # shape expected by wire_format.encode
+        return {'action': self.action, 'vector_clock': self.vector_clock.to_list(), 'from_id': self.from_id,
+                'entry': self.entry.text, 'entry_clock': self.entry_clock.to_list()}
+
+    @staticmethod
+    def from_wire(msg_dict: dict):
+        return Message(msg_dict['action'], VectorClock(msg_dict['vector_clock']), int(msg_dict['from_id']),
+                       msg_dict['entry'], VectorClock(msg_dict['entry_clock']))
 
 
 # ------------------------------------------------------------------------------------------------------
 class Server(Bottle):
 
-    def __init__(self, ID, IP, servers_list):
+    def __init__(self, ID, IP, servers_list, peer_client=None, fan_out=None, worker_pool=None,
+                 batch_window=DEFAULT_BATCH_WINDOW, batch_size=DEFAULT_BATCH_SIZE,
+                 wire_content_type=wire_format.BINARY, journal=None, sync_interval=DEFAULT_SYNC_INTERVAL,
+                 max_queued=DEFAULT_MAX_QUEUED, spill_dir=None, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 phi_threshold=DEFAULT_PHI_THRESHOLD, max_thread_streams=MAX_THREAD_STREAMS):
         """Distributed blackboard server using vector clocks and an ordered queue for writes."""
         super(Server, self).__init__()
-        self.blackboard = Blackboard()
+        self.blackboard = Blackboard(journal)
+        if journal is not None:
+            self.blackboard.restore()
         self.servers_list = servers_list
         self.id = int(ID)
         self.ip = str(IP)
+        # keep-alive connections to the other servers, shared by all outgoing messages
+        self.peer_client = peer_client or PeerClient()
+        # parallel broadcasts to the other servers
+        self.fan_out = fan_out or FanOut()
+        # threads running all background tasks
+        self.worker_pool = worker_pool or WorkerPool()
+        # pages rendered from the blackboard, by version of the blackboard
+        self.render_cache = RenderCache()
+        # /board/stream clients held by request threads, the browsers only stream if the server runs asyncio
+        self.thread_streams = ThreadStreams(max_thread_streams)
+        # messages propagated together to all other servers
+        self.batcher = Batcher(self.worker_pool, self.propagate_messages, window=batch_window, max_size=batch_size)
+        # Content-Type of the messages sent to the other servers
+        if wire_content_type == wire_format.MSGPACK and wire_format.msgpack is None:
+            print('[WARNING ]msgpack is not installed, sending json instead')
+            wire_content_type = wire_format.JSON
+        self.wire_format = wire_content_type
+        # dictionary of shape server_ip: Content-Type, for servers which couldn't decode self.wire_format
+        self.peer_formats = dict()
 
         self.clock_lock = Lock()
-        self.vector_clocks = {ip: 0 for ip in servers_list}
-        # all messages that couldn't be delivered to its receiver
-        self.out_queue = list()
-        self.queue_lock = Lock()
-        self.do_parallel_task(self.send_msg_from_queue)
-        self.vector_clock = [0] * 8
+        # suspicion level of every other server, from heartbeats
+        self.failure_detector = FailureDetector(self.worker_pool, self.peer_client,
+                                                [srv_ip for srv_ip in servers_list if srv_ip != self.ip],
+                                                interval=heartbeat_interval, threshold=phi_threshold)
+        self.failure_detector.start()
+        # messages waiting for every other server, each server has its own queue and sender
+        self.outbound = OutboundQueues(self.worker_pool, self.send_messages, max_queued=max_queued,
+                                       spill_dir=spill_dir, suspected=self.failure_detector.suspected)
+        # after a restart the clock continues after all writes on the restored board; the clock is keyed by server
+        # id, so servers can join with any id
+        self.vector_clock = LocalClock(self.blackboard.clock or VectorClock())
+        # seconds between two anti-entropy rounds with a random other server, 0 to only sync on start
+        self.sync_interval = sync_interval
+        self.do_parallel_task(self.sync_with_all_servers)
 
         # list all REST URIs
         # if you add new URIs to the server, you need to add them here
         self.route('/', callback=self.index)
         self.get('/board', callback=self.get_board)
+        # changes of the board since the version a browser shows
+        self.get('/board/changes', callback=self.get_board_changes)
+        # server-sent events with the changes of the board
+        self.get('/board/stream', callback=self.get_board_stream)
         self.post('/board', callback=self.post_board)
         self.post('/board/<element_id:int>/', callback=self.post_modify)
         # we give access to the templates elements
         self.get('/templates/<filename:path>', callback=self.get_template)
+        # health of the connections to the other servers
+        self.get('/stats', callback=self.get_stats)
+        # the failure detectors of the other servers check that this server is alive
+        self.get('/heartbeat', callback=self.get_heartbeat)
         # leader propagates new entries to all followers
         self.post('/propagate', callback=self.post_propagate)
+        # anti-entropy: another server sends the digest of its writes and gets the ones it is missing
+        self.post('/sync', callback=self.post_sync)
         # You can have variables in the URI, here's an example self.post('/board/<element_id:int>/',
         # callback=self.post_board) where post_board takes an argument (integer) called element_id
 
-    @staticmethod
-    def do_parallel_task(method, args=()):
-        # create a thread running a new task Usage example: self.do_parallel_task(self.contact_another_server,
-        # args=("10.1.0.2", "/index", "POST", params_dict)) this would start a thread sending a post request to
-        # server 10.1.0.2 with URI /index and with params params_dict
-        thread = Thread(target=method,
-                        args=args)
-        thread.daemon = True
-        thread.start()
+    def do_parallel_task(self, method, args=None):
+        # run a task on the worker pool Usage example: self.do_parallel_task(self.contact_another_server,
+        # args=("10.1.0.2", "/index", "POST", params_dict)) this would send a post request to
+        # server 10.1.0.2 with URI /index and with params params_dict from one of the pool's threads
+        self.worker_pool.submit(method, args)
 
     def do_parallel_task_after_delay(self, delay, method, args=None):
-        # create a thread, and run a task after a specified delay
+        # run a task on the worker pool after a specified delay
         # Usage example: self.do_parallel_task_after_delay(10, self.start_election, args=(,))
-        # this would start a thread starting an election after 10 seconds
-        thread = Thread(target=self._wrapper_delay_and_execute,
-                        args=(delay, method, args))
-        thread.daemon = True
-        thread.start()
+        # this would start an election after 10 seconds
+        self.worker_pool.submit_after_delay(delay, method, args)
 
-    @staticmethod
-    def _wrapper_delay_and_execute(delay, method, args):
-        time.sleep(delay)  # in sec
-        method(*args)
-
-    @staticmethod
-    def contact_another_server(srv_ip, URI, req='POST', params_dict=None):
-        # Try to contact another server through a POST or GET
+    def contact_another_server(self, srv_ip, URI, req='POST', params_dict=None):
+        # Try to contact another server through a POST or GET, reusing the pooled connections to that server
         # usage: server.contact_another_server("10.1.1.1", "/index", "POST", params_dict)
-        success = False
+        return self.peer_client.contact(srv_ip, URI, req, params_dict)
+
+    def propagate_to_all_servers(self, msgs: list):
+        # queues the messages for all other servers, they are sent in order and retried until they are delivered
+        wire_msgs = [msg.to_wire() for msg in msgs]
+        for srv_ip in self.servers_list:
+            if srv_ip != self.ip:  # don't propagate to yourself
+                self.outbound.enqueue(srv_ip, wire_msgs)
+
+    def propagate_messages(self, msgs: list):
+        self.propagate_to_all_servers(msgs)
+
+    def send_messages(self, srv_ip, wire_msgs: list, URI='/propagate', content_type=None) -> bool:
+        # sends the messages encoded in self.wire_format, or in json if the other server can't decode it
+        content_type = content_type or self.peer_formats.get(srv_ip, self.wire_format)
         try:
-            res = 0
-            if 'POST' in req:
-                res = requests.post('http://{}{}'.format(srv_ip, URI),
-                                    data=params_dict)
-            elif 'GET' in req:
-                res = requests.get('http://{}{}'.format(srv_ip, URI))
-            # result can be accessed res.json()
-            if res.status_code == 200:
-                success = True
+            res = self.peer_client.request(srv_ip, URI, 'POST', wire_format.encode(wire_msgs, content_type),
+                                           headers={'Content-Type': content_type})
+            if res.status_code == 415 and content_type != wire_format.JSON:
+                print('Server {} can\'t decode {}, falling back to json'.format(srv_ip, content_type))
+                self.peer_formats[srv_ip] = wire_format.JSON
+                return self.send_messages(srv_ip, wire_msgs, URI)
+            if res.status_code == 400:
+                # the other server couldn't decode this batch; sending it again as is would fail forever
+                if content_type != wire_format.JSON:
+                    print("[WARNING ]Server {} rejected a {} batch, sending it as json".format(srv_ip, content_type))
+                    return self.send_messages(srv_ip, wire_msgs, URI, wire_format.JSON)
+                print("[ERROR] Server {} rejected a batch of {} messages, dropping it: {}".format(
+                    srv_ip, len(wire_msgs), res.text))
+                return True
+            return res.status_code == 200
         except Exception as e:
             print("[ERROR] " + str(e))
-        return success
+            return False
 
-    def propagate_to_all_servers(self, URI='/propagate', req='POST', msg=None):
-        for srv_ip in self.servers_list:
-            if srv_ip != self.ip:  # don't propagate to yourself
-                msg.to_ip = srv_ip
-                success = self.contact_another_server(srv_ip, URI, req, msg.to_dict())
-                if not success:
-                    print("[WARNING ]Could not contact server {}".format(srv_ip))
-                    with self.queue_lock:
-                        self.out_queue.append(copy.copy(msg))
-
-    def send_msg_from_queue(self):
-        while True:
-            time.sleep(1)
-            n = len(self.out_queue)
-            if n > 0:
-                # try to send all messages in queue and delete all which could be delivered
-                with self.queue_lock:
-                    print('Trying to send {} messages that are currently in the queue...'.format(len(self.out_queue)))
-                    self.out_queue[:] = [msg for msg in self.out_queue
-                                         if not self.contact_another_server(
-                            srv_ip=msg.to_ip, URI='/propagate', req='POST', params_dict=msg.to_dict())]
-                print('Sent {} messages from the queue.'.format(n - len(self.out_queue)))
+    def sync_with(self, srv_ip) -> bool:
+        # pulls the writes this server is missing from srv_ip in one round trip, see anti_entropy.BucketDigest
+        try:
+            res = self.peer_client.request(srv_ip, '/sync', 'POST',
+                                           {'digest': json.dumps(self.blackboard.get_digest())})
+            res.raise_for_status()
+            writes = res.json()['writes']
+        except Exception as e:
+            print("[WARNING ]Could not sync with server {}: {}".format(srv_ip, e))
+            return False
+        if self.blackboard.apply_writes(writes) > 0:
+            print('Pulled {} writes from server {}'.format(len(writes), srv_ip))
+            with self.clock_lock:
+                self.vector_clock.merge(self.blackboard.clock, self.id)
+        return True
+
+    def sync_with_all_servers(self):
+        # a starting server catches up with all other servers at once, then syncs with one of them from time to time
+        peers = [srv_ip for srv_ip in self.servers_list if srv_ip != self.ip]
+        self.fan_out.broadcast(peers, self.sync_with)
+        if self.sync_interval > 0:
+            self.do_parallel_task_after_delay(self.sync_interval, self.sync_with_random_server)
+
+    def sync_with_random_server(self):
+        peers = [srv_ip for srv_ip in self.servers_list
+                 if srv_ip != self.ip and not self.failure_detector.suspected(srv_ip)]
+        if peers:
+            self.sync_with(random.choice(peers))
+        self.do_parallel_task_after_delay(self.sync_interval, self.sync_with_random_server)
+
+    # post to ('/sync')
+    def post_sync(self):
+        try:
+            digest = json.loads(request.forms.get('digest'))
+        except (TypeError, ValueError):
+            response.status = 400
+            return 'digest missing'
+        return {'writes': self.blackboard.get_writes(digest)}
 
     # post to ('/propagate')
     def post_propagate(self):
-        msg = Message.request_to_msg(request.forms)
-        print(str(msg.vector_clock) + ' from ' + str(msg.from_id) + ' (' + msg.action + ')')
-
-        if msg.action == SUBMIT:
-            self.blackboard.integrate_entry(msg.entry)
-        elif msg.action == MODIFY:
-            self.blackboard.modify_entry(msg.entry, msg.entry_clock)
-        elif msg.action == DELETE:
-            self.blackboard.del_entry(msg.entry, msg.entry_clock)
+        # the Content-Type tells how the batch of messages is encoded, see wire_format
+        # form encoded requests carry a batch as json list in the field 'batch', or a single message as form fields
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type in wire_format.WIRE_FORMATS.values():
+            try:
+                msgs = [Message.from_wire(msg_dict) for msg_dict in wire_format.decode(request.body.read(),
+                                                                                        content_type)]
+            except wire_format.UnsupportedFormat as e:
+                response.status = 415
+                return str(e)
+            except (ValueError, KeyError, TypeError) as e:
+                # a truncated or corrupt body, or messages missing fields; the sender drops the batch instead of
+                # retrying it
+                response.status = 400
+                return str(e)
+        elif request.forms.get('batch') is not None:
+            msgs = [Message.request_to_msg(msg_dict) for msg_dict in json.loads(request.forms.get('batch'))]
+        else:
+            msgs = [Message.request_to_msg(request.forms)]
+
+        # the whole batch is applied holding the lock once
+        with self.blackboard.lock:
+            for msg in msgs:
+                print(str(msg.vector_clock) + ' from ' + str(msg.from_id) + ' (' + msg.action + ')')
+                if msg.action == SUBMIT:
+                    self.blackboard.integrate_entry(msg.entry)
+                elif msg.action == MODIFY:
+                    self.blackboard.modify_entry(msg.entry, msg.entry_clock)
+                elif msg.action == DELETE:
+                    self.blackboard.del_entry(msg.entry, msg.entry_clock)
 
         with self.clock_lock:
-            self.vector_clock[self.id - 1] += 1
-            for svr_id in range(1, SERVER_COUNT + 1):
-                if svr_id != self.id:
-                    self.vector_clock[svr_id - 1] = max(self.vector_clock[svr_id - 1], msg.vector_clock[svr_id - 1])
+            for msg in msgs:
+                # the other servers never know more about this server's writes than this server itself
+                self.vector_clock.merge(msg.vector_clock, self.id)
+
+    def board_page(self, name: str, render, *key):
+        # the page rendered from the current version of the blackboard, render(board, version) is only called if
+        # the page isn't in the render cache yet; key are the other values the page depends on
+        # returns the version and the page
+        version = self.blackboard.changes.version
+        page = self.render_cache.get((name, version) + key)
+        if page is None:
+            # we must transform the blackboard as a dict for compatibility reasons
+            version, board = self.blackboard.get_versioned_content()
+            page = self.render_cache.put((name, version) + key, render(board, version))
+        return version, page
 
     # route to ('/')
     def index(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
-        return template('server/templates/index.tpl',
-                        board_title='Server {} ({}) - {}'.format(self.id, self.ip, self.vector_clock),
-                        board_dict=board.items(),
-                        members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        board_title = 'Server {} ({}) - {}'.format(self.id, self.ip, self.vector_clock)
+        # browsers open /board/stream only if an open stream doesn't hold a request thread
+        stream = async_streams(request.environ)
+
+        def render(board, version):
+            return template('server/templates/index.tpl',
+                            board_title=board_title,
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream,
+                            members_name_string='Lorenz Meierhofer and Tino Jeromin')
+        return self.board_page('index', render, board_title, stream)[1].send()
 
     # get on ('/board')
     def get_board(self):
-        # we must transform the blackboard as a dict for compatibility reasons
-        board = dict()
-        board = self.blackboard.get_content()
-        return template('server/templates/blackboard.tpl',
-                        board_title='Server {} ({}) - {}'.format(self.id, self.ip, self.vector_clock),
-                        board_dict=board.items())
+        # browsers revalidate the board on every reload and get 304 Not Modified if it didn't change
+        etag = self.blackboard.changes.etag(self.blackboard.changes.version)
+        if request.get_header('If-None-Match') == etag:
+            return HTTPResponse(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+        def render(board, version):
+            return template('server/templates/blackboard.tpl',
+                            board_dict=board.items(),
+                            board_epoch=self.blackboard.changes.epoch,
+                            board_version=version,
+                            board_stream=stream)
+        stream = async_streams(request.environ)
+        version, page = self.board_page('board', render, stream)
+        response.set_header('ETag', self.blackboard.changes.etag(version))
+        response.set_header('Cache-Control', 'no-cache')
+        return page.send()
+
+    # get on ('/board/changes')
+    def get_board_changes(self):
+        # ?since=<version>&epoch=<epoch> of the board shown by the browser, see board_changes.ChangeLog
+        try:
+            since = int(request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        response.set_header('Cache-Control', 'no-cache')
+        return self.blackboard.get_changes(since, request.query.get('epoch'))
+
+    # get on ('/board/stream')
+    def get_board_stream(self):
+        # every change of the board after ?since=<version>&epoch=<epoch> as it is applied,
+        # a reconnecting browser continues after the Last-Event-ID it received
+        try:
+            since = int(request.get_header('Last-Event-ID') or request.query.get('since'))
+        except (TypeError, ValueError):
+            since = -1
+        threaded = not async_streams(request.environ)
+        if threaded and not self.thread_streams.acquire():
+            # every stream holds a request thread until THREAD_STREAM_DURATION; the browser polls /board/changes
+            response.status = 503
+            return 'too many streams, poll /board/changes'
+        response.content_type = 'text/event-stream'
+        response.set_header('Cache-Control', 'no-cache')
+        subscription = self.blackboard.subscribe(since, request.query.get('epoch'))
+        if threaded:
+            subscription.when_closed(self.thread_streams.release)
+        return stream_response(request.environ, subscription)
 
     # post on ('/board')
     def post_board(self):
@@ -376,12 +657,11 @@ class Server(Bottle):
             # we read the POST form, and check for an element called 'entry'
             new_entry = request.forms.get('entry')
             with self.clock_lock:
-                self.vector_clock[self.id - 1] += 1
-                msg = Message(SUBMIT, self.vector_clock, self.id, new_entry)
+                msg = Message(SUBMIT, self.vector_clock.increment(self.id), self.id, new_entry)
             self.blackboard.add_entry(msg.entry)
 
             print("Received: {}".format(new_entry))
-            self.do_parallel_task(self.propagate_to_all_servers, args=('/propagate', 'POST', msg,))
+            self.batcher.add(msg)
 
         except Exception as e:
             print("[ERROR] " + str(e))
@@ -397,21 +677,35 @@ class Server(Bottle):
 
             print('modify/delete entry with clock ' + str(entry_clock))
             with self.clock_lock:
-                self.vector_clock[self.id - 1] += 1
+                clock = self.vector_clock.increment(self.id)
 
                 if delete == '1':
-                    msg = Message(DELETE, self.vector_clock, self.id, entry=new_entry, entry_clock=entry_clock)
+                    msg = Message(DELETE, clock, self.id, entry=new_entry, entry_clock=entry_clock)
                     self.blackboard.del_entry(msg.entry, entry_clock)
                 else:
-                    msg = Message(MODIFY, self.vector_clock, self.id, entry=new_entry, entry_clock=entry_clock)
+                    msg = Message(MODIFY, clock, self.id, entry=new_entry, entry_clock=entry_clock)
                     self.blackboard.modify_entry(msg.entry, entry_clock)
 
             print("Received: {}".format(new_entry))
-            self.do_parallel_task(self.propagate_to_all_servers,
-                                  args=('/propagate', 'POST', msg))
+            self.batcher.add(msg)
         except Exception as e:
             print("[ERROR] " + str(e))
 
+    # get on ('/heartbeat')
+    def get_heartbeat(self):
+        return 'ok'
+
+    # get on ('/stats')
+    def get_stats(self):
+        return {'peers': self.peer_client.health_report(),
+                'failure_detector': self.failure_detector.metrics(),
+                'workers': self.worker_pool.metrics(),
+                'streams': len(self.blackboard.changes.subscribers),
+                'thread_streams': self.thread_streams.metrics(),
+                'render_cache': self.render_cache.metrics(),
+                'outbound': self.outbound.metrics(),
+                'journal': self.blackboard.journal.metrics() if self.blackboard.journal is not None else None}
+
     @staticmethod
     def get_template(filename):
         return static_file(filename, root='./server/templates/')
@@ -432,18 +726,204 @@ def main():
                         dest='srv_list',
                         default="10.1.0.1,10.1.0.2",
                         help='List of all servers present in the network')
+    parser.add_argument('--server-mode',
+                        nargs='?',
+                        dest='server_mode',
+                        default='threadpool',
+                        choices=sorted(SERVER_MODES),
+                        help='How requests are served: wsgiref (one at a time), threadpool or asyncio '
+                             '(idle /board/stream clients don\'t hold a thread)')
+    parser.add_argument('--server-threads',
+                        nargs='?',
+                        dest='server_threads',
+                        default=DEFAULT_POOL_SIZE,
+                        type=int,
+                        help='Number of threads serving requests in threadpool and asyncio mode')
+    parser.add_argument('--max-thread-streams',
+                        nargs='?',
+                        dest='max_thread_streams',
+                        default=MAX_THREAD_STREAMS,
+                        type=int,
+                        help='Number of /board/stream clients served at the same time in threadpool mode, every one '
+                             'holds a request thread; more are refused. None in wsgiref mode, a stream would block '
+                             'the server')
+    parser.add_argument('--peer-pool-size',
+                        nargs='?',
+                        dest='peer_pool_size',
+                        default=DEFAULT_PEER_POOL_SIZE,
+                        type=int,
+                        help='Number of keep-alive connections kept open to every other server')
+    parser.add_argument('--connect-timeout',
+                        nargs='?',
+                        dest='connect_timeout',
+                        default=CONNECT_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for a connection to another server')
+    parser.add_argument('--read-timeout',
+                        nargs='?',
+                        dest='read_timeout',
+                        default=READ_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for the answer of another server')
+    parser.add_argument('--retries',
+                        nargs='?',
+                        dest='retries',
+                        default=DEFAULT_RETRIES,
+                        type=int,
+                        help='Retries of a message to another server that could not be reached')
+    parser.add_argument('--retry-ratio',
+                        nargs='?',
+                        dest='retry_ratio',
+                        default=DEFAULT_RETRY_RATIO,
+                        type=float,
+                        help='Fraction of the messages to another server that may be retried')
+    parser.add_argument('--breaker-threshold',
+                        nargs='?',
+                        dest='breaker_threshold',
+                        default=DEFAULT_BREAKER_THRESHOLD,
+                        type=int,
+                        help='Consecutive failures after which messages to another server fail at once')
+    parser.add_argument('--breaker-reset',
+                        nargs='?',
+                        dest='breaker_reset',
+                        default=DEFAULT_BREAKER_RESET,
+                        type=float,
+                        help='Seconds until another server is tried again after its circuit was opened')
+    parser.add_argument('--fanout-concurrency',
+                        nargs='?',
+                        dest='fanout_concurrency',
+                        default=DEFAULT_MAX_CONCURRENCY,
+                        type=int,
+                        help='Maximum number of servers contacted at the same time during a broadcast')
+    parser.add_argument('--fanout-deadline',
+                        nargs='?',
+                        dest='fanout_deadline',
+                        default=None,
+                        type=float,
+                        help='Seconds after which a server that hasn\'t answered a broadcast counts as failed')
+    parser.add_argument('--workers',
+                        nargs='?',
+                        dest='workers',
+                        default=DEFAULT_WORKERS,
+                        type=int,
+                        help='Number of threads running background tasks')
+    parser.add_argument('--task-queue-size',
+                        nargs='?',
+                        dest='task_queue_size',
+                        default=DEFAULT_MAX_QUEUE,
+                        type=int,
+                        help='Maximum number of waiting background tasks before requests are slowed down')
+    parser.add_argument('--batch-window',
+                        nargs='?',
+                        dest='batch_window',
+                        default=DEFAULT_BATCH_WINDOW,
+                        type=float,
+                        help='Seconds board operations are collected before they are propagated together')
+    parser.add_argument('--batch-size',
+                        nargs='?',
+                        dest='batch_size',
+                        default=DEFAULT_BATCH_SIZE,
+                        type=int,
+                        help='Maximum number of board operations propagated in one message')
+    parser.add_argument('--wire-format',
+                        nargs='?',
+                        dest='wire_format',
+                        default='binary',
+                        choices=sorted(wire_format.WIRE_FORMATS),
+                        help='Encoding of the messages sent to the other servers, msgpack needs the msgpack package')
+    parser.add_argument('--data-dir',
+                        nargs='?',
+                        dest='data_dir',
+                        default=None,
+                        help='Directory of the write-ahead log and snapshots of the board, '
+                             'the board is only kept in memory if not given')
+    parser.add_argument('--fsync-interval',
+                        nargs='?',
+                        dest='fsync_interval',
+                        default=DEFAULT_FSYNC_INTERVAL,
+                        type=float,
+                        help='Seconds board changes are collected before they are written and fsynced together, '
+                             'at most this window is lost in a crash')
+    parser.add_argument('--snapshot-every',
+                        nargs='?',
+                        dest='snapshot_every',
+                        default=DEFAULT_SNAPSHOT_EVERY,
+                        type=int,
+                        help='Number of logged changes after which a snapshot of the board is written')
+    parser.add_argument('--sync-interval',
+                        nargs='?',
+                        dest='sync_interval',
+                        default=DEFAULT_SYNC_INTERVAL,
+                        type=float,
+                        help='Seconds between two anti-entropy rounds with a random other server, 0 to only '
+                             'sync on start')
+    parser.add_argument('--max-queued',
+                        nargs='?',
+                        dest='max_queued',
+                        default=DEFAULT_MAX_QUEUED,
+                        type=int,
+                        help='Maximum number of messages kept in memory for a server that can\'t be reached')
+    parser.add_argument('--spill-dir',
+                        nargs='?',
+                        dest='spill_dir',
+                        default=None,
+                        help='Directory the messages exceeding --max-queued are written to, '
+                             'they are dropped (and repaired by anti-entropy) if not given')
+    parser.add_argument('--heartbeat-interval',
+                        nargs='?',
+                        dest='heartbeat_interval',
+                        default=DEFAULT_HEARTBEAT_INTERVAL,
+                        type=float,
+                        help='Seconds between two heartbeats sent to every other server')
+    parser.add_argument('--phi-threshold',
+                        nargs='?',
+                        dest='phi_threshold',
+                        default=DEFAULT_PHI_THRESHOLD,
+                        type=float,
+                        help='Suspicion level (phi) above which another server is treated as failed')
     args = parser.parse_args()
     server_id = args.id
     server_ip = "10.1.0.{}".format(server_id)
     servers_list = args.srv_list.split(",")
 
     try:
+        peer_client = PeerClient(pool_size=args.peer_pool_size,
+                                 connect_timeout=args.connect_timeout,
+                                 read_timeout=args.read_timeout,
+                                 retries=args.retries,
+                                 retry_ratio=args.retry_ratio,
+                                 breaker_threshold=args.breaker_threshold,
+                                 breaker_reset=args.breaker_reset)
+        worker_pool = WorkerPool(workers=args.workers, max_queue=args.task_queue_size)
+        journal = Journal(args.data_dir,
+                          worker_pool,
+                          fsync_interval=args.fsync_interval,
+                          snapshot_every=args.snapshot_every) if args.data_dir else None
         server = Server(server_id,
                         server_ip,
-                        servers_list)
+                        servers_list,
+                        peer_client=peer_client,
+                        fan_out=FanOut(max_concurrency=args.fanout_concurrency,
+                                       deadline=args.fanout_deadline),
+                        worker_pool=worker_pool,
+                        batch_window=args.batch_window,
+                        batch_size=args.batch_size,
+                        wire_content_type=wire_format.WIRE_FORMATS[args.wire_format],
+                        journal=journal,
+                        heartbeat_interval=args.heartbeat_interval,
+                        phi_threshold=args.phi_threshold,
+                        sync_interval=args.sync_interval,
+                        max_queued=args.max_queued,
+                        spill_dir=args.spill_dir,
+                        # a stream in wsgiref mode would hold the only thread serving requests
+                        max_thread_streams=0 if args.server_mode == 'wsgiref' else args.max_thread_streams)
         bottle.run(server,
+                   server=SERVER_MODES[args.server_mode],
                    host=server_ip,
-                   port=PORT)
+                   port=PORT,
+                   pool_size=args.server_threads)
+        if journal is not None:
+            journal.close()
     except Exception as e:
         raise Exception(str(e))
 
@@ -0,0 +1,327 @@
+# coding=utf-8
+import asyncio
+import io
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from threading import Lock
+from urllib.parse import unquote
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+from bottle import ServerAdapter, WSGIRefServer
+
+# Server adapters for bottle.run(). Without a server= argument bottle falls back to WSGIRefServer, which
+# handles one request at a time, so /propagate calls from the other servers queue up behind a slow /board render.
+# Usage: bottle.run(server, host=server_ip, port=PORT, server=SERVER_MODES['threadpool'], pool_size=32)
+
+DEFAULT_POOL_SIZE = 32
+# seconds an idle keep-alive connection may hold on to the server before it is closed
+KEEPALIVE_TIMEOUT = 5
+# environ key of a callable set by the AsyncioServer: an application passing it an async iterable of bytes has
+# its (long lived) response body sent from the event loop instead of returning it, see event_stream.stream_response
+ASYNC_STREAM = 'server_adapters.async_stream'
+
+
+# ------------------------------------------------------------------------------------------------------
+class _BoundedInput:
+    """ wsgi.input which never reads past the request body, so the next request on a keep-alive
+        connection is not consumed by the application
+    """
+
+    def __init__(self, rfile, length: int):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def drain(self):
+        # skip whatever part of the body the application did not read
+        while self.remaining > 0 and self.read(64 * 1024):
+            pass
+
+
+class _KeepAliveServerHandler(ServerHandler):
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        # without a Content-Length the client can only detect the end of the body by the connection closing
+        if 'Content-Length' not in self.headers:
+            self.request_handler.close_connection = True
+        if self.request_handler.close_connection:
+            self.headers['Connection'] = 'close'
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """ WSGIRequestHandler answering with HTTP/1.1 and serving several requests per connection """
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # headers and body are written separately, with Nagle the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def address_string(self):  # Prevent reverse DNS lookups please.
+        return self.client_address[0]
+
+    def log_request(self, *args, **kw):
+        if not getattr(self.server, 'quiet', False):
+            return WSGIRequestHandler.log_request(self, *args, **kw)
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        # same as WSGIRequestHandler.handle(), but leaves the connection open if the request allows it
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request():  # An error code has been sent, just exit
+            return
+
+        environ = self.get_environ()
+        body = _BoundedInput(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+        handler = _KeepAliveServerHandler(body, self.wfile, self.get_stderr(), environ, multithread=True)
+        handler.request_handler = self  # backpointer for logging & connection closing
+        handler.run(self.server.get_app())
+        body.drain()
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """ WSGIServer handing every accepted connection to a fixed pool of worker threads """
+    pool_size = DEFAULT_POOL_SIZE
+    request_queue_size = 128
+    quiet = False
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadPoolWSGIServer, self).__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='http')
+        # connections being served, closed on shutdown
+        self.connections = set()
+        self.connections_lock = Lock()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(ThreadPoolWSGIServer, self).server_close()
+        # the executor's threads are joined at exit: a keep-alive connection kept busy by the heartbeats of the
+        # other servers would never time out, so the waiting reads are ended here
+        with self.connections_lock:
+            for request in self.connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=False)
+
+
+# ------------------------------------------------------------------------------------------------------
+class ThreadPoolServer(WSGIRefServer):
+    """ wsgiref based server handling up to pool_size connections concurrently """
+
+    def run(self, app):  # pragma: no cover
+        server_cls = type('ThreadPoolWSGIServer', (ThreadPoolWSGIServer,),
+                          {'pool_size': self.options.get('pool_size', DEFAULT_POOL_SIZE),
+                           'quiet': self.quiet})
+        self.options.setdefault('server_class', server_cls)
+        self.options.setdefault('handler_class', KeepAliveRequestHandler)
+        super(ThreadPoolServer, self).run(app)
+
+
+class AsyncioServer(ServerAdapter):
+    """ asyncio based server: connections are coroutines, so idle keep-alive connections are cheap.
+        The (blocking) WSGI application itself runs on a pool of pool_size threads.
+    """
+
+    def run(self, app):  # pragma: no cover
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=self.options.get('pool_size', DEFAULT_POOL_SIZE),
+                                           thread_name_prefix='wsgi')
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        srv = self.loop.run_until_complete(asyncio.start_server(self._serve_connection, self.host, self.port,
+                                                                backlog=128))
+        self.port = srv.sockets[0].getsockname()[1]  # update port actual port (0 means random)
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            srv.close()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def _serve_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b''
+                environ = self._make_environ(method, target, version, headers, body, peer)
+
+                connection = headers.get('connection', '').lower()
+                if version == 'HTTP/1.1':
+                    keep_alive = connection != 'close'
+                else:
+                    keep_alive = connection == 'keep-alive'
+
+                status, response_headers, chunks, stream = await self.loop.run_in_executor(self.executor,
+                                                                                           self._call_app, environ)
+                if stream is not None:
+                    self._log_request(peer, request_line, status, chunks)
+                    await self._send_stream(writer, status, response_headers, stream)
+                    break
+                writer.write(self._response_head(version, status, response_headers, chunks, keep_alive))
+                for chunk in chunks:
+                    writer.write(chunk)
+                await writer.drain()
+                self._log_request(peer, request_line, status, chunks)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_stream(self, writer, status, headers, stream):
+        # the body ends when the stream ends or the client is gone, so the connection is closed afterwards
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        writer.write(self._response_head('HTTP/1.1', status, headers, None, False))
+        stream_iter = stream.__aiter__()
+        try:
+            async for chunk in stream_iter:
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            if hasattr(stream_iter, 'aclose'):
+                await stream_iter.aclose()
+
+    def _make_environ(self, method, target, version, headers, body, peer) -> dict:
+        path, _, query = target.partition('?')
+        environ = {'REQUEST_METHOD': method,
+                   'SCRIPT_NAME': '',
+                   'PATH_INFO': unquote(path, 'latin-1'),
+                   'QUERY_STRING': query,
+                   'SERVER_NAME': self.host,
+                   'SERVER_PORT': str(self.port),
+                   'SERVER_PROTOCOL': version,
+                   'REMOTE_ADDR': peer[0],
+                   'CONTENT_TYPE': headers.pop('content-type', ''),
+                   'CONTENT_LENGTH': headers.pop('content-length', ''),
+                   'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.input': io.BytesIO(body),
+                   'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True,
+                   'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        for name, value in headers.items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    def _call_app(self, environ):
+        # runs on the thread pool; the response is buffered so the event loop never blocks on the application
+        response = dict()
+        chunks = list()
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+
+        streams = list()
+        environ[ASYNC_STREAM] = streams.append
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks, streams[0] if streams else None
+
+    @staticmethod
+    def _response_head(version, status, headers, chunks, keep_alive) -> bytes:
+        names = set(name.lower() for name, _ in headers)
+        lines = ['HTTP/1.1 {}'.format(status)]
+        lines += ['{}: {}'.format(name, value) for name, value in headers]
+        if 'content-length' not in names and chunks is not None:
+            lines.append('Content-Length: {}'.format(sum(len(c) for c in chunks)))
+        if 'date' not in names:
+            lines.append('Date: {}'.format(formatdate(usegmt=True)))
+        if not keep_alive:
+            lines.append('Connection: close')
+        elif version != 'HTTP/1.1':
+            lines.append('Connection: keep-alive')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def _log_request(self, peer, request_line, status, chunks):
+        if not self.quiet:
+            sys.stderr.write('{} - - [{}] "{}" {} {}\n'.format(peer[0], time.strftime('%d/%b/%Y %H:%M:%S'),
+                                                              request_line.decode('latin-1').strip(),
+                                                              status.split(' ', 1)[0], sum(len(c) for c in chunks)))
+
+
+# ------------------------------------------------------------------------------------------------------
+# selectable with --server-mode
+SERVER_MODES = {'wsgiref': WSGIRefServer,
+                'threadpool': ThreadPoolServer,
+                'asyncio': AsyncioServer}
@@ -1,4 +1,4 @@
-                    <div id="boardcontents_placeholder">
+                    <div id="boardcontents_placeholder" data-epoch="{{board_epoch}}" data-version="{{board_version}}"{{!' data-stream' if board_stream else ''}} data-positional>
                     <div class="row">
                     <!-- this place will show the actual contents of the blackboard. 
                     It will be reloaded automatically from the server -->
@@ -10,6 +10,7 @@
                                 <input type="text" name="id" value="ID" readonly>
                                 <input type="text" name="vector_clock" value="Vector clock" size="20%%" readonly>
                                 <input type="text" name="entry" value="Entry" size="60%%" readonly>
+                                <div id="board_entries">
                                 % i = 0
                                 % for board_entry, board_element in board_dict:
                                     <form class="entryform" target="noreload" method="post" action="/board/{{i}}/">
@@ -21,6 +22,7 @@
                                     </form>
                                     % i += 1
                                 %end
+                                </div>
                             </div>
                         </div>
                     </div>
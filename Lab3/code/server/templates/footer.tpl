@@ -52,12 +52,104 @@
     <script>
                 var page_reload_timeout = 5; //in seconds
                 var page_reload_count = 0;
+                // the board is downloaded once, afterwards only the changes since the shown version (see /board/changes)
+                function board_version() {
+                    var board = $("#boardcontents_placeholder");
+                    return {epoch: board.attr("data-epoch"), since: board.attr("data-version")};
+                }
+                function entry_row(change) {
+                    // same markup as a row of blackboard.tpl
+                    var row = $('<form class="entryform" target="noreload" method="post"></form>');
+                    row.append($('<input type="text" name="id" readonly disabled>'));
+                    if (change.clock !== undefined) {
+                        row.append($('<input type="text" name="vector_clock" size="20%" readonly>').val(change.clock));
+                    }
+                    row.append($('<input type="text" name="entry">').attr("size", change.clock !== undefined ? "60%" : "70%").val(change.entry));
+                    row.append(' <button type="submit" name="delete" value="0">Modify</button> <button type="submit" name="delete" value="1">X</button>');
+                    return row;
+                }
+                function set_row_id(row, id) {
+                    row.attr("action", "/board/" + id + "/");
+                    row.find("input[name=id]").val(id);
+                }
+                function apply_changes(changes) {
+                    var entries = $("#board_entries");
+                    $.each(changes, function (i, change) {
+                        var rows = entries.children(".entryform");
+                        if (change.op === "insert") {
+                            var row = entry_row(change);
+                            set_row_id(row, change.id);
+                            if (change.index < rows.length) {
+                                rows.eq(change.index).before(row);
+                            } else {
+                                entries.append(row);
+                            }
+                        } else if (change.op === "update") {
+                            rows.eq(change.index).find("input[name=entry]").val(change.entry);
+                        } else if (change.op === "remove") {
+                            rows.eq(change.index).remove();
+                        }
+                    });
+                    // ids which are positions on the board shift with every insert and remove
+                    if ($("#boardcontents_placeholder").attr("data-positional") !== undefined) {
+                        entries.children(".entryform").each(function (index) {
+                            set_row_id($(this), index);
+                        });
+                    }
+                }
+                function reload_board(callback) {
+                    $.get("/board", function (data) {
+                        $("#boardcontents_placeholder").replaceWith($("<div>").html(data).find("#boardcontents_placeholder"));
+                    }).always(callback);
+                }
+                var update_running = false;
+                var update_pending = false;
                 function update_contents(){
+                    // one update at a time, otherwise the same changes would be applied twice
+                    if (update_running) {
+                        update_pending = true;
+                        return;
+                    }
+                    update_running = true;
                     page_reload_count += 1;
-                    $("#boardcontents_placeholder").load("/board #boardcontents_placeholder", function (data, status) {
-                        //alert("Data: " + data + "\nStatus: " + status);
+                    var done = function (data, status) {
                         $("#boardcontents_status_placeholder").text(page_reload_count + ": " + status);
+                        update_running = false;
+                        if (update_pending) {
+                            update_pending = false;
+                            update_contents();
+                        }
+                    };
+                    $.getJSON("/board/changes", board_version(), function (delta) {
+                        if (delta.reset) {
+                            reload_board(done);
+                            return;
+                        }
+                        apply_changes(delta.changes);
+                        $("#boardcontents_placeholder").attr({"data-epoch": delta.epoch, "data-version": delta.version});
+                        done(delta, "success");
+                    }).fail(done);
+                }
+                function open_stream() {
+                    // the server pushes every change of the board as it is applied, see /board/stream
+                    var stream = new EventSource("/board/stream?" + $.param(board_version()));
+                    stream.addEventListener("change", function (event) {
+                        apply_changes([JSON.parse(event.data)]);
+                        $("#boardcontents_placeholder").attr("data-version", event.lastEventId);
+                        $("#boardcontents_status_placeholder").text("live: version " + event.lastEventId);
                     });
+                    stream.addEventListener("reset", function () {
+                        stream.close();
+                        reload_board(open_stream);
+                    });
+                    stream.onerror = function () {
+                        if (stream.readyState === EventSource.CLOSED) {
+                            // refused by the server (503), it has no thread left for another stream
+                            start_polling();
+                            return;
+                        }
+                        $("#boardcontents_status_placeholder").text("live: reconnecting");
+                    };
                 }
                 function reload_countdown(remaining) {
                     $("#countdown_placeholder").text("reloading page in: " + remaining + " seconds.");
@@ -70,9 +162,19 @@
                         reload_countdown(remaining - 1);
                     }, 1000);
                 }
-                $(document).ready(function () {
+                function start_polling() {
                     reload_countdown(page_reload_timeout);
-                    $(".entryform").submit(update_contents);
+                    // the forms post into the hidden iframe, once the server answered the board is updated
+                    $("iframe[name=noreload]").on("load", update_contents);
+                }
+                $(document).ready(function () {
+                    // only the asyncio server streams (data-stream), otherwise every stream would hold a request thread
+                    if (window.EventSource && $("#boardcontents_placeholder").is("[data-stream]")) {
+                        $("#countdown_placeholder").text("live updates");
+                        open_stream();
+                        return;
+                    }
+                    start_polling();
                 });
     </script>
 </body>
@@ -0,0 +1,109 @@
+# coding=utf-8
+
+
+# ------------------------------------------------------------------------------------------------------
+class VectorClock:
+    """ Immutable vector clock keyed by node id (the server ids, starting at 1). Only nodes that wrote are stored,
+        so the size of a clock and the cost of comparing it grow with the writers, not with the number of servers,
+        and a server joining needs no resizing. The sum and the total ordering key are computed once on creation,
+        so comparing clocks while integrating entries doesn't loop over the components again.
+        On the wire and in the journal a clock is a dense list with the count of node i at index i - 1, up to the
+        highest node that wrote, see to_list.
+    """
+    __slots__ = ('counts', 'items', 'total', 'key', '_hash')
+
+    def __init__(self, values=()):
+        # values is a dense list (see to_list) or a dictionary of shape node id: count
+        if isinstance(values, dict):
+            counts = {int(node): int(count) for node, count in values.items() if int(count)}
+        else:
+            counts = {node: int(count) for node, count in enumerate(values, 1) if int(count)}
+        items = tuple(sorted(counts.items()))
+        object.__setattr__(self, 'counts', counts)
+        object.__setattr__(self, 'items', items)
+        object.__setattr__(self, 'total', sum(counts.values()))
+        # total ordering: by the sum of the clock, on a tie the lexicographically greater clock comes first;
+        # comparing the (node, -count) pairs in node order is the same as comparing the dense lists
+        object.__setattr__(self, 'key', (self.total, tuple((node, -count) for node, count in items)))
+        object.__setattr__(self, '_hash', hash(items))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('VectorClock is immutable')
+
+    def get(self, node: int) -> int:
+        return self.counts.get(node, 0)
+
+    def increment(self, node: int):
+        # a new clock with the count of node increased by one
+        counts = dict(self.counts)
+        counts[node] = counts.get(node, 0) + 1
+        return VectorClock(counts)
+
+    def merge(self, other):
+        # a new clock with the maximum count of every node of both clocks
+        counts = dict(self.counts)
+        for node, count in other.items:
+            if count > counts.get(node, 0):
+                counts[node] = count
+        return VectorClock(counts)
+
+    def dominates(self, other) -> bool:
+        # self happened after other
+        return self != other and all(self.counts.get(node, 0) >= count for node, count in other.items)
+
+    def concurrent(self, other) -> bool:
+        return self != other and not self.dominates(other) and not other.dominates(self)
+
+    def is_newer(self, other) -> bool:
+        # of two concurrent modifications the one with the greater sum wins, on a tie the lexicographically greater
+        return self.total > other.total or (self.total == other.total and self.key < other.key)
+
+    def to_list(self) -> list:
+        # dense encoding, the count of node i at index i - 1 up to the highest node that wrote
+        if not self.items:
+            return []
+        return [self.counts.get(node, 0) for node in range(1, self.items[-1][0] + 1)]
+
+    def __eq__(self, other):
+        return isinstance(other, VectorClock) and self.items == other.items
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __hash__(self):
+        return self._hash
+
+    def __len__(self):
+        return len(self.to_list())
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __repr__(self):
+        return str(self.to_list())
+
+
+# ------------------------------------------------------------------------------------------------------
+class LocalClock:
+    """ The clock of this server. Holds the current VectorClock and is updated by replacing it,
+        guard it with the server's clock_lock.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value: VectorClock):
+        self.value = value
+
+    def increment(self, node: int) -> VectorClock:
+        self.value = self.value.increment(node)
+        return self.value
+
+    def merge(self, other: VectorClock, node: int) -> VectorClock:
+        # merge a received clock and count the receive event of node
+        self.value = self.value.merge(other).increment(node)
+        return self.value
+
+    def __repr__(self):
+        return repr(self.value)
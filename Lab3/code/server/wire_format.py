@@ -0,0 +1,111 @@
+# coding=utf-8
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for --wire-format msgpack
+    msgpack = None
+
+# Encodings of a batch of /propagate messages, chosen by the Content-Type of the request.
+# A message is a dict of shape {'action': str, 'vector_clock': [int], 'from_id': int, 'entry': str or None,
+# 'entry_clock': [int]}.
+#
+# Binary format, all integers big-endian:
+#   header:  magic 'BB' | version (1 byte) | number of messages (4 bytes)
+#   message: action (1 byte) | from_id (2 bytes) | clock length n (2 bytes) | n clock values (4 bytes each)
+#            | entry clock length m (2 bytes) | m entry clock values (4 bytes each)
+#            | entry length (4 bytes, 0xFFFFFFFF for None) | entry (utf-8)
+BINARY = 'application/x-blackboard'
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# selectable with --wire-format
+WIRE_FORMATS = {'binary': BINARY, 'json': JSON, 'msgpack': MSGPACK}
+
+MAGIC = b'BB'
+VERSION = 1
+ACTIONS = ('submit', 'modify', 'delete')
+NO_ENTRY = 0xFFFFFFFF
+
+_header = struct.Struct('>2sBI')
+_length = struct.Struct('>H')
+# dictionary of shape (clock length, entry clock length): struct.Struct
+_message_structs = dict()
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+# ------------------------------------------------------------------------------------------------------
+def encode(messages: list, content_type=BINARY) -> bytes:
+    if content_type == BINARY:
+        return _encode_binary(messages)
+    elif content_type == JSON:
+        return json.dumps(messages).encode('utf-8')
+    elif content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(messages)
+    raise UnsupportedFormat('Can\'t encode {}'.format(content_type))
+
+
+def decode(body: bytes, content_type=BINARY) -> list:
+    # raises ValueError if the body is truncated or corrupt, UnsupportedFormat if content_type can't be decoded
+    try:
+        if content_type == BINARY:
+            return _decode_binary(body)
+        elif content_type == JSON:
+            return json.loads(body.decode('utf-8'))
+        elif content_type == MSGPACK and msgpack is not None:
+            return msgpack.unpackb(body, raw=False)
+    except UnsupportedFormat:
+        raise
+    except Exception as e:
+        # struct.error or IndexError of a truncated binary body, UnicodeDecodeError, the errors of json and msgpack
+        raise ValueError('Malformed {} body: {}'.format(content_type, e))
+    raise UnsupportedFormat('Can\'t decode {}'.format(content_type))
+
+
+def _message_struct(n: int, m: int) -> struct.Struct:
+    # fixed part of a message with clocks of length n and m, up to and including the entry length
+    key = (n, m)
+    if key not in _message_structs:
+        _message_structs[key] = struct.Struct('>BHH{}IH{}II'.format(n, m))
+    return _message_structs[key]
+
+
+def _encode_binary(messages: list) -> bytes:
+    parts = [_header.pack(MAGIC, VERSION, len(messages))]
+    for msg in messages:
+        clock = msg['vector_clock']
+        entry_clock = msg['entry_clock']
+        text = msg['entry'].encode('utf-8') if msg['entry'] is not None else b''
+        length = len(text) if msg['entry'] is not None else NO_ENTRY
+        parts.append(_message_struct(len(clock), len(entry_clock)).pack(
+            ACTIONS.index(msg['action']), msg['from_id'], len(clock), *clock, len(entry_clock), *entry_clock, length))
+        parts.append(text)
+    return b''.join(parts)
+
+
+def _decode_binary(body: bytes) -> list:
+    magic, version, count = _header.unpack_from(body, 0)
+    if magic != MAGIC or version != VERSION:
+        raise UnsupportedFormat('Unknown binary format {!r} version {}'.format(magic, version))
+    offset = _header.size
+    messages = list()
+    for _ in range(count):
+        n, = _length.unpack_from(body, offset + 3)
+        m, = _length.unpack_from(body, offset + 5 + 4 * n)
+        fixed = _message_struct(n, m)
+        values = fixed.unpack_from(body, offset)
+        offset += fixed.size
+        length = values[-1]
+        if length == NO_ENTRY:
+            entry = None
+        else:
+            if offset + length > len(body):
+                raise ValueError('Entry of {} bytes at offset {} is truncated'.format(length, offset))
+            entry = body[offset:offset + length].decode('utf-8')
+            offset += length
+        messages.append({'action': ACTIONS[values[0]], 'vector_clock': list(values[3:3 + n]), 'from_id': values[1],
+                         'entry': entry, 'entry_clock': list(values[4 + n:4 + n + m])})
+    return messages
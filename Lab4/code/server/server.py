@@ -1,11 +1,15 @@
 # coding=utf-8
 import argparse
 import byzantine_behavior
-from threading import Lock, Thread
-import time
+from threading import Lock
 import bottle
 from bottle import Bottle, request, template, run, static_file
-import requests
+from fanout import FanOut, DEFAULT_MAX_CONCURRENCY
+from peer_client import (PeerClient, DEFAULT_PEER_POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, DEFAULT_RETRIES,
+                         DEFAULT_RETRY_RATIO, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_RESET)
+from render_cache import RenderCache
+from server_adapters import SERVER_MODES, DEFAULT_POOL_SIZE
+from worker_pool import WorkerPool, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
 import json
 
 # constants for a given experiment
@@ -20,13 +24,22 @@ class Server(Bottle):
     legitimate = True       # set to False when node becomes byzantine
     vote_counter = 0        # keep track of number of incoming votes, send vote vector after all arrived
     result_string = ""      # will be displayed on the webpage
+    result_version = 0      # incremented after every new result_string, key of the rendered result page
 
-    def __init__(self, ID, IP, servers_list):
+    def __init__(self, ID, IP, servers_list, peer_client=None, fan_out=None, worker_pool=None):
         super(Server, self).__init__()
         print("serverslist")
         print(servers_list)
         self.id = int(ID)
         self.ip = str(IP)
+        # keep-alive connections to the other servers, shared by all outgoing messages
+        self.peer_client = peer_client or PeerClient()
+        # parallel broadcasts to the other servers
+        self.fan_out = fan_out or FanOut()
+        # threads running all background tasks
+        self.worker_pool = worker_pool or WorkerPool()
+        # rendered pages, the result page by Server.result_version
+        self.render_cache = RenderCache()
         self.servers_list = servers_list
 
         self.vote_vector = [-1] * no_total
@@ -47,66 +60,61 @@ class Server(Bottle):
 
         # we give access to the templates elements
         self.get('/templates/<filename:path>', callback=self.get_template)
+        # health of the connections to the other servers
+        self.get('/stats', callback=self.get_stats)
         # You can have variables in the URI, here's an example
         # self.post('/board/<element_id:int>/', callback=self.post_board) where post_board takes an argument (integer) called element_id
 
     def do_parallel_task(self, method, args=None):
-        # create a thread running a new task
-        # Usage example: self.do_parallel_task(self.contact_another_server, args=("10.1.0.2", "/index", "POST", params_dict))
-        # this would start a thread sending a post request to server 10.1.0.2 with URI /index and with params params_dict
-        thread = Thread(target=method,
-                        args=args)
-        thread.daemon = True
-        thread.start()
+        # run a task on the worker pool Usage example: self.do_parallel_task(self.contact_another_server,
+        # args=("10.1.0.2", "/index", "POST", params_dict)) this would send a post request to
+        # server 10.1.0.2 with URI /index and with params params_dict from one of the pool's threads
+        self.worker_pool.submit(method, args)
 
     def do_parallel_task_after_delay(self, delay, method, args=None):
-        # create a thread, and run a task after a specified delay
+        # run a task on the worker pool after a specified delay
         # Usage example: self.do_parallel_task_after_delay(10, self.start_election, args=(,))
-        # this would start a thread starting an election after 10 seconds
-        thread = Thread(target=self._wrapper_delay_and_execute,
-                        args=(delay, method, args))
-        thread.daemon = True
-        thread.start()
-
-    def _wrapper_delay_and_execute(self, delay, method, args):
-        time.sleep(delay)  # in sec
-        method(*args)
+        # this would start an election after 10 seconds
+        self.worker_pool.submit_after_delay(delay, method, args)
 
     def contact_another_server(self, srv_ip, URI, req='POST', params_dict=None):
-        # Try to contact another serverthrough a POST or GET
+        # Try to contact another server through a POST or GET, reusing the pooled connections to that server
         # usage: server.contact_another_server("10.1.1.1", "/index", "POST", params_dict)
-        success = False
-        try:
-            if 'POST' in req:
-                res = requests.post('http://{}{}'.format(srv_ip, URI),
-                                    data=params_dict)
-            elif 'GET' in req:
-                res = requests.get('http://{}{}'.format(srv_ip, URI))
-            # result can be accessed res.json()
-            if res.status_code == 200:
-                success = True
-        except Exception as e:
-            print("[ERROR] " + str(e))
-        return success
-
-    def propagate_to_all_servers(self, URI, req='POST', params_dict=None):
-        for srv_ip in self.servers_list:
-            if srv_ip != self.ip:  # don't propagate to yourself
-                success = self.contact_another_server(srv_ip, URI, req, params_dict)
-                if not success:
-                    print("[WARNING ]Could not contact server {}".format(srv_ip))
+        return self.peer_client.contact(srv_ip, URI, req, params_dict)
+
+    def propagate_to_all_servers(self, URI, req='POST', params_dict=None) -> dict:
+        # contacts all other servers in parallel and returns a dictionary of shape server_ip: success, None for
+        # the servers that didn't answer in time and may still apply the message, see FanOut.broadcast
+        peers = [srv_ip for srv_ip in self.servers_list if srv_ip != self.ip]  # don't propagate to yourself
+        results = self.fan_out.broadcast(peers,
+                                         lambda srv_ip: self.contact_another_server(srv_ip, URI, req, params_dict))
+        for srv_ip, success in results.items():
+            if success is None:
+                print("[WARNING ]No answer of server {} in time, it may still apply the message".format(srv_ip))
+            elif not success:
+                print("[WARNING ]Could not contact server {}".format(srv_ip))
+        return results
 
     # route to ('/')
     def home(self):
         # we must transform the blackboard as a dict for compatiobility reasons
-        return template('server/templates/vote_frontpage_template.html',
-                        board_title='Server {} ({})'.format(self.id,
-                                                            self.ip),
-                        members_name_string='INPUT YOUR NAME HERE')
+        page = self.render_cache.get('home')
+        if page is None:
+            page = self.render_cache.put('home', template('server/templates/vote_frontpage_template.html',
+                                                          board_title='Server {} ({})'.format(self.id,
+                                                                                              self.ip),
+                                                          members_name_string='INPUT YOUR NAME HERE'))
+        return page.send()
 
     # get on ('/vote/result')
     def get_vote(self):
-        return template('server/templates/vote_result_template.tpl', s=Server.result_string)
+        # the version is read before the string, a page is never cached under a newer version than its result
+        key = ('result', Server.result_version)
+        page = self.render_cache.get(key)
+        if page is None:
+            page = self.render_cache.put(key, template('server/templates/vote_result_template.tpl',
+                                                       s=Server.result_string))
+        return page.send()
 
     # post to ('/propagate/round1')
     def post_propagate1(self):
@@ -191,6 +199,7 @@ class Server(Bottle):
 
             # string to be displayed on screen
             Server.result_string = "result vector: " + str(result_vector) + "\nresult: " + str(result)
+            Server.result_version += 1
 
     # makes a node an honest general
     def post_attack(self):
@@ -212,6 +221,12 @@ class Server(Bottle):
     def post_byzantine(self):
         Server.legitimate = False
 
+    # get on ('/stats')
+    def get_stats(self):
+        return {'peers': self.peer_client.health_report(),
+                'workers': self.worker_pool.metrics(),
+                'render_cache': self.render_cache.metrics()}
+
     def get_template(self, filename):
         return static_file(filename, root='./server/templates/')
 
@@ -231,18 +246,110 @@ def main():
                         dest='srv_list',
                         default="10.1.0.1,10.1.0.2",
                         help='List of all servers present in the network')
+    parser.add_argument('--server-mode',
+                        nargs='?',
+                        dest='server_mode',
+                        default='threadpool',
+                        choices=sorted(SERVER_MODES),
+                        help='How requests are served: wsgiref (one at a time), threadpool or asyncio')
+    parser.add_argument('--server-threads',
+                        nargs='?',
+                        dest='server_threads',
+                        default=DEFAULT_POOL_SIZE,
+                        type=int,
+                        help='Number of threads serving requests in threadpool and asyncio mode')
+    parser.add_argument('--peer-pool-size',
+                        nargs='?',
+                        dest='peer_pool_size',
+                        default=DEFAULT_PEER_POOL_SIZE,
+                        type=int,
+                        help='Number of keep-alive connections kept open to every other server')
+    parser.add_argument('--connect-timeout',
+                        nargs='?',
+                        dest='connect_timeout',
+                        default=CONNECT_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for a connection to another server')
+    parser.add_argument('--read-timeout',
+                        nargs='?',
+                        dest='read_timeout',
+                        default=READ_TIMEOUT,
+                        type=float,
+                        help='Seconds to wait for the answer of another server')
+    parser.add_argument('--retries',
+                        nargs='?',
+                        dest='retries',
+                        default=DEFAULT_RETRIES,
+                        type=int,
+                        help='Retries of a message to another server that could not be reached')
+    parser.add_argument('--retry-ratio',
+                        nargs='?',
+                        dest='retry_ratio',
+                        default=DEFAULT_RETRY_RATIO,
+                        type=float,
+                        help='Fraction of the messages to another server that may be retried')
+    parser.add_argument('--breaker-threshold',
+                        nargs='?',
+                        dest='breaker_threshold',
+                        default=DEFAULT_BREAKER_THRESHOLD,
+                        type=int,
+                        help='Consecutive failures after which messages to another server fail at once')
+    parser.add_argument('--breaker-reset',
+                        nargs='?',
+                        dest='breaker_reset',
+                        default=DEFAULT_BREAKER_RESET,
+                        type=float,
+                        help='Seconds until another server is tried again after its circuit was opened')
+    parser.add_argument('--fanout-concurrency',
+                        nargs='?',
+                        dest='fanout_concurrency',
+                        default=DEFAULT_MAX_CONCURRENCY,
+                        type=int,
+                        help='Maximum number of servers contacted at the same time during a broadcast')
+    parser.add_argument('--fanout-deadline',
+                        nargs='?',
+                        dest='fanout_deadline',
+                        default=None,
+                        type=float,
+                        help='Seconds after which a server that hasn\'t answered a broadcast counts as failed')
+    parser.add_argument('--workers',
+                        nargs='?',
+                        dest='workers',
+                        default=DEFAULT_WORKERS,
+                        type=int,
+                        help='Number of threads running background tasks')
+    parser.add_argument('--task-queue-size',
+                        nargs='?',
+                        dest='task_queue_size',
+                        default=DEFAULT_MAX_QUEUE,
+                        type=int,
+                        help='Maximum number of waiting background tasks before requests are slowed down')
     args = parser.parse_args()
     server_id = args.id
     server_ip = "10.1.0.{}".format(server_id)
     servers_list = args.srv_list.split(",")
 
     try:
+        peer_client = PeerClient(pool_size=args.peer_pool_size,
+                                 connect_timeout=args.connect_timeout,
+                                 read_timeout=args.read_timeout,
+                                 retries=args.retries,
+                                 retry_ratio=args.retry_ratio,
+                                 breaker_threshold=args.breaker_threshold,
+                                 breaker_reset=args.breaker_reset)
         server = Server(server_id,
                         server_ip,
-                        servers_list)
+                        servers_list,
+                        peer_client=peer_client,
+                        fan_out=FanOut(max_concurrency=args.fanout_concurrency,
+                                       deadline=args.fanout_deadline),
+                        worker_pool=WorkerPool(workers=args.workers,
+                                               max_queue=args.task_queue_size))
         bottle.run(server,
+                   server=SERVER_MODES[args.server_mode],
                    host=server_ip,
-                   port=PORT)
+                   port=PORT,
+                   pool_size=args.server_threads)
     except Exception as e:
         print("[ERROR] " + str(e))
 